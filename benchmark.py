@@ -0,0 +1,323 @@
+import os
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import argparse
+from bisect import bisect
+
+from metrics import get_peak_memory
+
+
+RANKS = ["phylum", "class", "order", "family", "genus", "species"]
+# Number of child taxa per taxon in the synthetic taxonomy.
+FANOUT = 3
+QC_HEADER = "filename,read_id,barcode,run_id,channel,start_time,seqlen,mean_qscore\n"
+CLASSIFICATION_HEADER = "filename,read_id,status,name,taxid,barcode,accuracy,lca\n"
+# Layout of the WIMP files without _2 in the name, taxid 2, accuracy 3 and lca 8.
+WIMP_HEADER = "filename,read_id,taxid,accuracy,name,barcode,status,species,lca\n"
+
+
+def parse_args(args=None):
+    """Parse the command line arguments.
+
+    Keyword Arguments:
+        args: List of arguments, sys.argv is used if None. (default: {None})
+
+    Returns:
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark otu.py (Python 3) or csv_nanopore.py (Python 2) on synthetic "
+                    "EPI2ME csv files and a synthetic taxa.sqlite database.")
+    parser.add_argument("script", choices=["otu", "nanopore"], help="The script to benchmark")
+    parser.add_argument("-n", "--reads", type=int, default=100000,
+                        help="Number of reads per file (default: 100000)")
+    parser.add_argument("-f", "--files", type=int, default=2, help="Number of files (default: 2)")
+    parser.add_argument("-b", "--barcodes", type=int, default=12,
+                        help="Number of barcodes (default: 12)")
+    parser.add_argument("-t", "--taxa", type=int, default=500,
+                        help="Number of species in the taxonomy (default: 500)")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes of otu.py (default: 1)")
+    parser.add_argument("-c", "--columnar", action="store_true",
+                        help="Use the columnar csv reader, requires pyarrow")
+    parser.add_argument("-r", "--rank", default="6", help="Rank of csv_nanopore.py (default: 6)")
+    parser.add_argument("-d", "--workdir",
+                        help="Folder for the synthetic data and the tables, a temporary folder "
+                             "that is removed afterwards if not given")
+    return parser.parse_args(args)
+
+
+def make_taxadb(filename, species):
+    """Create a small taxa.sqlite database with the schema of ete's NCBITaxa.
+
+    Every taxon has FANOUT child taxa, from phylum down to species. Every
+    third species name has a strain suffix.
+
+    Arguments:
+        filename: The database file.
+        species: Number of species.
+
+    Returns:
+        List with the taxonomy IDs of all genera and species.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    db = sqlite3.connect(filename)
+    db.executescript(
+        'CREATE TABLE stats (version INT PRIMARY KEY);'
+        'CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, '
+        'common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);'
+        'CREATE TABLE synonym (taxid INT, spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));'
+        'CREATE TABLE merged (taxid_old INT, taxid_new INT);'
+        'CREATE INDEX spname1 ON species (spname COLLATE NOCASE);'
+        'CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);'
+        'INSERT INTO stats VALUES (2);')
+    counts = [species]
+    for dummyrank in RANKS[:-1]:
+        counts.insert(0, (counts[0] + FANOUT - 1) // FANOUT)
+    rows = [(1, 1, "root", "", "no rank", "1"), (2, 1, "Bacteria", "", "superkingdom", "2,1")]
+    tracks = ["2,1"]
+    names = [""]
+    taxid = 10
+    leaves = []
+    for rank, count in zip(RANKS, counts):
+        level_tracks = []
+        level_names = []
+        for i in range(count):
+            parent = i // FANOUT if rank != "phylum" else 0
+            if rank == "species":
+                name = names[parent] + " sp" + str(i)
+                if i % 3 == 2:
+                    name += " strain X"
+            else:
+                name = rank.capitalize() + str(i)
+            track = str(taxid) + "," + tracks[parent]
+            rows.append((taxid, int(tracks[parent].split(',')[0]), name, "", rank, track))
+            level_tracks.append(track)
+            level_names.append(name)
+            if rank in ("genus", "species"):
+                leaves.append(taxid)
+            taxid += 1
+        tracks = level_tracks
+        names = level_names
+    db.executemany('INSERT INTO species VALUES (?, ?, ?, ?, ?, ?);', rows)
+    db.commit()
+    db.close()
+    return leaves
+
+
+def make_files(folder, script, reads, files, barcodes, taxids, seed):
+    """Write synthetic EPI2ME csv files.
+
+    For otu.py a QC file and a classification file with the same name are
+    written per run. For csv_nanopore.py half of the files use the layout
+    of files with _2 in the name and half the older WIMP layout. Taxa are
+    drawn with a Zipf distribution, so a few taxa have most of the reads.
+
+    Arguments:
+        folder: Folder for the csv files.
+        script: otu or nanopore.
+        reads: Number of reads per file.
+        files: Number of files.
+        barcodes: Number of barcodes.
+        taxids: Taxonomy IDs the reads are classified as.
+        seed: Random seed.
+
+    Returns:
+        Dictionary with the folders of the qc, classification or nanopore files.
+    """
+    rng = random.Random(seed)
+    barcode_names = ["BC{:02d}".format(i + 1) for i in range(barcodes)]
+    cumulative = []
+    total = 0.0
+    for i in range(len(taxids)):
+        total += 1.0 / (i + 1)
+        cumulative.append(total)
+    folders = dict((name, os.path.join(folder, name)) for name in (
+        ["qc", "classification"] if script == "otu" else ["nanopore"]))
+    for path in folders.values():
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    for number in range(files):
+        if script == "otu":
+            name = "run_{}.csv".format(number + 1)
+            qc = open(os.path.join(folders["qc"], name), 'w')
+            qc.write(QC_HEADER)
+            classification = open(os.path.join(folders["classification"], name), 'w')
+            classification.write(CLASSIFICATION_HEADER)
+        else:
+            name = "run_{}{}.csv".format(number + 1, "_2" if number % 2 == 0 else "")
+            qc = None
+            classification = open(os.path.join(folders["nanopore"], name), 'w')
+            classification.write(CLASSIFICATION_HEADER if "_2" in name else WIMP_HEADER)
+        qclines = []
+        lines = []
+        for dummyread in range(reads):
+            read_id = "{:032x}".format(rng.getrandbits(128))
+            read_id = "-".join((read_id[:8], read_id[8:12], read_id[12:16], read_id[16:20], read_id[20:]))
+            barcode = "NA" if rng.random() < 0.05 else barcode_names[rng.randrange(barcodes)]
+            taxid = taxids[bisect(cumulative, rng.random() * total)]
+            accuracy = "{:.2f}".format(rng.uniform(70, 100))
+            status = "Classification successful" if rng.random() < 0.95 else "Classification failed"
+            lca = rng.choice("0012")
+            if qc is not None:
+                qclines.append("reads.fastq,{},{},run,1,0,{},{:.2f}\n".format(
+                    read_id, barcode, rng.randint(1300, 1800), rng.uniform(5, 14)))
+            if "_2" in name or script == "otu":
+                lines.append("reads.fastq,{},{},name,{},{},{},{}\n".format(
+                    read_id, status, taxid, barcode, accuracy, lca))
+            else:
+                lines.append("reads.fastq,{},{},{},name,{},{},species,{}\n".format(
+                    read_id, taxid, accuracy, barcode, status, lca))
+        if qc is not None:
+            qc.write("".join(qclines))
+            qc.close()
+        classification.write("".join(lines))
+        classification.close()
+    return folders
+
+
+class Stages(object):
+    """Time the stages of a benchmark and record the peak memory use after every stage."""
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, name, rows, function, *args):
+        """Run and time a stage.
+
+        Arguments:
+            name: Name of the stage.
+            rows: Number of rows, i.e. csv lines or taxa, handled by the stage.
+            function: The function to run.
+            *args: The arguments of the function.
+
+        Returns:
+            The result of the function.
+        """
+        start = time.time()
+        result = function(*args)
+        self.add(name, rows, time.time() - start)
+        return result
+
+    def add(self, name, rows, seconds):
+        """Add a stage that is timed separately."""
+        self.results.append((name, rows, seconds, get_peak_memory()))
+
+    def report(self):
+        """Print the duration, rows per second and peak memory use of all stages."""
+        print("{:<22}{:>12}{:>10}{:>14}{:>10}".format("stage", "rows", "seconds", "rows/s", "peak MB"))
+        for name, rows, seconds, memory in self.results:
+            print("{:<22}{:>12}{:>10.2f}{:>14.0f}{:>10}".format(
+                name, rows, seconds, rows / seconds if seconds else 0,
+                "unknown" if memory is None else "{:.1f}".format(memory)))
+
+
+def benchmark_otu(args, folders, taxadb, output_dir, stages):
+    """Time the stages of otu.py.
+
+    Arguments:
+        args: The parsed arguments.
+        folders: Dictionary with the folders of the qc and classification files.
+        taxadb: The synthetic taxa.sqlite database.
+        output_dir: Folder for the OTU tables.
+        stages: The Stages of the benchmark.
+    """
+    import otu
+    from taxonomy import TaxonomyResolver
+    otu.ncbi = otu.NCBITaxa(dbfile=taxadb)
+    otu.taxonomy = TaxonomyResolver(otu.ncbi)
+    otu.configure((folders["classification"], folders["qc"]), (7, 80),
+                  ["BC{:02d}".format(i + 1) for i in range(args.barcodes)],
+                  workers=args.workers, use_columnar=args.columnar, output_dir=output_dir)
+    otu.progress = False
+    rows = args.reads * args.files
+    otu.ok_read_ids, otu.barcode_dict = stages.run("qc filter", rows, otu.read_basecalling_qc)
+    results = stages.run("classification scan", rows, lambda: list(
+        otu.map_files(otu.scan_classification_file, otu.onlyfiles)))
+    taxids = set()
+    for barcodecounts, species, dummystats in results:
+        taxids.update(species)
+        for taxcounter in barcodecounts.values():
+            taxids.update(taxcounter)
+    stages.run("taxonomy", len(taxids), lambda: (
+        otu.get_taxonomy().get_lineage_table(taxids, otu.searchrank),
+        [otu.get_taxon_name(taxid) for taxid in taxids]))
+    stages.run("table writing", len(taxids), otu.make_otu_table, list(zip(otu.onlyfiles, results)))
+
+
+def benchmark_nanopore(args, folders, taxadb, output_dir, stages):
+    """Time the stages of csv_nanopore.py.
+
+    The counting stage is the time of read_csv without the taxonomy
+    lookups and the table writing.
+
+    Arguments:
+        args: The parsed arguments.
+        folders: Dictionary with the folder of the nanopore files.
+        taxadb: The synthetic taxa.sqlite database.
+        output_dir: Folder for the tables.
+        stages: The Stages of the benchmark.
+    """
+    import csv_nanopore
+    from taxonomy import TaxonomyResolver
+    csv_nanopore.ncbi = csv_nanopore.NCBITaxa(dbfile=taxadb)
+    csv_nanopore.taxonomy = TaxonomyResolver(csv_nanopore.ncbi)
+    timings = {}
+
+    def timed(owner, name):
+        function = getattr(owner, name)
+
+        def wrapper(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                timings[name] = timings.get(name, 0) + time.time() - start
+        setattr(owner, name, wrapper)
+
+    timed(csv_nanopore.taxonomy, "get_lineage_table")
+    timed(csv_nanopore, "make_rank_csv")
+    start = time.time()
+    table = csv_nanopore.build_rank_table(folders["nanopore"], args.rank, args.columnar, output_dir)
+    total = time.time() - start
+    stages.add("counting", args.reads * args.files,
+               total - timings["get_lineage_table"] - timings["make_rank_csv"])
+    stages.add("taxonomy", len(table), timings["get_lineage_table"])
+    stages.add("table writing", len(table), timings["make_rank_csv"])
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="csvnanopore_benchmark_")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        start = time.time()
+        taxadb = os.path.join(workdir, "taxa.sqlite")
+        taxids = make_taxadb(taxadb, args.taxa)
+        folders = make_files(workdir, args.script, args.reads, args.files, args.barcodes, taxids,
+                             args.seed)
+        output_dir = os.path.join(workdir, "tables")
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        print("Generated {} files with {} reads in {:.1f} seconds".format(
+            args.files, args.reads, time.time() - start))
+        stages = Stages()
+        if args.script == "otu":
+            benchmark_otu(args, folders, taxadb, output_dir, stages)
+        else:
+            benchmark_nanopore(args, folders, taxadb, output_dir, stages)
+        print("")
+        stages.report()
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import pickle
+import sqlite3
+
+
+# Increase when the format of the stored results changes.
+CHECKPOINT_VERSION = 2
+
+
+def get_file_signature(filename):
+    """Get the size and modification time of a file.
+
+    Arguments:
+        filename: The file.
+
+    Returns:
+        The size and modification time in microseconds as a string.
+    """
+    stat = os.stat(filename)
+    return '{}:{}'.format(stat.st_size, int(stat.st_mtime * 1000000))
+
+
+class CheckpointStore(object):
+    """Persistent results of processed input files in a SQLite file.
+
+    Results are stored per kind and file path with a signature of the
+    file size, the modification time and the settings that were used.
+    A result is only returned if the signature did not change, so new
+    and changed files are processed again.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints ('
+                        'kind TEXT, path TEXT, signature TEXT, result BLOB, PRIMARY KEY (kind, path));')
+        self.db.commit()
+
+    @staticmethod
+    def signature(path, settings):
+        """Get the signature of a file and the settings used to process it.
+
+        Get the signature before the file is processed, a file that
+        changes while it is processed is processed again the next time.
+
+        Arguments:
+            path: The input file.
+            settings: Tuple with the settings the result depends on.
+
+        Returns:
+            The signature as a string.
+        """
+        return '{}:{}:{!r}'.format(CHECKPOINT_VERSION, get_file_signature(path), settings)
+
+    def get(self, kind, path, signature):
+        """Get the stored result of a file.
+
+        Arguments:
+            kind: The kind of result, e.g. qc or classification.
+            path: The input file.
+            signature: The current signature of the file.
+
+        Returns:
+            The result or None if there is no result with the same signature.
+        """
+        row = self.db.execute('SELECT result FROM checkpoints WHERE kind = ? AND path = ? AND signature = ?;',
+                              (kind, os.path.abspath(path), signature)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(bytes(row[0]))
+
+    def put(self, kind, path, signature, result):
+        """Store the result of a file, replacing the previous result.
+
+        Arguments:
+            kind: The kind of result, e.g. qc or classification.
+            path: The input file.
+            signature: The signature of the file before it was processed.
+            result: The result, any object that can be pickled.
+        """
+        self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?);', (
+            kind, os.path.abspath(path), signature,
+            sqlite3.Binary(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM checkpoints;').fetchone()[0]
+
+    def close(self):
+        """Close the checkpoint file."""
+        self.db.close()
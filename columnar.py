@@ -0,0 +1,314 @@
+from collections import Counter
+
+from compressed import is_compressed, open_csv
+from layouts import CLASSIFICATION_LAYOUT, QC_LAYOUT, read_layout
+from readids import ReadIdSet, chars_to_arrays
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    np = None
+    pa = None
+
+
+# Bytes of csv that are parsed per batch.
+BLOCK_SIZE = 1 << 24
+# Errors of the columnar readers after which a file is read with the line reader,
+# pyarrow raises NotImplementedError if it is built without a compression codec.
+READ_ERRORS = (ValueError, IOError, OSError, NotImplementedError)
+
+
+def available():
+    """Check if pyarrow and NumPy are installed for the columnar readers.
+
+    Both are imported together, pa is None if either is missing.
+    """
+    return pa is not None and np is not None
+
+
+def read_columns(filename, columns, block_size=BLOCK_SIZE, report=None, check_empty=False):
+    """Read selected columns of a csv file in batches.
+
+    Empty fields are read as missing values, "NA" is kept as a string.
+    pyarrow reads ahead of the batches, so the progress is reported from
+    the number of blocks that are parsed. pyarrow decompresses files
+    that end with .gz, .bz2 or .zst, the progress of those files is not known.
+
+    Arguments:
+        filename: The csv file to read, the first line is the header.
+        columns: Dictionary with column name and a tuple with the column
+            number and type, float64 or string.
+
+    Keyword Arguments:
+        block_size: Number of bytes per batch. (default: {BLOCK_SIZE})
+        report: Progress of the file or None. (default: {None})
+        check_empty: Also read the other columns and add a NumPy mask of
+            the rows with an empty field as empty, like the line readers
+            that skip these rows. (default: {False})
+
+    Returns:
+        Generator with a dictionary with column name and pyarrow array per batch.
+
+    Raises:
+        ValueError: If a line can not be parsed or a column can not be
+        converted to its type.
+        IOError: If the file can not be read or decompressed.
+    """
+    with open_csv(filename) as header:
+        column_names = ['column{}'.format(i) for i in range(len(header.readline().split(',')))]
+    types = {'float64': pa.float64(), 'string': pa.string()}
+    column_types = dict((column_names[number], types[dtype]) for number, dtype in columns.values())
+    if check_empty:
+        for name in column_names:
+            column_types.setdefault(name, pa.string())
+    reader = pacsv.open_csv(
+        filename,
+        read_options=pacsv.ReadOptions(
+            skip_rows=1, column_names=column_names, block_size=block_size),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=[name for name in column_names if name in column_types],
+            column_types=column_types, null_values=[''], strings_can_be_null=True))
+    compressed = is_compressed(filename)
+    rows = 0
+    for blocks, batch in enumerate(reader, 1):
+        arrays = dict((name, batch.column(batch.schema.get_field_index(column_names[number])))
+                      for name, (number, dtype) in columns.items())
+        if check_empty:
+            arrays['empty'] = ~is_valid(*batch.columns)
+        yield arrays
+        rows += batch.num_rows
+        if report is not None:
+            report.update(None if compressed else blocks * block_size, rows)
+    if report is not None:
+        report.finish(rows)
+
+
+def to_numpy(array):
+    """Convert a pyarrow float array to NumPy, missing values become NaN."""
+    return array.to_numpy(zero_copy_only=False)
+
+
+def is_valid(*arrays):
+    """Get a mask of the rows that have no missing values in all arrays."""
+    mask = np.ones(len(arrays[0]), dtype=bool)
+    for array in arrays:
+        if array.null_count:
+            mask &= array.is_valid().to_numpy(zero_copy_only=False)
+    return mask
+
+
+def equals(array, value):
+    """Get a mask of the rows of a string array that are equal to value."""
+    return pc.fill_null(pc.equal(array, value), False).to_numpy(zero_copy_only=False)
+
+
+def is_in(array, values):
+    """Get a mask of the rows of a string array that are in a list of values."""
+    return pc.fill_null(pc.is_in(array, value_set=pa.array(values, pa.string())), False).to_numpy(
+        zero_copy_only=False)
+
+
+def filter_array(array, mask):
+    """Select the rows of a pyarrow array with a NumPy mask."""
+    return array.filter(pa.array(mask))
+
+
+def read_id_arrays(array):
+    """Convert a pyarrow string array of read IDs to 128-bit integers.
+
+    The characters of read IDs with 36 characters are converted without
+    creating Python strings.
+
+    Arguments:
+        array: pyarrow string array with read IDs.
+
+    Returns:
+        Boolean array that is True for UUID read IDs.
+        Arrays with the upper and lower 64 bits of the UUID read IDs.
+        Dictionary with the row number and read ID of the other read IDs.
+    """
+    length36 = pc.fill_null(pc.equal(pc.binary_length(array), 36), False).to_numpy(zero_copy_only=False)
+    fixed = filter_array(array, length36).cast(pa.binary(36))
+    data = np.frombuffer(fixed.buffers()[1], dtype=np.uint8)
+    chars = data[fixed.offset * 36:(fixed.offset + len(fixed)) * 36].reshape(-1, 36)
+    hexvalid, hi, lo = chars_to_arrays(chars)
+    valid = length36.copy()
+    valid[valid] = hexvalid
+    others = {}
+    if not valid.all():
+        rows = np.nonzero(~valid)[0]
+        for row, read_id in zip(rows, filter_array(array, ~valid).to_pylist()):
+            others[row] = read_id
+    return valid, hi, lo, others
+
+
+def count_pairs(first, second):
+    """Count the combinations of a string array and an integer array.
+
+    Arguments:
+        first: pyarrow string array without missing values.
+        second: NumPy integer array with the same length.
+
+    Returns:
+        List of tuples with string, integer and count.
+    """
+    if not len(first):
+        return []
+    encoded = first.dictionary_encode()
+    codes = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    names = encoded.dictionary.to_pylist()
+    keys = second.astype(np.int64) * len(names) + codes
+    unique, counts = np.unique(keys, return_counts=True)
+    return [(names[key % len(names)], int(key // len(names)), int(count))
+            for key, count in zip(unique, counts)]
+
+
+def count_failed(stats, filters):
+    """Count the rows of a batch that failed each filter.
+
+    Arguments:
+        stats: Counter with the number of rows and the failed rows per filter.
+        filters: List with the filter name and the mask of the rows that
+            passed this filter and all filters before it.
+    """
+    rows = len(filters[0][1])
+    stats['rows'] += rows
+    for name, mask in filters:
+        passed = int(mask.sum())
+        stats[name] += rows - passed
+        rows = passed
+
+
+def filter_qc_file(filename, minqscore, minseqlen=1400, maxseqlen=1700, layout=None, report=None):
+    """Read a QC file and keep the reads that pass the filtering steps.
+
+    Arguments:
+        filename: The QC file.
+        minqscore: Minimum mean qscore per read.
+
+    Keyword Arguments:
+        minseqlen: Minimum read length. (default: {1400})
+        maxseqlen: Maximum read length. (default: {1700})
+        layout: Layout of the file, detected from the header if None. (default: {None})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A compact set of reads that passed the filtering steps.
+        A counter with the number of passed reads per barcode.
+        A counter with the number of rows and the rows that failed the
+        parse, barcode, seqlen and qscore filters.
+
+    Raises:
+        ValueError: If the header does not match the QC layout.
+    """
+    if layout is None:
+        layout = read_layout(filename, [QC_LAYOUT], QC_LAYOUT)
+    read_ids = ReadIdSet()
+    barcode_counter = Counter()
+    stats = Counter()
+    columns = {'read_id': (layout['read_id'], 'string'), 'barcode': (layout['barcode'], 'string'),
+               'seqlen': (layout['seqlen'], 'float64'), 'qscore': (layout['mean_qscore'], 'float64')}
+    for batch in read_columns(filename, columns, report=report, check_empty=True):
+        seqlen = to_numpy(batch['seqlen'])
+        qscore = to_numpy(batch['qscore'])
+        valid = ~batch['empty']
+        barcode = valid & ~equals(batch['barcode'], "NA")
+        length = barcode & (seqlen >= minseqlen) & (seqlen <= maxseqlen)
+        mask = length & (qscore >= minqscore)
+        count_failed(stats, [('parse', valid), ('barcode', barcode), ('seqlen', length), ('qscore', mask)])
+        dummyvalid, hi, lo, others = read_id_arrays(filter_array(batch['read_id'], mask))
+        read_ids.update_uuids(hi, lo)
+        read_ids.update(list(others.values()))
+        for item in pc.value_counts(filter_array(batch['barcode'], mask)).to_pylist():
+            barcode_counter[item['values']] += item['counts']
+    read_ids.freeze()
+    return read_ids, barcode_counter, stats
+
+
+def scan_classification_file(filename, barcodes, minaccuracy, ok_read_ids, layout=None, report=None):
+    """Count the reads per barcode and taxid in a classification file.
+
+    Arguments:
+        filename: The classification file.
+        barcodes: List of barcodes to count.
+        minaccuracy: Minimum accuracy per read.
+        ok_read_ids: ReadIdSet with the reads that passed the QC filtering.
+
+    Keyword Arguments:
+        layout: Layout of the file, detected from the header if None. (default: {None})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A dictionary with a counter of taxonomy IDs per barcode.
+        All taxonomy IDs that are classified successfully in the file.
+        A counter with the number of rows and the rows that failed the
+        parse, barcode, accuracy and qc filters.
+
+    Raises:
+        ValueError: If the header does not match the classification layout.
+    """
+    if layout is None:
+        layout = read_layout(filename, [CLASSIFICATION_LAYOUT], CLASSIFICATION_LAYOUT)
+    barcodecounts = dict((bc, Counter()) for bc in barcodes)
+    species = set()
+    stats = Counter()
+    columns = {'read_id': (layout['read_id'], 'string'), 'status': (layout['status'], 'string'),
+               'taxid': (layout['taxid'], 'float64'), 'barcode': (layout['barcode'], 'string'),
+               'accuracy': (layout['accuracy'], 'float64')}
+    for batch in read_columns(filename, columns, report=report):
+        # The filters are applied in the order of the line reader, an
+        # empty field only fails the parse filter if it is the accuracy or taxid.
+        batch['read_id'] = pc.fill_null(batch['read_id'], "")
+        batch['barcode'] = pc.fill_null(batch['barcode'], "")
+        taxid = to_numpy(batch['taxid'])
+        accuracy = to_numpy(batch['accuracy'])
+        barcode = ~equals(batch['barcode'], "NA")
+        complete = barcode & ~np.isnan(accuracy)
+        accurate = complete & (accuracy >= minaccuracy)
+        mask = accurate & ~np.isnan(taxid)
+        parsed = mask.copy()
+        valid, hi, lo, others = read_id_arrays(filter_array(batch['read_id'], mask))
+        passed = np.zeros(len(valid), dtype=bool)
+        passed[valid] = ok_read_ids.contains_uuids(hi, lo)
+        for row, read_id in others.items():
+            passed[row] = read_id in ok_read_ids
+        mask[mask] = passed
+        count_failed(stats, [('barcode', barcode), ('parse', complete), ('accuracy', accurate), ('parse', parsed),
+                             ('qc', mask)])
+        counted = mask & is_in(batch['barcode'], barcodes)
+        for barcode, counted_taxid, count in count_pairs(
+                filter_array(batch['barcode'], counted), taxid[counted]):
+            barcodecounts[barcode][counted_taxid] += count
+        successful = mask & equals(batch['status'], "Classification successful")
+        species.update(int(value) for value in np.unique(taxid[successful]))
+    return barcodecounts, species, stats
+
+
+def count_taxa(filename, layout, minaccuracy=80, report=None):
+    """Count the reads per taxid and LCA value in a WIMP csv file.
+
+    Arguments:
+        filename: The WIMP csv file.
+        layout: Layout of the file with the taxid, accuracy and lca
+            columns and the LCA values to count.
+
+    Keyword Arguments:
+        minaccuracy: Minimum accuracy per read. (default: {80})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A counter with (taxid, LCA value) and the number of reads.
+    """
+    taxcounter = Counter()
+    columns = {'taxid': (layout['taxid'], 'float64'), 'accuracy': (layout['accuracy'], 'float64'),
+               'lca': (layout['lca'], 'string')}
+    for batch in read_columns(filename, columns, report=report, check_empty=True):
+        taxid = to_numpy(batch['taxid'])
+        accuracy = to_numpy(batch['accuracy'])
+        mask = ~batch['empty'] & (accuracy >= minaccuracy) & is_in(batch['lca'], layout.lca_values)
+        for lca, counted_taxid, count in count_pairs(filter_array(batch['lca'], mask), taxid[mask]):
+            taxcounter[(counted_taxid, lca)] += count
+    return taxcounter
@@ -0,0 +1,203 @@
+import io
+import bz2
+import zlib
+import threading
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Extensions of the compressed csv files that are read while they are decompressed.
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.zst')
+CSV_EXTENSIONS = ('.csv',) + tuple('.csv' + extension for extension in COMPRESSED_EXTENSIONS)
+# Number of compressed bytes that are decompressed at once.
+CHUNK_SIZE = 1 << 20
+# Number of decompressed chunks the background thread can be ahead of the reader.
+QUEUE_SIZE = 8
+
+
+def is_compressed(filename):
+    """Check if a file is compressed with gzip, bzip2 or Zstandard, based on the extension."""
+    return filename.endswith(COMPRESSED_EXTENSIONS)
+
+
+def is_csv_file(filename, run=""):
+    """Check if a file is a csv file of a run, compressed or not.
+
+    Arguments:
+        filename: Name of the file.
+
+    Keyword Arguments:
+        run: Run number that is in the name before .csv, all runs if empty. (default: {""})
+
+    Returns:
+        True if the file can be read as csv file of the run.
+    """
+    return run + '.csv' in filename and filename.endswith(CSV_EXTENSIONS)
+
+
+def csv_name(filename):
+    """Get the name of a csv file without the compression extension, i.e. run_1.csv for run_1.csv.gz."""
+    for extension in COMPRESSED_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def get_decompressor(filename):
+    """Get the function that creates a decompressor for a compressed file.
+
+    Arguments:
+        filename: The compressed file.
+
+    Returns:
+        Function without arguments that returns a new decompressor.
+
+    Raises:
+        IOError: If the file is compressed with Zstandard and zstandard is not installed.
+    """
+    if filename.endswith('.gz'):
+        return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if filename.endswith('.bz2'):
+        return bz2.BZ2Decompressor
+    if zstandard is None:
+        raise IOError("zstandard is not installed, can not read " + filename)
+    return lambda: zstandard.ZstdDecompressor().decompressobj()
+
+
+def decompress(f, new_decompressor, chunk_size=CHUNK_SIZE):
+    """Decompress a file in chunks, files with more than one compressed stream are read completely.
+
+    Arguments:
+        f: The compressed file, opened in binary mode.
+        new_decompressor: Function that returns a new decompressor.
+
+    Keyword Arguments:
+        chunk_size: Number of compressed bytes per chunk. (default: {CHUNK_SIZE})
+
+    Returns:
+        Generator with the decompressed data and the number of compressed bytes that are read.
+    """
+    decompressor = new_decompressor()
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        while data:
+            if getattr(decompressor, 'eof', False):
+                decompressor = new_decompressor()
+            try:
+                chunk = decompressor.decompress(data)
+            except EOFError:
+                # The bz2 decompressor of Python 2 has no eof attribute.
+                decompressor = new_decompressor()
+                continue
+            if chunk:
+                yield chunk, f.tell()
+            data = decompressor.unused_data
+            if data:
+                decompressor = new_decompressor()
+
+
+class DecompressedStream(io.RawIOBase):
+    """Raw stream of a compressed file that is decompressed in a background thread.
+
+    zlib, bz2 and zstandard release the GIL while they decompress, so the
+    lines are parsed while the next chunks are decompressed. The number
+    of compressed bytes that are read is kept in position, for progress
+    reporting.
+    """
+
+    def __init__(self, filename, new_decompressor, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        io.RawIOBase.__init__(self)
+        self.filename = filename
+        self.position = 0
+        self.data = b''
+        self.offset = 0
+        self.done = False
+        self.stopped = False
+        self.queue = Queue(queue_size)
+        self.file = open(filename, 'rb')
+        self.thread = threading.Thread(target=self.run, args=(new_decompressor, chunk_size))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, new_decompressor, chunk_size):
+        """Decompress the file and put the chunks in the queue, None after the last chunk."""
+        try:
+            for item in decompress(self.file, new_decompressor, chunk_size):
+                if not self.put(item):
+                    return
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        """Put an item in the queue, waiting for space until the stream is closed.
+
+        Returns:
+            False if the stream is closed.
+        """
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.data):
+            if self.done:
+                return 0
+            item = self.queue.get()
+            if item is None:
+                self.done = True
+                return 0
+            if isinstance(item, Exception):
+                self.done = True
+                raise item
+            self.data, self.position = item
+            self.offset = 0
+        size = min(len(b), len(self.data) - self.offset)
+        b[:size] = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            self.thread.join()
+            self.file.close()
+        io.RawIOBase.close(self)
+
+
+def open_csv(filename):
+    """Open a csv file for reading lines, compressed files are decompressed while they are read.
+
+    Arguments:
+        filename: The csv file, compressed with gzip, bzip2 or Zstandard
+            if the name ends with .gz, .bz2 or .zst.
+
+    Returns:
+        The open file, in text mode on Python 3.
+
+    Raises:
+        IOError: If the file is compressed with Zstandard and zstandard is not installed.
+    """
+    if not is_compressed(filename):
+        return open(filename)
+    buffered = io.BufferedReader(DecompressedStream(filename, get_decompressor(filename)), CHUNK_SIZE)
+    if str is bytes:
+        return buffered
+    return io.TextIOWrapper(buffered)
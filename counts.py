@@ -0,0 +1,145 @@
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CountMatrix(object):
+    """Sparse matrix with read counts per taxon and sample.
+
+    Taxa and samples are indexed in the order they are added. Only the
+    non-zero counts are stored, one dictionary with sample index and
+    count per taxon, so an increment is O(1) and rows are always aligned
+    with the sample columns.
+    """
+
+    def __init__(self):
+        self.rows = OrderedDict()
+        self.columns = OrderedDict()
+        self.counts = []
+
+    def add_row(self, key):
+        """Add a taxon and return its row index."""
+        index = self.rows.get(key)
+        if index is None:
+            index = len(self.counts)
+            self.rows[key] = index
+            self.counts.append({})
+        return index
+
+    def add_column(self, sample):
+        """Add a sample and return its column index."""
+        index = self.columns.get(sample)
+        if index is None:
+            index = len(self.columns)
+            self.columns[sample] = index
+        return index
+
+    def add(self, key, sample, count=1):
+        """Add a count for a taxon in a sample.
+
+        Arguments:
+            key: The taxon, e.g. a taxonomy ID or name.
+            sample: The sample name.
+
+        Keyword Arguments:
+            count: The count to add. (default: {1})
+        """
+        row = self.counts[self.add_row(key)]
+        column = self.add_column(sample)
+        row[column] = row.get(column, 0) + count
+
+    def add_counts(self, sample, counter):
+        """Add all counts of a sample.
+
+        Arguments:
+            sample: The sample name.
+            counter: Dictionary with taxon and count.
+        """
+        column = self.add_column(sample)
+        for key, count in counter.items():
+            row = self.counts[self.add_row(key)]
+            row[column] = row.get(column, 0) + count
+
+    def merge(self, other):
+        """Add all taxa, samples and counts of another CountMatrix.
+
+        Arguments:
+            other: The CountMatrix to add.
+        """
+        columns = [self.add_column(sample) for sample in other.columns]
+        for key, index in other.rows.items():
+            row = self.counts[self.add_row(key)]
+            for column, count in other.counts[index].items():
+                row[columns[column]] = row.get(columns[column], 0) + count
+
+    def get(self, key, sample):
+        """Get the count of a taxon in a sample."""
+        if key not in self.rows or sample not in self.columns:
+            return 0
+        return self.counts[self.rows[key]].get(self.columns[sample], 0)
+
+    def row(self, key):
+        """Get the counts of a taxon for all samples in column order."""
+        counts = self.counts[self.rows[key]]
+        return [counts.get(column, 0) for column in range(len(self.columns))]
+
+    def items(self):
+        """Get the taxa and their counts for all samples in row order."""
+        return [(key, self.row(key)) for key in self.rows]
+
+    def samples(self):
+        """Get the sample names in column order."""
+        return list(self.columns)
+
+    def column_totals(self):
+        """Get the total count of every sample in column order."""
+        totals = [0] * len(self.columns)
+        for counts in self.counts:
+            for column, count in counts.items():
+                totals[column] += count
+        return totals
+
+    def percentages(self):
+        """Get the counts as percentages of the sample totals in row order.
+
+        Samples without counts get a percentage of 0. The division is
+        vectorized if NumPy is installed.
+
+        Returns:
+            List with a list of percentages per taxon.
+        """
+        totals = self.column_totals()
+        empty = [column for column, total in enumerate(totals) if total == 0]
+        if np is not None and self.rows:
+            divisor = np.array([total or 1 for total in totals], dtype=np.float64)
+            percentages = (100.0 * self.to_array() / divisor).tolist()
+        else:
+            percentages = [[100.0 * count / total if total else 0 for count, total in zip(row, totals)]
+                           for dummykey, row in self.items()]
+        for row in percentages:
+            for column in empty:
+                row[column] = 0
+        return percentages
+
+    def to_array(self):
+        """Get the counts as a dense NumPy array with a row per taxon.
+
+        Raises:
+            ImportError: If NumPy is not installed.
+        """
+        if np is None:
+            raise ImportError("NumPy is required for CountMatrix.to_array")
+        array = np.zeros((len(self.rows), len(self.columns)), dtype=np.int64)
+        for index, counts in enumerate(self.counts):
+            for column, count in counts.items():
+                array[index, column] = count
+        return array
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
@@ -1,24 +1,168 @@
 import os
 import sqlite3
 import csv
+import argparse
 from os import listdir
 from os.path import isfile, join
 from collections import Counter
-from collections import defaultdict
 from ete2 import NCBITaxa
+import columnar
+import tables
+from compressed import csv_name, is_csv_file, open_csv
+from counts import CountMatrix
+from layouts import CLASSIFICATION_LAYOUT, WIMP_LAYOUT, lca_parser, read_layout
+from progress import CHECK_ROWS, Progress, file_position
+from taxonomy import AnnotationCache, TaxonomyResolver
 
 
-d = defaultdict(list)
+d = CountMatrix()
 taxids = []
-mypath = raw_input("Enter path to csv files (i.e. /home/user/csv/files/): ")
-allfiles = [f for f in listdir(mypath) if isfile(join(mypath, f))]
-onlyfiles = [s for s in allfiles if '.csv' in s]
-filecount = len(onlyfiles)
-level = raw_input("1: phylum ----> 2: class ----> 3: order ----> 4: family ----> 5: genus ----> 6: species\nEnter rank number: ")
-ncbi = NCBITaxa()
+mypath = ""
+allfiles = []
+onlyfiles = []
+filecount = 0
+level = "6"
+use_columnar = False
+output_dir = ""
+formats = []
+ncbi = None
+taxonomy = None
 DEFAULT_TAXADB = os.path.join(os.environ.get('HOME', '/'), '.etetoolkit', 'taxa.sqlite')
 DB_VERSION = 2
 rank_dict = {"1": "phylum", "2": "class", "3": "order", "4": "family", "5": "genus", "6": "species"}
+ALL_RANKS = "all"
+
+
+def get_taxonomy():
+    """
+    Open the NCBI taxonomy database on first use.
+    The same resolver and its caches are used for all tables that are built in the process.
+    :return: The TaxonomyResolver
+    """
+    global ncbi, taxonomy
+    if taxonomy is None:
+        ncbi = NCBITaxa()
+        taxonomy = TaxonomyResolver(ncbi, annotations=AnnotationCache(dbfile=DEFAULT_TAXADB))
+    return taxonomy
+
+
+def get_input():
+    """
+    Ask the user for the path of the csv files, the rank and the csv reader.
+    :return: Path of the csv files, rank number and use the columnar csv reader or not
+    """
+    path = raw_input("Enter path to csv files (i.e. /home/user/csv/files/): ")
+    rank = raw_input("1: phylum ----> 2: class ----> 3: order ----> 4: family ----> 5: genus ----> 6: species\n"
+                     "Enter rank number or all: ")
+    columnar_reader = raw_input("Use the columnar csv reader, requires pyarrow (y/N): ").lower().startswith('y')
+    return path, rank, columnar_reader
+
+
+def parse_args(args=None):
+    """
+    Parse the command line arguments.
+    :param args: List of arguments, sys.argv is used if None
+    :return: The parsed arguments, the path is None if the settings should be entered interactively
+    """
+    parser = argparse.ArgumentParser(
+        description="Count the occurrence of a rank in the EPI2ME WIMP csv files. "
+                    "All settings are asked interactively if no path is given.")
+    parser.add_argument("path", nargs="?", help="Path of the csv files")
+    parser.add_argument("-r", "--rank", default="6",
+                        choices=sorted(rank_dict.keys()) + sorted(rank_dict.values()) + [ALL_RANKS],
+                        help="Rank number or name, all writes the tables of all ranks in one pass "
+                             "(default: 6, species)")
+    parser.add_argument("-c", "--columnar", action="store_true",
+                        help="Use the columnar csv reader, requires pyarrow")
+    parser.add_argument("-o", "--output-dir", default="",
+                        help="Folder for the output files (default: current folder)")
+    parser.add_argument("-f", "--format", dest="formats", action="append", choices=tables.FORMATS,
+                        help="Also write the tables in this sparse format, BIOM JSON, BIOM HDF5 "
+                             "(requires h5py), Parquet (requires pyarrow) or npz (requires NumPy). "
+                             "Can be used more than once")
+    parser.add_argument("-s", "--sample-order", metavar="SAMPLES",
+                        help="Order of the samples in the sorted file, a comma separated list or a file "
+                             "with one sample name per line (default: sorted by name)")
+    return parser.parse_args(args)
+
+
+def get_rank_number(rank):
+    """
+    Get the number of a rank as used in rank_dict.
+    :param rank: Rank number or name, i.e. 5 or genus
+    :return: The rank number
+    """
+    for number, name in rank_dict.iteritems():
+        if str(rank) in (number, name):
+            return number
+    raise KeyError(rank)
+
+
+def build_rank_table(path, rank, use_columnar=False, output_dir="", formats=None):
+    """
+    Count the occurrence of a rank in all csv files of a folder and write the count and percentage files.
+    The taxonomy database is opened once and reused by the following calls.
+    :param path: Path of the csv files
+    :param rank: Rank number or name, i.e. 5 or genus
+    :param use_columnar: Use the columnar csv reader
+    :param output_dir: Folder for the output files, the current folder if empty
+    :param formats: List of output formats that are written next to the csv files, biom, hdf5, parquet or npz
+    :return: CountMatrix with the counts per name and csv file
+    """
+    configure(path, get_rank_number(rank), use_columnar, output_dir, formats)
+    read_csv()
+    return d
+
+
+def build_all_rank_tables(path, use_columnar=False, output_dir="", formats=None):
+    """
+    Count the occurrence of all ranks in all csv files of a folder with one pass over the files.
+    The reads are counted per taxid and LCA value once, the lineages of the taxids are looked up once
+    for all ranks and the count and percentage files of every rank are written from the same counts.
+    :param path: Path of the csv files
+    :param use_columnar: Use the columnar csv reader
+    :param output_dir: Folder for the output files, the current folder if empty
+    :param formats: List of output formats that are written next to the csv files, biom, hdf5, parquet or npz
+    :return: Dictionary with the rank name and the CountMatrix with the counts per name and csv file
+    """
+    configure(path, "6", use_columnar, output_dir, formats)
+    filecounts = count_files()
+    lineage_table = get_lineage_table(filecounts, rank_dict.values())
+    rank_tables = {}
+    for number in sorted(rank_dict):
+        globals().update(level=number, d=CountMatrix())
+        print "Counting " + rank_dict[level] + "...\n"
+        make_rank_csv(count_rank(filecounts, lineage_table))
+        rank_tables[rank_dict[level]] = d
+    print "Finished\n"
+    return rank_tables
+
+
+def configure(path, level, use_columnar=False, output_dir="", formats=None):
+    """
+    Set the module settings used to build the rank tables.
+    :param path: Path of the csv files
+    :param level: Rank number as used in rank_dict
+    :param use_columnar: Use the columnar csv reader
+    :param output_dir: Folder for the output files, the current folder if empty
+    :param formats: List of output formats that are written next to the csv files, biom, hdf5, parquet or npz
+    :return:
+    """
+    if use_columnar and not columnar.available():
+        print "pyarrow is not installed, using the line reader."
+        use_columnar = False
+    formats = list(formats or [])
+    for fmt in list(formats):
+        requirement = tables.missing_requirement(fmt)
+        if requirement is not None:
+            print requirement + " is not installed, the " + fmt + " tables are not written."
+            formats.remove(fmt)
+    mypath = os.path.join(path, '')
+    allfiles = [f for f in listdir(mypath) if isfile(join(mypath, f))]
+    onlyfiles = [s for s in allfiles if is_csv_file(s)]
+    globals().update(
+        mypath=mypath, allfiles=allfiles, onlyfiles=onlyfiles, filecount=len(onlyfiles),
+        level=level, use_columnar=use_columnar, output_dir=output_dir, formats=formats, d=CountMatrix())
 
 
 def is_taxadb_up_to_date(dbfile=DEFAULT_TAXADB):
@@ -47,241 +191,271 @@ def get_desired_ranks(taxid, desired_ranks):
     :param desired_ranks:
     :return:
     """
-    lineage = ncbi.get_lineage(taxid)
-    names = ncbi.get_taxid_translator(lineage)
-    lineage2ranks = ncbi.get_rank(names)
-    ranks2lineage = dict((rank, taxid) for (taxid, rank) in lineage2ranks.items())
-    return{'{}_id'.format(rank): ranks2lineage.get(rank, '<not present>') for rank in desired_ranks}
+    return get_taxonomy().get_desired_ranks(taxid, desired_ranks)
+
+
+def get_lineage_ranks():
+    """
+    Get the ranks of the lineage of the rank entered by the user, from phylum to the rank itself.
+    :return: List with the rank names
+    """
+    return [rank_dict[number] for number in sorted(rank_dict) if number <= level]
+
+
+def get_rank_name(taxid, lca, rank_names):
+    """
+    Get the name of the rank entered by the user for a taxid.
+    :param taxid: Taxonomy ID from the csv file
+    :param lca: LCA value from the csv file that is added to the name
+    :param rank_names: Rank names in the lineage of the taxid
+    :return: Name of the rank or None if the rank is not found
+    """
+    if rank_dict[level] == "species":
+        tname = get_taxonomy().get_name(taxid)
+    else:
+        tname = rank_names.get(rank_dict[level])
+    if tname is None:
+        return None
+    name = ""
+    for nl in str(tname).split(" ")[:2]:
+        name += str(nl) + " "
+    return name + lca
 
 
 def read_csv():
     """
     Read the csv files and build lists with available taxids and occurance.
+    Reads are counted per taxid and LCA value, the names are looked up once per taxid.
     :return:
     """
-    count = 0
+    filecounts = count_files()
+    make_rank_csv(count_rank(filecounts, get_lineage_table(filecounts, get_lineage_ranks())))
+    print "Finished\n"
+
+
+def count_files():
+    """
+    Read the csv files and count the reads per taxid and LCA value.
+    The columns and LCA values are taken from the layout of the header of every file.
+    :return: List with a Counter of (taxid, LCA value) for every csv file
+    """
+    filecounts = []
     for csv in onlyfiles:
-        klist = []
-        taxnames = []
-        if "_2" in csv:
-            acc_column = 6
-            lca_column = 7
-            lca_data = ['0', '1']
-            taxid_column = 4
-        else:
-            acc_column = 3
-            lca_column = 8
-            lca_data = ['1', '2']
-            taxid_column = 2
-        with open(mypath + csv) as nf:
+        taxcounter = Counter()
+        # Files without a known header have the classification layout if the name has _2.
+        layout = read_layout(mypath + csv, [CLASSIFICATION_LAYOUT, WIMP_LAYOUT],
+                             CLASSIFICATION_LAYOUT if "_2" in csv else WIMP_LAYOUT)
+        parse_lca_line = lca_parser(layout)
+        if use_columnar:
+            try:
+                filecounts.append(columnar.count_taxa(
+                    mypath + csv, layout, report=Progress(csv, os.path.getsize(mypath + csv))))
+                continue
+            except columnar.READ_ERRORS:
+                print "Columnar reader failed on " + csv + ", using the line reader."
+        report = Progress(csv, os.path.getsize(mypath + csv))
+        with open_csv(mypath + csv) as nf:
             linenr = 0
             for line in nf:
-                if ',,' not in line:
-                    line = line.split(',')
-                    name = ""
-                    if linenr > 0:
-                        if float(line[acc_column]) >= 80 and line[lca_column].strip('\r\n') in lca_data:
-                            if rank_dict[level] == "species":
-                                taxid2name = ncbi.get_taxid_translator([int(line[taxid_column])])
-                                for dummytid, tname in taxid2name.iteritems():
-                                    namelist = str(tname).split(" ")[:2]
-                                for nl in namelist:
-                                    name += str(nl) + " "
-                                name += line[lca_column].strip('\r\n')
-                                taxnames.append(str(name))
-                            else:
-                                taxids = [line[taxid_column]]
-                                desired_ranks = [rank_dict[level]]
-                                for taxid in taxids:
-                                    ranks = get_desired_ranks(taxid, desired_ranks)
-                                    for dummykey, rank in ranks.items():
-                                        if rank != '<not present>':
-                                            taxid2name = ncbi.get_taxid_translator([int(rank)])
-                                            for dummytid, tname in taxid2name.iteritems():
-                                                namelist = str(tname).split(" ")[:2]
-                                            for nl in namelist:
-                                                name += str(nl) + " "
-                                            name += line[lca_column].strip('\r\n')
-                                            taxnames.append(str(name))
+                if linenr > 0:
+                    key = parse_lca_line(line)
+                    if key is not None:
+                        taxcounter[key] += 1
                 linenr += 1
-            # nf.close()
-            namecounter = Counter(taxnames)
-            for k, v in namecounter.iteritems():
-                if k not in d and count > 0:
-                    for dummyc in range(0, count):
-                        d[k].append(0)
-                d[k].append(v)
-                klist.append(k)
-            for dk, dummydv in d.iteritems():
-                if dk not in klist:
-                    d[dk].append(0)
-            count += 1
-            namecounter.clear()
-    for k, v in d.iteritems():
-        if len(d[k]) < len(onlyfiles):
-            d[k].append(0)
-    make_rank_csv()
-    print "Finished\n"
+                if not linenr % CHECK_ROWS:
+                    report.update(file_position(nf), linenr - 1)
+        report.finish(max(linenr - 1, 0))
+        filecounts.append(taxcounter)
+    return filecounts
+
+
+def get_lineage_table(filecounts, desired_ranks):
+    """
+    Get the names of the desired ranks in the lineages of all taxids in the csv files.
+    :param filecounts: List with a Counter of (taxid, LCA value) for every csv file
+    :param desired_ranks: The rank names to find in the lineages
+    :return: Dictionary with taxid and a dictionary with rank and name
+    """
+    taxids = set()
+    for taxcounter in filecounts:
+        taxids.update(taxid for taxid, dummylca in taxcounter)
+    return get_taxonomy().get_lineage_table(taxids, desired_ranks)
+
+
+def count_rank(filecounts, lineage_table):
+    """
+    Add the counts of the rank entered by the user to the CountMatrix, the names are looked up once
+    per taxid and LCA value.
+    :param filecounts: List with a Counter of (taxid, LCA value) for every csv file
+    :param lineage_table: Dictionary with taxid and a dictionary with rank and name
+    :return: Dictionary with the name of the rank and the names of the ranks in its lineage
+    """
+    rank_names = {}
+    for taxcounter in filecounts:
+        for key in taxcounter:
+            if key not in rank_names:
+                rank_names[key] = get_rank_name(key[0], key[1], lineage_table[key[0]])
+    lineage_ranks = get_lineage_ranks()
+    lineages = {}
+    for key, name in sorted(rank_names.iteritems()):
+        if name is not None and name not in lineages:
+            lineages[name] = [lineage_table[key[0]].get(rank, "NA") for rank in lineage_ranks]
+    for csv, taxcounter in zip(onlyfiles, filecounts):
+        namecounter = Counter()
+        for key, v in taxcounter.iteritems():
+            if rank_names[key] is not None:
+                namecounter[rank_names[key]] += v
+        d.add_counts(csv, namecounter)
+    return lineages
 
 
-def make_rank_csv():
+def make_rank_csv(lineages):
     """
     Create a new csv file based on the rank provided by the user.
     The WIMP csv files will be used as input and the rank will be searched using the NCBI taxid translator.
+    The SUM row and the percentages are calculated from the counts in memory.
+    :param lineages: Dictionary with the name of the rank and the names of the ranks in its lineage
     :return:
     """
     print "Creating csv file based on rank...\n"
-    with open(rank_dict[level] + '.csv', 'w') as tf:
-        tf.write(rank_dict[level] + ',')
-        i = 0
-        for s in onlyfiles:
-            if i < len(onlyfiles) - 1:
-                tf.write(s.strip(".csv") + ',')
-            else:
-                tf.write(s.strip(".csv"))
-            i += 1
-        tf.write('\n')
-        z = 0
-        for k in d.iteritems():
-            x = 0
-            line = ""
-            line += str(k[0])
-            line += ','
-            for v in k[1]:
-                line += str(v)
-                if x < len(onlyfiles) - 1:
-                    line += ','
-                x += 1
-            if z < len(d.items()) - 1:
-                line += '\n'
-            z += 1
-            tf.write(line)
-        total_line = "SUM"
-    for i in range(1, filecount + 1):
-        total = 0
-        cr = csv.reader(open(rank_dict[level] + '.csv'))
-        cr.next()
-        for row in cr:
-            try:
-                total += int(row[i])
-            except ValueError:
-                pass
-        total_line += ","
-        total_line += str(total)
-    with open(tf.name, 'a') as sfile:
-        sfile.write("\n")
-        sfile.write(total_line)
+    headers = [csv_name(s).strip(".csv") for s in onlyfiles]
+    totals = d.column_totals()
+    lines = [rank_dict[level] + ',' + ','.join(headers)]
+    for k, v in d.items():
+        lines.append(str(k) + ',' + ','.join(str(count) for count in v))
+    lines.append("SUM," + ','.join(str(total) for total in totals))
+    filename = rank_dict[level] + '.csv'
+    with open(os.path.join(output_dir, filename), 'w') as tf:
+        tf.write('\n'.join(lines))
     print tf.name + " created\n"
-    percentage_nanopore(tf.name)
+    rows = d.items()
+    rows.append(("SUM", totals))
+    percentages = d.percentages()
+    percentages.append([100.0 if total else 0 for total in totals])
+    percentage_nanopore(filename, headers, rows, percentages)
+    if formats:
+        prefixes = [os.path.join(output_dir, name) for name in (
+            rank_dict[level], "percentage_" + rank_dict[level], rank_dict[level])]
+        for name in tables.write_tables(formats, prefixes, d, list(d.rows), headers, get_lineage_ranks(),
+                                        lineages, "csv_nanopore.py"):
+            print name + " created"
 
 
-def percentage_nanopore(nanopore):
+def percentage_nanopore(nanopore, headers, rows, percentages):
     """
     Creates a file with the occurrence in percentages of all species or genera.
-    :param nanopore: Nanopore input file with rank (species or genera) and count
+    :param nanopore: Name of the nanopore output file with rank (species or genera) and count
+    :param headers: The sample names
+    :param rows: List with the name and the counts per sample, including the SUM row
+    :param percentages: List with the percentages per sample for every row
     :return:
     """
-    print "Reading ", nanopore, "..."
-    count = 0
-    output = "percentage_" + nanopore
-    with open(nanopore) as linecount:
-        for line in linecount:
-            count += 1
-    with open(nanopore) as last:
-        for i, l in enumerate(last):
-            if i == count-1:
-                sum_row = l.split(',')
-            else:
-                pass
+    output = os.path.join(output_dir, "percentage_" + nanopore)
     print "Writing ", output, "..."
+    lines = [rank_dict[level] + ',' + ''.join(h + '_#,' + h + '_%,' for h in headers) + '\n']
+    for (name, counts), row in zip(rows, percentages):
+        wline = str(name) + ','
+        for count, percentage in zip(counts, row):
+            wline += str(count) + ',' + str(percentage) + ','
+        lines.append(wline + '\n')
     with open(output, 'w') as perc_nano:
-        with open(nanopore) as nano:
-            ncount = 0
-            header = nano.readline()
-            samples = header.split(',')
-            for i, dummys in enumerate(samples):
-                if i > 0:
-                    perc_nano.write(samples[i].strip("\n").strip(".csv") + '_#,' + samples[i].strip("\n").strip(".csv") + '_%,')
-                elif i == 0:
-                    perc_nano.write(rank_dict[level] + ',')
-            perc_nano.write("\n")
-            sum_row.pop(0)
-            for line in nano:
-                if ncount < count:
-                    wline = ""
-                    sample = line.split(',')
-                    wline += sample[0].strip("\n").strip(".csv") + ','
-                    for x in range(0, len(samples)-1):
-                        percentage = float(100*float(sample[x + 1])/float(sum_row[x]))
-                        wline += sample[x + 1].strip("\n") + ',' + str(percentage) + ','
-                    perc_nano.write(wline)
-                    perc_nano.write("\n")
-                    ncount += 1
+        perc_nano.write(''.join(lines))
     print "Writing ", output, "... finished"
 
 
-def sort_file(ifilename, ofilename):
+def get_sample_order(samples):
+    """
+    Get the sample order of the sorted files.
+    :param samples: File with the sample names, one per line or comma separated, or a comma separated
+    list of sample names
+    :return: List of sample names
     """
-    Sorting the nanopore and/or illumina files based on the headers in the fieldnames list
-    :param ifilename: Name of the input file with the Nanopore or Illumina info
+    if os.path.isfile(samples):
+        with open(samples) as f:
+            samples = f.read().replace('\n', ',')
+    return [sample.strip() for sample in samples.split(',') if sample.strip()]
+
+
+def get_permutation(header, sample_order):
+    """
+    Get the column order of a percentage file with the samples in the sample order.
+    :param header: The header fields of the percentage file
+    :param sample_order: List of sample names, the samples that are not in the list are put after them
+    in the order of the file
+    :return: List with the column numbers of the sorted file and the samples of the order that are not
+    in the file
+    """
+    columns = dict((name, number) for number, name in enumerate(header))
+    samples = [name[:-2] for name in header[1:] if name.endswith('_#') and name[:-2] + '_%' in columns]
+    order = [sample for sample in sample_order if sample in samples]
+    missing = [sample for sample in sample_order if sample not in samples]
+    order.extend(sample for sample in samples if sample not in order)
+    permutation = [0]
+    for sample in order:
+        permutation.extend((columns[sample + '_#'], columns[sample + '_%']))
+    return permutation, missing
+
+
+def sort_file(ifilename, ofilename, sample_order=None):
+    """
+    Sort the columns of a percentage file by sample.
+    The rows are read one at a time and reordered with the column numbers of the header. The sorted
+    file is written to a temporary file first and replaces the output file, so it can be made again.
+    :param ifilename: Name of the percentage file with the Nanopore or Illumina info
     :param ofilename: The sorted output file
+    :param sample_order: List of sample names, the samples are sorted by name if None
     :return:
     """
-    ifilename = ifilename
-    ofilename = ofilename
-    with open(ifilename, 'r') as infile, open(ofilename, 'a') as outfile:
-        # output dict needs a list for new column ordering. Enter the column names in order.
-        fieldnames = [
-            '', 4371, '4371_2', 5013, 4278, '4278_2', 4322, '4322_2', 
-            6043, 4282, '4282_2', 6015, 5028, 5044, 5006, 4206, 4294, 
-            4364, '4364_2', 5136, 4198, 5408, 4343, '4343_2', 4195, 
-            5066, 4135, 4243, '4243_2', 4059, 6030, 5418, 6026, 5164, 
-            4395, 4233, 6119, 4356, '4356_2', 5001, 5145, 4186, 6003, 
-            4124, 4323, '4323_2', 5082, 4043, 5411, 6036, 6045, 4187,
-            4185, 5168, 5027, 4280, '4280_2', 6020, 5421, 5186, 6107,
-            6009, 6019, 5067, 5417, 4179, 5204, 6014, 5103, 6334, 5032,
-            5163, 5304, 5425, 6035, 4306, '4306_2', 5306, 5015, 6049,
-            6010, 6074, 'EC01', 'C1', 'C15'
-        ]
-        # fieldnames = [
-        #     '', 4371, 5013, 4278, 4322, 6043, 4282, 6015, 
-        #     5028, 5044, 5006, 4206, 4294, 4364, 5136, 4198, 
-        #     5408, 4343, 4195, 5066, 4135, 4243, 4059, 6030, 
-        #     5418, 6026, 5164, 4395, 4233, 6119, 4356, 5001, 
-        #     5145, 4186, 6003, 4124, 4323, 5082, 4043, 5411, 
-        #     6036, 6045, 4187, 4185, 5168, 5027, 4280, 6020, 
-        #     5421, 5186, 6107, 6009, 6019, 5067, 5417, 4179, 
-        #     5204, 6014, 5103, 6334, 5032,5163, 5304, 5425, 
-        #     6035, 4306, 5306, 5015, 6049, 6010, 6074, 
-        #     'EC01', 'C1', 'C15'
-        # ]
-        fields = [rank_dict[level]]
-        for fn in fieldnames:
-            if fn != "":
-                fields.append(str(fn) + '_#')
-                fields.append(str(fn) + '_%')
-            else:
-                fields.append(str(fn))
-        writer = csv.DictWriter(outfile, fieldnames=fields, delimiter=',')
-        # reorder the header first
-        writer.writeheader()
-        for row in csv.DictReader(infile):
-            # writes the reordered rows to the new file
-            writer.writerow(row)
+    tmpfile = ofilename + '.tmp'
+    with open(ifilename, 'rb') as infile, open(tmpfile, 'wb') as outfile:
+        reader = csv.reader(infile)
+        header = next(reader)
+        if sample_order is None:
+            sample_order = sorted(name[:-2] for name in header[1:] if name.endswith('_#'))
+        permutation, missing = get_permutation(header, sample_order)
+        if missing:
+            print "Samples not found in " + ifilename + ": " + ", ".join(missing)
+        get_columns = lambda row: [row[i] for i in permutation]
+        writer = csv.writer(outfile, lineterminator='\n')
+        writer.writerow(get_columns(header))
+        for row in reader:
+            writer.writerow(get_columns(row))
+    os.rename(tmpfile, ofilename)
+    print ofilename + " created\n"
 
 
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        if is_taxadb_up_to_date(DEFAULT_TAXADB):
+        if args.path is None:
+            mypath, level, use_columnar = get_input()
+        else:
+            mypath, level, use_columnar, output_dir, formats = (
+                args.path, args.rank, args.columnar, args.output_dir, args.formats)
+        sample_order = get_sample_order(args.sample_order) if args.sample_order else None
+        if level == ALL_RANKS:
+            levels = sorted(rank_dict)
+        else:
+            level = get_rank_number(level)
+            levels = [level]
+        if is_taxadb_up_to_date(DEFAULT_TAXADB) and len(levels) > 1:
+            print "Getting all ranks from csv files and NCBI...\n"
+            build_all_rank_tables(mypath, use_columnar, output_dir, formats)
+            get_taxonomy().print_cache_info()
+            for level in levels:
+                sort_file(os.path.join(output_dir, "percentage_" + rank_dict[level] + ".csv"),
+                          os.path.join(output_dir, rank_dict[level] + "_sorted.csv"), sample_order)
+        elif is_taxadb_up_to_date(DEFAULT_TAXADB):
             if rank_dict[level] not in ["species"]:
                 print "Getting " + rank_dict[level] + " names from NCBI...\n"
             else:
                 print "Getting " + rank_dict[level] + " from csv files...\n"
-            read_csv()
-            # Add the input and output file to sort the csv.
-            sort_file("percentage_" + rank_dict[level] + ".csv", rank_dict[level] + "_sorted.csv")
+            build_rank_table(mypath, level, use_columnar, output_dir, formats)
+            get_taxonomy().print_cache_info()
+            sort_file(os.path.join(output_dir, "percentage_" + rank_dict[level] + ".csv"),
+                      os.path.join(output_dir, rank_dict[level] + "_sorted.csv"), sample_order)
         else:
             print "Taxonomy database is updating...\n"
-            ncbi.update_taxonomy_database()
+            get_taxonomy().ncbi.update_taxonomy_database()
     except KeyError:
         print "Please enter one of the options."
@@ -0,0 +1,233 @@
+from compressed import open_csv
+
+
+# Names of the fields in the header of the EPI2ME csv files, in lower case.
+FIELD_NAMES = {
+    'read_id': ('read_id', 'readid'),
+    'status': ('status', 'exit_status'),
+    'taxid': ('taxid', 'tax_id'),
+    'barcode': ('barcode',),
+    'accuracy': ('accuracy',),
+    'lca': ('lca',),
+    'seqlen': ('seqlen', 'sequence_length_template'),
+    'mean_qscore': ('mean_qscore', 'mean_qscore_template')}
+SUCCESSFUL = "Classification successful"
+
+
+class Layout(object):
+    """Column numbers of the fields of an EPI2ME csv file.
+
+    The column numbers are those of the files without a known header,
+    the columns of a file with a header are found by name in any order.
+    """
+
+    def __init__(self, name, columns, optional=(), lca_values=()):
+        self.name = name
+        self.columns = dict(columns)
+        self.optional = list(optional)
+        self.lca_values = list(lca_values)
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __repr__(self):
+        return "Layout({!r}, {!r})".format(self.name, self.columns)
+
+    def fields(self):
+        """Get the fields in column order."""
+        return sorted(self.columns, key=self.columns.get)
+
+    def maxsplit(self, fields):
+        """Get the number of splits of a line that give all fields without the rest of the line."""
+        return max(self.columns[field] for field in fields) + 1
+
+    def match(self, names):
+        """Get the layout of a file with this layout and a header.
+
+        Arguments:
+            names: Dictionary with the lower case header names and column numbers.
+
+        Returns:
+            A new Layout with the column numbers of the header, None if a
+            field is missing.
+        """
+        columns = {}
+        for field in self.fields():
+            for name in FIELD_NAMES[field]:
+                if name in names:
+                    columns[field] = names[name]
+                    break
+            else:
+                if field not in self.optional:
+                    return None
+        return Layout(self.name, columns, self.optional, self.lca_values)
+
+
+QC_LAYOUT = Layout("qc", {'read_id': 1, 'barcode': 2, 'seqlen': 6, 'mean_qscore': 7})
+CLASSIFICATION_LAYOUT = Layout(
+    "classification", {'read_id': 1, 'status': 2, 'taxid': 4, 'barcode': 5, 'accuracy': 6, 'lca': 7},
+    optional=['lca'], lca_values=['0', '1'])
+WIMP_LAYOUT = Layout("wimp", {'read_id': 1, 'taxid': 2, 'accuracy': 3, 'lca': 8}, lca_values=['1', '2'])
+QC_FIELDS = ['read_id', 'barcode', 'seqlen', 'mean_qscore']
+CLASSIFICATION_FIELDS = ['read_id', 'status', 'taxid', 'barcode', 'accuracy']
+LCA_FIELDS = ['taxid', 'accuracy', 'lca']
+
+
+def detect_layout(header, layouts, default=None):
+    """Detect the layout of a csv file from the header.
+
+    Arguments:
+        header: The first line of the file.
+        layouts: List of possible layouts. The layout with the most fields
+            in the header is used, i.e. a classification file with an lca
+            column has the classification layout and not the WIMP layout.
+
+    Keyword Arguments:
+        default: Layout of files without any known field names in the header. (default: {None})
+
+    Returns:
+        The Layout with the column numbers of the header.
+
+    Raises:
+        ValueError: If the header does not match one of the layouts.
+    """
+    names = {}
+    for number, name in enumerate(header.rstrip('\r\n').split(',')):
+        names.setdefault(name.strip().strip('"').lower(), number)
+    best = None
+    for layout in layouts:
+        matched = layout.match(names)
+        if matched is not None and (best is None or len(matched.columns) > len(best.columns)):
+            best = matched
+    if best is not None:
+        return best
+    known = [name for aliases in FIELD_NAMES.values() for name in aliases if name in names]
+    if default is not None and not known:
+        return default
+    raise ValueError("The header does not match the " + " or ".join(layout.name for layout in layouts) +
+                     " layout: " + header.strip())
+
+
+def read_layout(filename, layouts, default=None):
+    """Detect the layout of a csv file from the header, see detect_layout.
+
+    Raises:
+        ValueError: If the header does not match one of the layouts.
+    """
+    with open_csv(filename) as f:
+        header = f.readline()
+    try:
+        return detect_layout(header, layouts, default)
+    except ValueError as e:
+        raise ValueError(filename + ": " + str(e))
+
+
+def qc_parser(layout, minqscore, minseqlen=1400, maxseqlen=1700):
+    """Get the function that parses and filters the lines of a QC file.
+
+    Arguments:
+        layout: Layout of the QC file.
+        minqscore: Minimum mean qscore per read.
+
+    Keyword Arguments:
+        minseqlen: Minimum read length. (default: {1400})
+        maxseqlen: Maximum read length. (default: {1700})
+
+    Returns:
+        Function that takes a line and returns the read ID, barcode and
+        mean qscore if the read passed, otherwise the name of the filter
+        that failed: parse, barcode, seqlen or qscore. Lines with an empty
+        field fail the parse filter.
+    """
+    read_id_column, barcode_column, seqlen_column, qscore_column = [layout[field] for field in QC_FIELDS]
+    maxsplit = layout.maxsplit(QC_FIELDS)
+
+    def parse_qc_line(line):
+        line = line.rstrip('\r\n')
+        if ',,' in line or line[:1] == ',' or line[-1:] == ',':
+            return 'parse'
+        content = line.split(',', maxsplit)
+        try:
+            barcode = content[barcode_column]
+            if barcode == "NA":
+                return 'barcode'
+            if not minseqlen <= int(content[seqlen_column]) <= maxseqlen:
+                return 'seqlen'
+            qscore = float(content[qscore_column])
+            if not qscore >= minqscore:
+                return 'qscore'
+            return content[read_id_column], barcode, qscore
+        except (IndexError, ValueError):
+            return 'parse'
+    return parse_qc_line
+
+
+def classification_parser(layout, minaccuracy):
+    """Get the function that parses and filters the lines of a classification file.
+
+    Arguments:
+        layout: Layout of the classification file.
+        minaccuracy: Minimum accuracy per read.
+
+    Returns:
+        Function that takes a line and returns the read ID, barcode,
+        taxonomy ID, if the classification was successful and the
+        accuracy, otherwise the name of the filter that failed: parse,
+        barcode or accuracy.
+    """
+    read_id_column, status_column, taxid_column, barcode_column, acc_column = [
+        layout[field] for field in CLASSIFICATION_FIELDS]
+    maxsplit = layout.maxsplit(CLASSIFICATION_FIELDS)
+
+    def parse_classification_line(line):
+        content = line.rstrip('\r\n').split(',', maxsplit)
+        try:
+            barcode = content[barcode_column]
+            if barcode == "NA":
+                return 'barcode'
+            accuracy = float(content[acc_column])
+            if not accuracy >= minaccuracy:
+                return 'accuracy'
+            return (content[read_id_column], barcode, int(content[taxid_column]),
+                    content[status_column] == SUCCESSFUL, accuracy)
+        except (IndexError, ValueError):
+            return 'parse'
+    return parse_classification_line
+
+
+def lca_parser(layout, minaccuracy=80):
+    """Get the function that parses the lines of a WIMP csv file.
+
+    Arguments:
+        layout: Layout of the WIMP csv file, with an lca field.
+
+    Keyword Arguments:
+        minaccuracy: Minimum accuracy per read. (default: {80})
+
+    Returns:
+        Function that takes a line and returns the taxonomy ID and LCA
+        value if the read is counted, otherwise None. Lines with an empty
+        field are not counted.
+
+    Raises:
+        ValueError: If the layout has no lca field.
+    """
+    if 'lca' not in layout:
+        raise ValueError("The " + layout.name + " layout has no lca column")
+    taxid_column, acc_column, lca_column = [layout[field] for field in LCA_FIELDS]
+    maxsplit = layout.maxsplit(LCA_FIELDS)
+    lca_values = layout.lca_values
+
+    def parse_lca_line(line):
+        line = line.rstrip('\r\n')
+        if ',,' in line or line[:1] == ',' or line[-1:] == ',':
+            return None
+        content = line.split(',', maxsplit)
+        lca = content[lca_column]
+        if float(content[acc_column]) >= minaccuracy and lca in lca_values:
+            return int(content[taxid_column]), lca
+        return None
+    return parse_lca_line
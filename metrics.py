@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def get_peak_memory():
+    """Get the peak memory use of the process in MB or None if it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss = maxrss / 1024.0
+    return round(maxrss / 1024.0, 1)
+
+
+def get_cpu_time():
+    """Get the user and system CPU time of the process and its finished child processes."""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def format_runtime(seconds):
+    """Format a duration as days, hours, minutes and seconds.
+
+    Arguments:
+        seconds: The duration in seconds.
+
+    Returns:
+        The duration, i.e. 1 h 2 m 3 s, without the leading zero parts.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days > 0:
+        return "{} d {} h {} m {} s".format(days, hours, minutes, seconds)
+    if hours > 0:
+        return "{} h {} m {} s".format(hours, minutes, seconds)
+    if minutes > 0:
+        return "{} m {} s".format(minutes, seconds)
+    return "{} seconds".format(seconds)
+
+
+def filter_counts(stats, filters):
+    """Summarize the rows that failed each filter.
+
+    Arguments:
+        stats: Counter with the number of rows and the number of rows
+            that failed each filter.
+        filters: The filters in the order they are applied.
+
+    Returns:
+        Dictionary with the rows, the failed rows per filter and the rows
+        that passed all filters.
+    """
+    failed = OrderedDict((name, stats[name]) for name in filters)
+    return OrderedDict([('rows', stats['rows']), ('failed', failed),
+                        ('passed', stats['rows'] - sum(failed.values()))])
+
+
+class RunMetrics(object):
+    """Wall time, CPU time, counts and peak memory use per stage of a run.
+
+    The metrics are written as JSON, so the throughput of runs can be
+    followed without parsing the printed output.
+    """
+
+    def __init__(self, **info):
+        self.start = time.time()
+        self.cpu = get_cpu_time()
+        self.info = OrderedDict(sorted(info.items()))
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage, the times of a stage that runs more than once are added up.
+
+        Arguments:
+            name: Name of the stage.
+
+        Returns:
+            Context manager with the dictionary of the stage, counts of the
+            stage can be added to it.
+        """
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = OrderedDict([('wall_seconds', 0.0), ('cpu_seconds', 0.0), ('peak_memory_mb', None)])
+            self.stages[name] = stage
+        wall = time.time()
+        cpu = get_cpu_time()
+        try:
+            yield stage
+        finally:
+            stage['wall_seconds'] += time.time() - wall
+            stage['cpu_seconds'] += get_cpu_time() - cpu
+            stage['peak_memory_mb'] = get_peak_memory()
+
+    def to_dict(self):
+        """Get all metrics with the rows per second of the stages that count rows."""
+        stages = OrderedDict()
+        for name, stage in self.stages.items():
+            stage = OrderedDict(stage)
+            rows = stage.get('rows')
+            if rows is not None and stage['wall_seconds'] > 0:
+                stage['rows_per_second'] = round(rows / stage['wall_seconds'], 1)
+            stage['wall_seconds'] = round(stage['wall_seconds'], 3)
+            stage['cpu_seconds'] = round(stage['cpu_seconds'], 3)
+            stages[name] = stage
+        return OrderedDict([
+            ('info', self.info),
+            ('wall_seconds', round(time.time() - self.start, 3)),
+            ('cpu_seconds', round(get_cpu_time() - self.cpu, 3)),
+            ('peak_memory_mb', get_peak_memory()),
+            ('stages', stages)])
+
+    def write(self, filename):
+        """Write the metrics to a JSON file.
+
+        Arguments:
+            filename: The JSON file.
+        """
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+        os.rename(tmpfile, filename)
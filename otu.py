@@ -1,33 +1,170 @@
 import os
-import sys
+import argparse
 import sqlite3
-import csv
-import re
-import random
 from os import listdir
 from os.path import isfile, join
 from collections import Counter
-from collections import defaultdict
 from collections import OrderedDict
 from ete3 import NCBITaxa
-from operator import itemgetter
-from datetime import datetime, date, time
+from datetime import datetime
+from time import sleep
+from multiprocessing import Pool
+import columnar
+import partials
+import rarefaction
+import scanner
+import sweep
+import tables
+from checkpoints import CheckpointStore, get_file_signature
+from compressed import csv_name, is_compressed, is_csv_file, open_csv
+from counts import CountMatrix
+from layouts import (CLASSIFICATION_LAYOUT, QC_LAYOUT, classification_parser, detect_layout, qc_parser,
+                     read_layout)
+from metrics import RunMetrics, filter_counts, format_runtime, get_peak_memory
+from progress import CHECK_ROWS, Progress, file_position
+from readids import ReadIdLevels, ReadIdSet, RUN_SIZE
+from tailing import FileTail
+from taxonomy import AnnotationCache, TaxonomyResolver
 
 
-d = defaultdict(list)
-ncbi = NCBITaxa()
+d = CountMatrix()
+workers = 1
+use_columnar = False
+progress = True
+output_dir = ""
+formats = []
+subsample_depth = None
+seed = 0
+rarefaction_points = 0
+run = ""
+checkpoints = None
+metrics = RunMetrics()
+ncbi = None
+taxonomy = None
 DEFAULT_TAXADB = os.path.join(os.environ.get(
     'HOME', '/'), '.etetoolkit', 'taxa.sqlite')
 DB_VERSION = 2
+DEFAULT_BARCODES = ["BC01", "BC02", "BC03", "BC04", "BC05", "BC06",
+                    "BC07", "BC08", "BC09", "BC10", "BC11", "BC12"]
+DEFAULT_SEARCHRANK = ["phylum", "class", "order", "family", "genus"]
+QC_FILTERS = ["parse", "barcode", "seqlen", "qscore"]
+CLASSIFICATION_FILTERS = ["parse", "barcode", "accuracy", "qc"]
+
+
+def get_taxonomy():
+    """Open the NCBI taxonomy database on first use.
+
+    The same resolver and its caches are used for all OTU tables
+    that are built in the process.
+
+    Returns:
+        The TaxonomyResolver.
+    """
+    global ncbi, taxonomy
+    if taxonomy is None:
+        ncbi = NCBITaxa()
+        taxonomy = TaxonomyResolver(ncbi, annotations=AnnotationCache(dbfile=DEFAULT_TAXADB))
+    return taxonomy
+
+
+def parse_args(args=None):
+    """Parse the command line arguments.
+
+    Keyword Arguments:
+        args: List of arguments, sys.argv is used if None. (default: {None})
+
+    Returns:
+        The parsed arguments, the paths are None if the settings
+        should be entered interactively.
+    """
+    parser = argparse.ArgumentParser(
+        description="Create OTU tables from the EPI2ME 16S classification and QC csv files. "
+                    "All settings are asked interactively if no paths are given.")
+    parser.add_argument("classification", nargs="?", help="Path of the classification files")
+    parser.add_argument("qc", nargs="?", help="Path of the QC files")
+    parser.add_argument("-r", "--run", default="",
+                        help="Run number, all runs in the folder are used if empty")
+    parser.add_argument("-q", "--min-qscore", type=int, default=7,
+                        help="Minimum mean qscore per read (default: 7)")
+    parser.add_argument("-a", "--min-accuracy", type=int, default=80,
+                        help="Minimum accuracy per read (default: 80)")
+    parser.add_argument("-b", "--barcodes", default=",".join(DEFAULT_BARCODES),
+                        help="Comma seperated list of barcodes (default: BC01 to BC12)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes (default: 1)")
+    parser.add_argument("-c", "--columnar", action="store_true",
+                        help="Use the columnar csv reader, requires pyarrow")
+    parser.add_argument("-o", "--output-dir", default="",
+                        help="Folder for the OTU tables (default: current folder)")
+    parser.add_argument("-W", "--watch", type=float, metavar="SECONDS",
+                        help="Follow the growing files of a running sequencing run and "
+                             "rewrite the OTU tables every SECONDS seconds until interrupted")
+    parser.add_argument("-s", "--checkpoint",
+                        help="SQLite file with the results per input file, unchanged files are "
+                             "not read again and an interrupted run continues where it stopped")
+    parser.add_argument("--sweep-qscore", metavar="QSCORES",
+                        help="Comma seperated list of minimum qscores, the tables of all combinations "
+                             "with the minimum accuracies are made in one pass")
+    parser.add_argument("--sweep-accuracy", metavar="ACCURACIES",
+                        help="Comma seperated list of minimum accuracies, the tables of all "
+                             "combinations with the minimum qscores are made in one pass")
+    parser.add_argument("--map", metavar="PARTIAL",
+                        help="Write the counts of the files to a partial result file instead of the "
+                             "OTU tables, the partial results are merged with --reduce")
+    parser.add_argument("--shard", metavar="NUMBER/COUNT",
+                        help="With --map, only use every COUNT-th file of the files sorted by name, "
+                             "starting with file NUMBER counted from 0")
+    parser.add_argument("--reduce", nargs="+", metavar="PARTIAL",
+                        help="Merge partial result files of --map and write the OTU tables, the "
+                             "classification and QC paths are not used")
+    parser.add_argument("-n", "--subsample", type=int, metavar="DEPTH",
+                        help="Subsample every sample to DEPTH reads, samples with less reads are kept")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the subsampling (default: 0)")
+    parser.add_argument("-R", "--rarefaction", type=int, default=0, metavar="POINTS",
+                        help="Write the rarefaction curves of all samples at POINTS depths to "
+                             "otu_rarefaction.csv")
+    parser.add_argument("-f", "--format", dest="formats", action="append", choices=tables.FORMATS,
+                        help="Also write the tables in this sparse format, BIOM JSON, BIOM HDF5 "
+                             "(requires h5py), Parquet (requires pyarrow) or npz (requires NumPy). "
+                             "Can be used more than once")
+    args = parser.parse_args(args)
+    if (args.classification is None) != (args.qc is None):
+        parser.error("Enter both the classification and the QC path.")
+    if args.map and args.classification is None:
+        parser.error("Enter the classification and the QC path of the files to map.")
+    if args.watch is not None and not args.watch > 0:
+        parser.error("The --watch interval must be more than 0 seconds.")
+    if args.shard is not None and not args.map:
+        parser.error("--shard can only be used with --map.")
+    if args.map and (args.sweep_qscore or args.sweep_accuracy or args.watch is not None):
+        parser.error("--map can not be used with --sweep-qscore, --sweep-accuracy or --watch.")
+    if args.sweep_qscore or args.sweep_accuracy:
+        if args.columnar or args.checkpoint:
+            parser.error("--sweep-qscore and --sweep-accuracy can not be used with --columnar or "
+                         "--checkpoint.")
+    elif args.watch is not None and (args.columnar or args.checkpoint):
+        parser.error("--watch can not be used with --columnar or --checkpoint.")
+    if args.shard is not None:
+        try:
+            number, count = [int(value) for value in args.shard.split('/')]
+        except ValueError:
+            parser.error("Enter the shard as NUMBER/COUNT, i.e. 0/4.")
+        if not 0 <= number < count:
+            parser.error("The shard number must be at least 0 and less than the number of shards.")
+        args.shard = (number, count)
+    return args
 
 
 def get_input():
     """Get all user input and return all files and settings.
     
     Returns:
-        Filepaths and all QC and classification files.
-        Searchranks that will be added to the OTU table.
-        Minimum qscore used for filtering the reads.
+        Paths of the classification and QC files.
+        Run number that is used to select the files.
+        Minimum qscore and accuracy used for filtering the reads.
+        Barcodes that are added to the OTU table.
+        Number of worker processes used to read the files.
+        Use the columnar csv reader or not.
     """
     while True:
         mypath = input("Enter classification files path: ")
@@ -36,20 +173,509 @@ def get_input():
         minqscore = input("Please enter the minimun qc score per read: ")
         minaccuracy = input("Please enter the minimun accuracy per read: ")
         barcodeinput = input("Enter a list of barcodes (comma seperated): ")
+        workersinput = input("Enter the number of worker processes (leave empty for 1): ")
+        workers = int(workersinput) if workersinput.isdigit() and int(workersinput) > 0 else 1
+        columnarinput = input("Use the columnar csv reader, requires pyarrow (y/N): ")
+        use_columnar = columnarinput.lower().startswith('y')
         if barcodeinput == "":
-            # Default barcodes
-            barcodes = ["BC01", "BC02", "BC03", "BC04", "BC05", "BC06",
-                        "BC07", "BC08", "BC09", "BC10", "BC11", "BC12"]
+            barcodes = DEFAULT_BARCODES
         else:
             barcodes = barcodeinput.split(',')
         if mypath == "" or mypathqc == "" or minqscore == "":
             print("Invalid input.")
             get_input()
         else:
-            qcfiles = [f for f in listdir(mypathqc) if isfile(join(mypathqc, f))]
-            onlyfiles = [s for s in qcfiles if run + '.csv' in s]
-            searchrank = ["phylum","class","order","family", "genus"]
-            return mypath, mypathqc, minqscore, minaccuracy, qcfiles, onlyfiles, searchrank, barcodes
+            return mypath, mypathqc, run, minqscore, minaccuracy, barcodes, workers, use_columnar
+
+
+def configure(paths, thresholds, barcodes=None, run="", workers=1, use_columnar=False, output_dir="",
+              formats=None, subsample=None, seed=0, rarefaction=0):
+    """Set the module settings used to build an OTU table.
+
+    Arguments:
+        paths: Tuple with the path of the classification files and the path of the QC files.
+        thresholds: Tuple with the minimum qscore and the minimum accuracy per read.
+
+    Keyword Arguments:
+        barcodes: List of barcodes in the OTU table. (default: {DEFAULT_BARCODES})
+        run: Run number that is used to select the files, all files if empty. (default: {""})
+        workers: Number of worker processes used to read the files. (default: {1})
+        use_columnar: Use the columnar csv reader. (default: {False})
+        output_dir: Folder for the OTU tables. (default: {current folder})
+        formats: List of output formats that are written next to the csv
+            tables, biom, hdf5, parquet or npz. (default: {None})
+        subsample: Number of reads every sample is subsampled to, all reads if None. (default: {None})
+        seed: Seed of the subsampling. (default: {0})
+        rarefaction: Number of depths of the rarefaction curves, no curves if 0. (default: {0})
+    """
+    mypath, mypathqc = [os.path.join(path, '') for path in paths]
+    minqscore, minaccuracy = thresholds
+    if use_columnar and not columnar.available():
+        print("pyarrow is not installed, using the line reader.")
+        use_columnar = False
+    formats = list(formats or [])
+    for fmt in list(formats):
+        requirement = tables.missing_requirement(fmt)
+        if requirement is not None:
+            print(requirement + " is not installed, the " + fmt + " tables are not written.")
+            formats.remove(fmt)
+    qcfiles = [f for f in listdir(mypathqc) if isfile(join(mypathqc, f))]
+    globals().update(
+        mypath=mypath, mypathqc=mypathqc, minqscore=minqscore, minaccuracy=minaccuracy, run=run,
+        qcfiles=qcfiles, onlyfiles=sorted(s for s in qcfiles if is_csv_file(s, run)),
+        searchrank=list(DEFAULT_SEARCHRANK), barcodes=list(barcodes or DEFAULT_BARCODES),
+        workers=max(workers, 1), use_columnar=use_columnar, output_dir=output_dir, formats=formats,
+        subsample_depth=subsample, seed=seed, rarefaction_points=rarefaction)
+    globals()['metrics'] = RunMetrics(
+        script="otu", started=datetime.now().isoformat(), classification_path=mypath,
+        qc_path=mypathqc, minqscore=int(minqscore), minaccuracy=int(minaccuracy),
+        barcodes=barcodes, workers=workers, use_columnar=use_columnar, files=onlyfiles,
+        formats=formats, subsample=subsample, seed=seed)
+
+
+def build_otu_table(paths, thresholds, barcodes=None, run="", workers=1, use_columnar=False,
+                    output_dir="", checkpoint_file=None, formats=None, subsample=None, seed=0,
+                    rarefaction=0):
+    """Build the OTU count and percentage tables of the classification files.
+
+    The taxonomy database is opened once and reused by the following
+    calls, so many runs can be processed in the same process.
+
+    Arguments:
+        paths: Tuple with the path of the classification files and the path of the QC files.
+        thresholds: Tuple with the minimum qscore and the minimum accuracy per read.
+
+    Keyword Arguments:
+        barcodes: List of barcodes in the OTU table. (default: {DEFAULT_BARCODES})
+        run: Run number that is used to select the files, all files if empty. (default: {""})
+        workers: Number of worker processes used to read the files. (default: {1})
+        use_columnar: Use the columnar csv reader. (default: {False})
+        output_dir: Folder for the OTU tables. (default: {current folder})
+        checkpoint_file: SQLite file with the results per input file. Only
+            new and changed files are read if it is used. (default: {None})
+        formats: List of output formats that are written next to the csv
+            tables, biom, hdf5, parquet or npz. (default: {None})
+        subsample: Number of reads every sample is subsampled to, all reads if None. (default: {None})
+        seed: Seed of the subsampling. (default: {0})
+        rarefaction: Number of depths of the rarefaction curves, no curves if 0. (default: {0})
+
+    Returns:
+        CountMatrix with the read counts per taxonomy ID and sample.
+    """
+    configure(paths, thresholds, barcodes, run, workers, use_columnar, output_dir, formats, subsample,
+              seed, rarefaction)
+    globals()['checkpoints'] = CheckpointStore(checkpoint_file) if checkpoint_file else None
+    try:
+        ok_read_ids, barcode_dict = read_basecalling_qc()
+        globals().update(ok_read_ids=ok_read_ids, barcode_dict=barcode_dict)
+        read_csv()
+    finally:
+        if checkpoints is not None:
+            print(checkpoints.hits, "files reused from", checkpoints.filename)
+            metrics.info['checkpoint_files_reused'] = checkpoints.hits
+            checkpoints.close()
+            globals()['checkpoints'] = None
+    write_metrics()
+    return d
+
+
+def watch_otu_table(paths, thresholds, barcodes=None, run="", output_dir="", interval=60,
+                    refreshes=None, formats=None, subsample=None, seed=0, rarefaction=0):
+    """Follow the QC and classification files of a running sequencing run
+    and rewrite the OTU tables while the files grow.
+
+    Only the lines that are added to the files are read at every refresh,
+    new files in the folders are added to the table.
+
+    Arguments:
+        paths: Tuple with the path of the classification files and the path of the QC files.
+        thresholds: Tuple with the minimum qscore and the minimum accuracy per read.
+
+    Keyword Arguments:
+        barcodes: List of barcodes in the OTU table. (default: {DEFAULT_BARCODES})
+        run: Run number that is used to select the files, all files if empty. (default: {""})
+        output_dir: Folder for the OTU tables. (default: {current folder})
+        interval: Seconds between the refreshes. (default: {60})
+        refreshes: Number of refreshes, runs until it is interrupted if None. (default: {None})
+        formats: List of output formats that are written next to the csv
+            tables, biom, hdf5, parquet or npz. (default: {None})
+        subsample: Number of reads every sample is subsampled to, all reads if None. (default: {None})
+        seed: Seed of the subsampling. (default: {0})
+        rarefaction: Number of depths of the rarefaction curves, no curves if 0. (default: {0})
+
+    Returns:
+        CountMatrix with the read counts per taxonomy ID and sample.
+    """
+    configure(paths, thresholds, barcodes, run, output_dir=output_dir, formats=formats,
+              subsample=subsample, seed=seed, rarefaction=rarefaction)
+    watcher = RunWatcher()
+    refresh = 0
+    try:
+        while refreshes is None or refresh < refreshes:
+            start = datetime.now()
+            with metrics.stage('refresh') as stage:
+                lines = watcher.refresh()
+                stage['rows'] = stage.get('rows', 0) + lines
+                stage['refreshes'] = refresh + 1
+                stage['waiting'] = len(watcher.waiting)
+                stage['qc_filter'] = filter_counts(watcher.qcstats, QC_FILTERS)
+                stage['classification_scan'] = filter_counts(watcher.stats, CLASSIFICATION_FILTERS)
+            print(datetime.now().strftime("%H:%M:%S"), lines, "new lines,",
+                  len(watcher.waiting), "classified reads wait for QC")
+            if lines or refresh == 0:
+                make_otu_table(watcher.results())
+                write_metrics()
+            refresh += 1
+            if refreshes is None or refresh < refreshes:
+                sleep(max(0, interval - (datetime.now() - start).total_seconds()))
+    except KeyboardInterrupt:
+        print()
+        print("Stopped watching the run.")
+    return d
+
+
+def map_otu_table(paths, thresholds, partial_file, barcodes=None, run="", workers=1, use_columnar=False,
+                  shard=None, checkpoint_file=None):
+    """Count the reads of a shard of the QC and classification files and
+    write the counts as partial result, see reduce_otu_tables.
+
+    The reads of a classification file are looked up in the QC files of
+    the shard, so a shard is self-contained if every classification file
+    has a QC file with the same name.
+
+    Arguments:
+        paths: Tuple with the path of the classification files and the path of the QC files.
+        thresholds: Tuple with the minimum qscore and the minimum accuracy per read.
+        partial_file: The partial result file.
+
+    Keyword Arguments:
+        barcodes: List of barcodes in the OTU table. (default: {DEFAULT_BARCODES})
+        run: Run number that is used to select the files, all files if empty. (default: {""})
+        workers: Number of worker processes used to read the files. (default: {1})
+        use_columnar: Use the columnar csv reader. (default: {False})
+        shard: Tuple with the number of the shard, counted from 0, and the
+            number of shards. The files are sorted by name and every shard
+            has every so many file, all files if None. (default: {None})
+        checkpoint_file: SQLite file with the results per input file. (default: {None})
+
+    Returns:
+        List with the classification file name and the result of
+        scan_classification_file for every file of the shard.
+    """
+    configure(paths, thresholds, barcodes, run, workers, use_columnar)
+    if shard is not None:
+        number, count = shard
+        globals()['onlyfiles'] = onlyfiles[number::count]
+        metrics.info.update(files=onlyfiles, shard="{}/{}".format(number, count))
+    globals()['checkpoints'] = CheckpointStore(checkpoint_file) if checkpoint_file else None
+    try:
+        ok_read_ids, barcode_dict = read_basecalling_qc()
+        globals().update(ok_read_ids=ok_read_ids, barcode_dict=barcode_dict)
+        results = list(zip(onlyfiles, scan_classification_files()))
+    finally:
+        if checkpoints is not None:
+            checkpoints.close()
+            globals()['checkpoints'] = None
+    qc_filter = metrics.stages['qc_filter']
+    qc_stats = dict(qc_filter['failed'], rows=qc_filter['rows'])
+    partials.write_partial(partial_file, {
+        'minqscore': int(minqscore), 'minaccuracy': int(minaccuracy),
+        'barcodes': list(barcodes or DEFAULT_BARCODES),
+        'run': run, 'shard': metrics.info.get('shard'), 'qc_stats': qc_stats}, results)
+    print(partial_file + " created with the counts of " + ", ".join(onlyfiles) + "\n")
+    write_metrics(os.path.splitext(partial_file)[0] + '_metrics.json')
+    return results
+
+
+def reduce_otu_tables(partial_files, output_dir="", formats=None, subsample=None, seed=0, rarefaction=0):
+    """Merge partial results of map_otu_table and write the OTU tables.
+
+    Arguments:
+        partial_files: List of partial result files, the samples are sorted
+            by file name like in a single run.
+
+    Keyword Arguments:
+        output_dir: Folder for the OTU tables. (default: {current folder})
+        formats: List of output formats that are written next to the csv
+            tables, biom, hdf5, parquet or npz. (default: {None})
+        subsample: Number of reads every sample is subsampled to, all reads if None. (default: {None})
+        seed: Seed of the subsampling. (default: {0})
+        rarefaction: Number of depths of the rarefaction curves, no curves if 0. (default: {0})
+
+    Returns:
+        CountMatrix with the read counts per taxonomy ID and sample.
+
+    Raises:
+        ValueError: If the partial results can not be merged.
+    """
+    formats = list(formats or [])
+    for fmt in list(formats):
+        requirement = tables.missing_requirement(fmt)
+        if requirement is not None:
+            print(requirement + " is not installed, the " + fmt + " tables are not written.")
+            formats.remove(fmt)
+    globals()['metrics'] = RunMetrics(script="otu", started=datetime.now().isoformat(),
+                                      partials=partial_files, formats=formats, subsample=subsample, seed=seed)
+    with metrics.stage('merge') as stage:
+        info, results, qc_stats = partials.merge_partials(partial_files)
+        stats = Counter()
+        for dummycsv, (dummybarcodecounts, dummyspecies, file_stats) in results:
+            stats.update(file_stats)
+        stage['files'] = len(results)
+        stage['qc_filter'] = filter_counts(qc_stats, QC_FILTERS)
+        stage['classification_scan'] = filter_counts(stats, CLASSIFICATION_FILTERS)
+    metrics.info.update(minqscore=info['minqscore'], minaccuracy=info['minaccuracy'],
+                        barcodes=info['barcodes'], files=[csv for csv, dummyresult in results])
+    globals().update(
+        minqscore=info['minqscore'], minaccuracy=info['minaccuracy'], run=info.get('run', ""),
+        onlyfiles=[csv for csv, dummyresult in results], searchrank=list(DEFAULT_SEARCHRANK),
+        barcodes=info['barcodes'], output_dir=output_dir, formats=formats, subsample_depth=subsample,
+        seed=seed, rarefaction_points=rarefaction)
+    print(len(results), "files merged from", len(partial_files), "partial results")
+    make_otu_table(results)
+    print("Finished\n")
+    write_metrics()
+    return d
+
+
+def sweep_otu_table(paths, qscores, accuracies, barcodes=None, run="", workers=1, output_dir="",
+                    formats=None, subsample=None, seed=0, rarefaction=0):
+    """Build the OTU tables for all combinations of qscore and accuracy
+    thresholds with one pass over the QC and classification files.
+
+    The reads are counted per barcode, taxonomy ID, qscore bin and
+    accuracy bin, the tables of every combination are made from these
+    counts. The tables are written to a folder per combination, i.e.
+    q8_a80, and otu_sweep.csv has the number of reads and taxa of every
+    combination.
+
+    Arguments:
+        paths: Tuple with the path of the classification files and the path of the QC files.
+        qscores: List of minimum mean qscores per read.
+        accuracies: List of minimum accuracies per read.
+
+    Keyword Arguments:
+        barcodes: List of barcodes in the OTU table. (default: {DEFAULT_BARCODES})
+        run: Run number that is used to select the files, all files if empty. (default: {""})
+        workers: Number of worker processes used to read the files. (default: {1})
+        output_dir: Folder for the folders with the OTU tables. (default: {current folder})
+        formats: List of output formats that are written next to the csv
+            tables, biom, hdf5, parquet or npz. (default: {None})
+        subsample: Number of reads every sample is subsampled to, all reads if None. (default: {None})
+        seed: Seed of the subsampling. (default: {0})
+        rarefaction: Number of depths of the rarefaction curves, no curves if 0. (default: {0})
+
+    Returns:
+        Dictionary with the qscore and accuracy and the CountMatrix of every combination.
+    """
+    qscores = sorted(set(int(qscore) for qscore in qscores))
+    accuracies = sorted(set(int(accuracy) for accuracy in accuracies))
+    configure(paths, (qscores[0], accuracies[0]), barcodes, run, workers, output_dir=output_dir,
+              formats=formats, subsample=subsample, seed=seed, rarefaction=rarefaction)
+    metrics.info.update(qscores=qscores, accuracies=accuracies)
+    globals().update(qscores=qscores, accuracies=accuracies)
+    print()
+    print("Filtering reads for qscores " + ", ".join(str(qscore) for qscore in qscores) + "...")
+    with metrics.stage('qc_filter') as stage:
+        qscore_bins = [ReadIdSet() for dummyqscore in qscores]
+        stats = Counter()
+        for file_bins, file_stats in map_files(sweep_qc_file, onlyfiles):
+            for read_ids, file_read_ids in zip(qscore_bins, file_bins):
+                read_ids.merge(file_read_ids)
+            stats.update(file_stats)
+        for read_ids in qscore_bins:
+            read_ids.freeze()
+        stage['files'] = len(onlyfiles)
+        stage.update(filter_counts(stats, QC_FILTERS))
+    globals()['qscore_bins'] = qscore_bins
+    print("Counting reads for accuracies " + ", ".join(str(accuracy) for accuracy in accuracies) + "...")
+    with metrics.stage('classification_scan') as stage:
+        stats = Counter()
+        histograms = []
+        for histogram, file_stats in map_files(sweep_classification_file, onlyfiles):
+            histograms.append(histogram)
+            stats.update(file_stats)
+        stage['files'] = len(onlyfiles)
+        stage.update(filter_counts(stats, CLASSIFICATION_FILTERS))
+    sweep_tables = {}
+    lines = ['minqscore,minaccuracy,reads,taxa\n']
+    try:
+        for qscore_index, qscore in enumerate(qscores):
+            for accuracy_index, accuracy in enumerate(accuracies):
+                folder = os.path.join(output_dir, "q{}_a{}".format(qscore, accuracy))
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                globals().update(output_dir=folder, minqscore=qscore, minaccuracy=accuracy)
+                print("Minimum qscore", qscore, "and minimum accuracy", accuracy)
+                results = [sweep.get_counts(histogram, barcodes or DEFAULT_BARCODES, qscore_index,
+                                            accuracy_index) for histogram in histograms]
+                make_otu_table(zip(onlyfiles, results))
+                sweep_tables[(qscore, accuracy)] = d
+                lines.append("{},{},{},{}\n".format(
+                    qscore, accuracy, sum(d.column_totals()), len(d)))
+    finally:
+        globals().update(output_dir=output_dir, minqscore=qscores[0], minaccuracy=accuracies[0])
+    filename = os.path.join(output_dir, 'otu_sweep.csv')
+    write_atomic(filename, ''.join(lines))
+    print(filename + " created\n")
+    write_metrics()
+    return sweep_tables
+
+
+def sweep_qc_file(qcfile):
+    """Read a QC file and bin the reads by the qscore thresholds of the sweep."""
+    return sweep.filter_qc_file(mypathqc + qcfile, qscores, report=get_progress(mypathqc + qcfile))
+
+
+def sweep_classification_file(csv):
+    """Count the reads of a classification file per qscore and accuracy bin of the sweep."""
+    return sweep.scan_classification_file(mypath + csv, accuracies, qscore_bins,
+                                          report=get_progress(mypath + csv))
+
+
+class RunWatcher(object):
+    """Follow the QC and classification files of a running sequencing run.
+
+    Only the lines that are added to the files since the last refresh are
+    read. Classified reads are counted if their QC line passed the
+    filtering steps, classifications that are read before the QC line of
+    the read wait until it is read.
+    """
+
+    def __init__(self):
+        self.qctails = OrderedDict()
+        self.tails = OrderedDict()
+        self.filecounts = OrderedDict()
+        self.passed = ReadIdLevels()
+        self.seen = ReadIdLevels()
+        self.recent_passed = set()
+        self.recent_seen = set()
+        self.waiting = {}
+        self.layouts = {}
+        self.qcstats = Counter()
+        self.stats = Counter()
+
+    def find_files(self):
+        """Add the new QC and classification files of the run, compressed files are skipped."""
+        for f in sorted(listdir(mypathqc)):
+            if is_csv_file(f, run) and not is_compressed(f) and isfile(join(mypathqc, f)):
+                if f not in self.qctails:
+                    self.qctails[f] = FileTail(mypathqc + f)
+                if f not in self.tails and isfile(join(mypath, f)):
+                    self.tails[f] = FileTail(mypath + f)
+                    self.filecounts[f] = (dict((bc, Counter()) for bc in barcodes), set())
+
+    def refresh(self):
+        """Read the new lines of all files and count the classified reads.
+
+        Returns:
+            The number of new lines.
+        """
+        self.find_files()
+        lines = 0
+        for f, tail in self.qctails.items():
+            if tail.truncated():
+                print(f + " was replaced, reading it again.")
+                tail.reset()
+            layout = self.get_layout(tail, [QC_LAYOUT], QC_LAYOUT)
+            if layout is None:
+                continue
+            parse_qc_line = qc_parser(layout, int(minqscore))
+            read_id_column = layout['read_id']
+            for line in tail.read_lines():
+                lines += 1
+                self.qcstats['rows'] += 1
+                passed = parse_qc_line(line)
+                if passed.__class__ is not tuple:
+                    self.qcstats[passed] += 1
+                fields = line.split(',', read_id_column + 1)
+                if len(fields) <= read_id_column:
+                    continue
+                read_id = fields[read_id_column]
+                self.recent_seen.add(read_id)
+                if passed.__class__ is tuple:
+                    self.recent_passed.add(read_id)
+                for csv, classification in self.waiting.pop(read_id, ()):
+                    if passed.__class__ is tuple:
+                        barcodecounts, species = self.filecounts[csv]
+                        count_classification(barcodecounts, species, *classification[1:4])
+                    else:
+                        self.stats['qc'] += 1
+        for f, tail in self.tails.items():
+            if tail.truncated():
+                print(f + " was replaced, reading it again.")
+                tail.reset()
+                self.filecounts[f] = (dict((bc, Counter()) for bc in barcodes), set())
+                for read_id in list(self.waiting):
+                    self.waiting[read_id] = [w for w in self.waiting[read_id] if w[0] != f]
+                    if not self.waiting[read_id]:
+                        del self.waiting[read_id]
+            layout = self.get_layout(tail, [CLASSIFICATION_LAYOUT], CLASSIFICATION_LAYOUT)
+            if layout is None:
+                continue
+            barcodecounts, species = self.filecounts[f]
+            parse_classification_line = classification_parser(layout, int(minaccuracy))
+            for line in tail.read_lines():
+                lines += 1
+                self.stats['rows'] += 1
+                classification = parse_classification_line(line)
+                if classification.__class__ is not tuple:
+                    self.stats[classification] += 1
+                    continue
+                read_id = classification[0]
+                if read_id in self.recent_passed or read_id in self.passed:
+                    count_classification(barcodecounts, species, *classification[1:4])
+                elif read_id not in self.recent_seen and read_id not in self.seen:
+                    self.waiting.setdefault(read_id, []).append((f, classification))
+                else:
+                    self.stats['qc'] += 1
+        self.compact()
+        return lines
+
+    def get_layout(self, tail, layouts, default):
+        """Get the layout of a followed file, from the header once the file is read from the start.
+
+        Arguments:
+            tail: The FileTail of the file.
+            layouts: List of possible layouts.
+            default: Layout of files without a known header.
+
+        Returns:
+            The Layout of the file, None if the header is not complete yet.
+
+        Raises:
+            ValueError: If the header does not match one of the layouts.
+        """
+        if tail.offset == 0 or tail.filename not in self.layouts:
+            header = tail.read_header()
+            if header is None:
+                return None
+            try:
+                self.layouts[tail.filename] = detect_layout(header, layouts, default)
+            except ValueError as e:
+                raise ValueError(tail.filename + ": " + str(e))
+        return self.layouts[tail.filename]
+
+    def compact(self):
+        """Move the read IDs of the last refreshes to the compact sets
+        once there are many of them, as a new level of the sets.
+        """
+        for recent, read_ids in ((self.recent_passed, self.passed), (self.recent_seen, self.seen)):
+            if len(recent) >= RUN_SIZE:
+                read_ids.add_batch(list(recent))
+                recent.clear()
+
+    def results(self):
+        """Get the counts of all classification files.
+
+        Returns:
+            List with the classification file name, a dictionary with a
+            counter of taxonomy IDs per barcode, the taxonomy IDs that
+            are classified successfully and the filter counts of all files,
+            sorted by file name.
+        """
+        return [(f, (barcodecounts, species, self.stats))
+                for f, (barcodecounts, species) in sorted(self.filecounts.items())]
 
 
 def is_taxadb_up_to_date(dbfile=DEFAULT_TAXADB):
@@ -89,12 +715,7 @@ def get_desired_ranks(taxid, desired_ranks):
     Returns:
         Rank based on taxid
     """
-    lineage = ncbi.get_lineage(taxid)
-    names = ncbi.get_taxid_translator(lineage)
-    lineage2ranks = ncbi.get_rank(names)
-    ranks2lineage = dict((rank, taxid)
-                         for (taxid, rank) in lineage2ranks.items())
-    return{'{}_id'.format(rank): ranks2lineage.get(rank, '<not present>') for rank in desired_ranks}
+    return get_taxonomy().get_desired_ranks(taxid, desired_ranks)
 
 
 def read_basecalling_qc():
@@ -102,424 +723,517 @@ def read_basecalling_qc():
     from the classification file.
 
     Returns:
-        A list of reads that passed the filtering steps.
-        A dictionary with read counts per barcode.
+        A compact set of reads that passed the filtering steps.
+        A sorted list with barcodes and read counts.
     
     Raises:
         ValueError: If qscore column is not a float skip read.
     """
     print()
     print("Filtering reads...")
-    # ok_read_ids = {}
-    # read_ids = []
-    barcode_list = []
-    massive_read_set = set()
-    for qcfile in onlyfiles:
-        read_ids = []
-        read_id_column = 1
-        barcode_column = 2
-        seqlen_column = 6
-        mean_qscore_column = 7
-        with open(mypathqc + qcfile) as qf:
-            linenr = 0
-            for line in qf:
-                if ',,' not in line:
-                    line = line.split(',')
-                    if line[barcode_column] != "NA":
-                        if linenr > 0:
-                            try:
-                                if int(line[seqlen_column]) >= 1400 and int(line[seqlen_column]) <= 1700:
-                                    if float(line[mean_qscore_column].strip('\n')) >= int(minqscore):
-                                        massive_read_set.add(line[read_id_column])
-                                        read_ids.append(line[read_id_column])
-                                        barcode_list.append(line[barcode_column])
-                            except ValueError:
-                                pass
-                linenr += 1
-        # ok_read_ids[qcfile] = read_ids
-        ok_read_ids = massive_read_set
-        barcode_dict = Counter(barcode_list)
-        barcode_dict = sorted(barcode_dict.items())
-        # print(len(ok_read_ids.get(qcfile)), "reads will be used")
+    print("Peak memory use before filtering:", get_memory_usage())
+    barcode_counter = Counter()
+    ok_read_ids = ReadIdSet()
+    stats = Counter()
+    with metrics.stage('qc_filter') as stage:
+        for file_read_ids, file_barcode_counter, file_stats in map_files_checkpointed(
+                filter_qc_file, 'qc', mypathqc, onlyfiles, lambda qcfile: (int(minqscore), use_columnar)):
+            ok_read_ids.merge(file_read_ids)
+            barcode_counter.update(file_barcode_counter)
+            stats.update(file_stats)
+        ok_read_ids.freeze()
+        stage['files'] = len(onlyfiles)
+        stage.update(filter_counts(stats, QC_FILTERS))
+        stage['read_id_mb'] = round(ok_read_ids.nbytes() / 1048576.0, 1)
+    barcode_dict = sorted(barcode_counter.items())
+    print(len(ok_read_ids), "reads will be used, read IDs use",
+          round(ok_read_ids.nbytes() / 1048576.0, 1), "MB")
+    print("Peak memory use after filtering:", get_memory_usage())
     return ok_read_ids, barcode_dict
 
 
+def filter_qc_file(qcfile):
+    """Read a QC file and keep the reads that pass the filtering steps.
+
+    Arguments:
+        qcfile: Name of the QC file.
+
+    Returns:
+        A compact set of reads that passed the filtering steps.
+        A counter with the number of passed reads per barcode.
+        A counter with the number of rows and the rows that failed each filter.
+
+    Raises:
+        ValueError: If the header does not match the QC layout. Use the line
+        reader if the columnar reader can not parse or read the file.
+    """
+    layout = read_layout(mypathqc + qcfile, [QC_LAYOUT], QC_LAYOUT)
+    if use_columnar:
+        try:
+            return columnar.filter_qc_file(mypathqc + qcfile, int(minqscore), layout=layout,
+                                           report=get_progress(mypathqc + qcfile))
+        except columnar.READ_ERRORS:
+            print("Columnar reader failed on " + qcfile + ", using the line reader.")
+    barcode_counter = Counter()
+    read_ids = ReadIdSet()
+    stats = Counter()
+    parse_qc_line = qc_parser(layout, int(minqscore))
+    report = get_progress(mypathqc + qcfile)
+    with open_csv(mypathqc + qcfile) as qf:
+        qf.readline()
+        linenr = 0
+        for line in qf:
+            linenr += 1
+            passed = parse_qc_line(line)
+            if passed.__class__ is tuple:
+                read_ids.add(passed[0])
+                barcode_counter[passed[1]] += 1
+            else:
+                stats[passed] += 1
+            if report is not None and not linenr % CHECK_ROWS:
+                report.update(file_position(qf), linenr)
+    if report is not None:
+        report.finish(linenr)
+    read_ids.freeze()
+    stats['rows'] = linenr
+    return read_ids, barcode_counter, stats
+
+
+def init_worker(settings):
+    """Set the module settings in a worker process.
+
+    Arguments:
+        settings: Dictionary with the global names and values used by the workers.
+    """
+    globals().update(settings)
+
+
+def map_files(function, files):
+    """Apply a function to all files, using a pool of worker processes
+    if more than one worker is used.
+
+    Arguments:
+        function: Function that takes a filename.
+        files: List of filenames.
+
+    Returns:
+        Generator with the results in the same order as the files.
+    """
+    if workers < 2 or len(files) < 2:
+        for f in files:
+            yield function(f)
+        return
+    settings = dict((name, globals()[name]) for name in (
+        'mypath', 'mypathqc', 'minqscore', 'minaccuracy', 'barcodes', 'ok_read_ids', 'workers',
+        'use_columnar', 'qscores', 'accuracies', 'qscore_bins')
+        if name in globals())
+    settings['progress'] = False
+    pool = Pool(min(workers, len(files)), initializer=init_worker, initargs=(settings,))
+    try:
+        for result in pool.imap(function, files, chunksize=1):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def map_files_checkpointed(function, kind, path, files, settings):
+    """Apply a function to all files like map_files and reuse the stored
+    results of the files that did not change.
+
+    Every new result is stored as soon as it is available, so an
+    interrupted run continues with the files that were not finished.
+
+    Arguments:
+        function: Function that takes a filename.
+        kind: The kind of result that is stored.
+        path: Path of the files.
+        files: List of filenames.
+        settings: Function that takes a filename and returns a tuple with
+            the settings the result depends on.
+
+    Returns:
+        List with the results in the same order as the files.
+    """
+    if checkpoints is None:
+        return list(map_files(function, files))
+    signatures = dict((f, checkpoints.signature(path + f, settings(f))) for f in files)
+    results = dict((f, checkpoints.get(kind, path + f, signatures[f])) for f in files)
+    todo = [f for f in files if results[f] is None]
+    for f, result in zip(todo, map_files(function, todo)):
+        checkpoints.put(kind, path + f, signatures[f], result)
+        results[f] = result
+    return [results[f] for f in files]
+
+
+def get_progress(filename):
+    """Get the progress reporter of an input file.
+
+    Arguments:
+        filename: The input file.
+
+    Returns:
+        The Progress of the file or None if progress is not shown.
+    """
+    if not progress:
+        return None
+    return Progress(os.path.basename(filename), os.path.getsize(filename))
+
+
+def get_memory_usage():
+    """Get the peak memory use of the process.
+
+    Returns:
+        Peak resident set size in MB or "unknown" if it is not available.
+    """
+    memory = get_peak_memory()
+    if memory is None:
+        return "unknown"
+    return str(memory) + " MB"
+
+
 def read_csv():
     """Read the csv files and build lists with available taxids and occurance.
 
-    Raises:
-        IndexError: Set rank to (no rank) is none is found.
+    Every classification file is scanned once for all barcodes, the
+    species found in the files are collected during the same pass.
+    Reads are counted per taxonomy ID, names are only looked up when
+    the OTU table is written.
     """
-    taxnames = []
-    allnames, headers = get_all_species(ok_read_ids)
-    for csv in onlyfiles:
-        read_id_column = 1
-        barcode_column = 5
-        acc_column = 6
-        taxid_column = 4
-        for bc in barcodes:
-            print("Checking", bc, "in", csv)
-            with open(mypath + csv) as nf:
-                nf.readline()
-                filecontent = nf.read().split('\n')
-                linenr = 0
-                for content in filecontent:
-                    content = content.split(',')
-                    name = ""
-                    try:
-                        if content[barcode_column] == bc:
-                            if linenr > 0:
-                                if (
-                                    float(content[acc_column]) >= int(minaccuracy) and
-                                    content[read_id_column] in ok_read_ids
-                                ):
-                                    taxid2name = ncbi.get_taxid_translator([int(content[taxid_column])])
-                                    bestrankdict = ncbi.get_rank([int(content[taxid_column])])
-                                    bestrank = list(bestrankdict.values())
-                                    for dummytid, tname in taxid2name.items():
-                                        namesplit = tname.split(' ')
-                                        if len(namesplit) > 2:
-                                            splitnr = 0
-                                            for split in namesplit[:2]:
-                                                if splitnr < 1:
-                                                    name += split + ' '
-                                                else:
-                                                    name += split
-                                                splitnr += 1
-                                        else:
-                                            name = str(tname)
-                                    if content[barcode_column] == bc:
-                                        try:
-                                            fullname = str(name + " (" + bestrank[0] + ")")
-                                        except IndexError:
-                                            fullname = str(name + " (no rank)")
-                                        taxnames.append(str(fullname))
-                        linenr += 1
-                    except (IndexError, ValueError):
-                        pass
-                namecounter = Counter(taxnames)
-                for k, v in namecounter.items():
-                    values = []
-                    values.append(v)
-                    values.append(csv.strip(".csv") + bc)
-                    d[k].append(values)
-                allnames = list(dict.fromkeys(allnames))
-                for key in allnames:
-                    if key not in namecounter.keys():
-                        values = []
-                        values.append(0)
-                        values.append(csv.strip(".csv") + bc)
-                        d[key].append(values)
-                namecounter.clear()
-                taxnames = []
-                print(bc, "done!")
-    make_rank_csv(headers)
+    make_otu_table(zip(onlyfiles, scan_classification_files()))
     print("Finished\n")
 
 
-def make_subset(reads_per_barcode):
-    """Create a subset of read IDs.
-    
+def scan_classification_files():
+    """Scan all classification files and add the filter counts to the metrics.
+
+    Returns:
+        List with the result of scan_classification_file for every file.
+    """
+    print()
+    print("Getting all available species from " + ", ".join(onlyfiles) + "...")
+    print()
+    with metrics.stage('classification_scan') as stage:
+        # The reads of a classification file are in the QC file with the same name.
+        results = map_files_checkpointed(
+            scan_classification_file, 'classification', mypath, onlyfiles,
+            lambda csv: (int(minqscore), int(minaccuracy), barcodes, use_columnar,
+                         get_file_signature(mypathqc + csv)))
+        stats = Counter()
+        for dummybarcodecounts, dummyspecies, file_stats in results:
+            stats.update(file_stats)
+        stage['files'] = len(onlyfiles)
+        stage.update(filter_counts(stats, CLASSIFICATION_FILTERS))
+    return results
+
+
+def make_otu_table(results):
+    """Count the reads per taxonomy ID and sample and write the OTU tables.
+
     Arguments:
-        reads_per_barcode: The maximum amount of reads per barcode.
-    
+        results: List with the classification file name and the result of
+            scan_classification_file for every file.
+    """
+    global d
+    d = CountMatrix()
+    alltaxids = set()
+    filecounts = []
+    for csv, (barcodecounts, species, dummystats) in results:
+        alltaxids.update(species)
+        for taxcounter in barcodecounts.values():
+            alltaxids.update(taxcounter)
+        filecounts.append((csv, barcodecounts))
+    print()
+    print(len(alltaxids), "species found!")
+    print()
+    for taxid in alltaxids:
+        d.add_row(taxid)
+    for csv, barcodecounts in filecounts:
+        for bc in barcodes:
+            d.add_counts(csv_name(csv).strip(".csv") + bc, barcodecounts[bc])
+    if rarefaction_points:
+        write_rarefaction(d.samples())
+    if subsample_depth:
+        with metrics.stage('subsampling') as stage:
+            below = [sample for sample, total in zip(d.samples(), d.column_totals())
+                     if total < subsample_depth]
+            d = rarefaction.subsample(d, subsample_depth, seed)
+            stage['depth'] = subsample_depth
+            stage['samples_below_depth'] = below
+        print("Subsampled every sample to", subsample_depth, "reads with seed", seed)
+        if below:
+            print(len(below), "samples have less reads and are not subsampled:", ", ".join(below))
+        print()
+    make_rank_csv(d.samples())
+
+
+def write_rarefaction(headers):
+    """Write the rarefaction curves of all samples, the expected number
+    of taxa at evenly spaced depths, calculated from the counts.
+
+    Arguments:
+        headers: List of header names with the run and barcode names.
+    """
+    with metrics.stage('rarefaction') as stage:
+        depths = rarefaction.get_depths(d, rarefaction_points)
+        curves = rarefaction.rarefaction_curves(d, depths)
+        lines = ['depth,' + ','.join(headers) + '\n']
+        for index, depth in enumerate(depths):
+            lines.append(str(depth) + ',' + ','.join(
+                "NA" if curve[index] is None else str(round(curve[index], 4)) for curve in curves) + '\n')
+        filename = os.path.join(output_dir, 'otu_rarefaction.csv')
+        write_atomic(filename, ''.join(lines))
+        stage['depths'] = len(depths)
+        stage['samples'] = len(headers)
+    print(filename + " created\n")
+
+
+def get_taxon_name(taxid):
+    """Get the name and best rank of a taxonomy ID as used in the OTU table.
+
+    Arguments:
+        taxid: Taxonomy ID from EPI2ME csv file.
+
     Returns:
-        [type] -- [description]
+        The first two words of the taxonomy name followed by the rank
+        or (no rank) if no rank is found in the NCBI taxonomy database.
     """
-    subset = {}
-    for barcode, bcount in barcode_dict.items():
-        values = []
-        if bcount > reads_per_barcode:
-            for dummyx in range(reads_per_barcode):
-                values.append(random.randint(1,bcount))
+    name = ""
+    tname = get_taxonomy().get_name(taxid)
+    bestrank = get_taxonomy().get_rank(taxid)
+    if tname is not None:
+        namesplit = tname.split(' ')
+        if len(namesplit) > 2:
+            name = namesplit[0] + ' ' + namesplit[1]
         else:
-            for x in range(1, bcount):
-                values.append(x)
-        subset[barcode] = values
-    return subset
+            name = str(tname)
+    if bestrank is None:
+        return str(name + " (no rank)")
+    return str(name + " (" + bestrank + ")")
 
 
-def get_all_species(ok_read_ids):
-    """Get all species that are found in the csv files.
-    
+def scan_classification_file(csv):
+    """Read a classification file once and count the reads of all barcodes.
+
+    Plain csv files are scanned with a memory map, compressed files
+    are read line by line.
+
     Arguments:
-        ok_read_ids: A list with all read ids that passed the filtering stage.
-    
+        csv: Name of the classification file.
+
     Returns:
-        All species names and header needed to create a new species file.
-        Random line number per barcode for future subset functionality.
-    
+        A dictionary with a counter of taxonomy IDs per barcode.
+        All taxonomy IDs that are classified successfully in the file.
+        A counter with the number of rows and the rows that failed each filter.
+
     Raises:
-        IndexError: Set rank to (no rank) if no rank is found in the NCBI taxonomy database.
-        ValueError: Check if values are correct.
+        ValueError: If the header does not match the classification layout.
+        Use the line reader if the columnar reader can not parse or read the file.
     """
-    taxids = []
-    allnameslist = []
-    headers = []
-    for csv in onlyfiles:
-        print()
-        print("Getting all available species from " + csv + "...")
-        print()
-        read_id_column = 1
-        classification_status = 2
-        barcode_column = 5
-        acc_column = 6
-        taxid_column = 4
-        with open(mypath + csv) as dummy:
-            total_lines = 0
-            dummy.readline()
-            for dummyline in dummy:
-                total_lines += 1
-        for bc in barcodes:
-            headers.append(csv.strip(".csv") + bc)
-        with open(mypath + csv) as nf:
-            nf.readline()
-            filecontent = nf.read().split('\n')
-            linenr = 0
-            for content in filecontent:
-                content = content.split(',')
-            # for line in nf:
-                # if ',,' not in line:
-                    # line = line.split(',')
-                name = ""
-                if linenr > 0:
-                    try:
-                        if (
-                            float(content[acc_column]) >= int(minaccuracy) and
-                            content[read_id_column] in ok_read_ids and
-                            content[barcode_column] != "NA" and
-                            int(content[taxid_column]) not in taxids and 
-                            content[classification_status] == "Classification successful"
-                        ):
-                            taxids.append(int(content[taxid_column]))
-                            bestrankdict = ncbi.get_rank([int(content[taxid_column])])
-                            bestrank = list(bestrankdict.values())
-                            taxid2name = ncbi.get_taxid_translator([int(content[taxid_column])])
-                            for dummytid, tname in taxid2name.items():
-                                namesplit = tname.split(' ')
-                                if len(namesplit) > 2:
-                                    splitnr = 0
-                                    for split in namesplit[:2]:
-                                        if splitnr < 1:
-                                            name += split + ' '
-                                        else:
-                                            name += split
-                                        splitnr += 1
-                                else:
-                                    name = str(tname)
-                            if str(name) not in allnameslist:
-                                try:
-                                    fullname = str(name + " (" + bestrank[0] + ")")
-                                except IndexError:
-                                    fullname = str(name + " (no rank)")
-                                allnameslist.append(str(fullname))
-                    except (IndexError, ValueError):
-                        pass
-                linenr += 1
-                block = int(round(60*(linenr/total_lines)))
-                msg = "\r[{0}] {1}%".format("#"*block + "-"*(60-block), round(linenr/total_lines*100, 2))
-                sys.stdout.write(msg)
-                sys.stdout.flush()
-    print()
-    allnames = list(set(allnameslist))
-    print(len(allnames), "species found!")
-    print()
-    return allnames, headers
+    layout = read_layout(mypath + csv, [CLASSIFICATION_LAYOUT], CLASSIFICATION_LAYOUT)
+    if use_columnar:
+        try:
+            return columnar.scan_classification_file(
+                mypath + csv, barcodes, int(minaccuracy), ok_read_ids, layout=layout,
+                report=get_progress(mypath + csv))
+        except columnar.READ_ERRORS:
+            print("Columnar reader failed on " + csv + ", using the line reader.")
+    if not is_compressed(csv):
+        return scanner.scan_classification_file(
+            mypath + csv, barcodes, int(minaccuracy), ok_read_ids, layout=layout,
+            report=get_progress(mypath + csv))
+    parse_classification_line = classification_parser(layout, int(minaccuracy))
+    barcodecounts = dict((bc, Counter()) for bc in barcodes)
+    species = set()
+    stats = Counter()
+    report = get_progress(mypath + csv)
+    with open_csv(mypath + csv) as nf:
+        nf.readline()
+        linenr = 0
+        for line in nf:
+            linenr += 1
+            classification = parse_classification_line(line)
+            if classification.__class__ is not tuple:
+                stats[classification] += 1
+            elif classification[0] in ok_read_ids:
+                count_classification(barcodecounts, species, *classification[1:4])
+            else:
+                stats['qc'] += 1
+            if report is not None and not linenr % CHECK_ROWS:
+                report.update(file_position(nf), linenr)
+    if report is not None:
+        report.finish(linenr)
+    stats['rows'] = linenr
+    return barcodecounts, species, stats
+
+
+def count_classification(barcodecounts, species, barcode, taxid, successful):
+    """Count a classified read that passed the filtering steps.
+
+    Arguments:
+        barcodecounts: Dictionary with a counter of taxonomy IDs per barcode.
+        species: Set with the taxonomy IDs that are classified successfully.
+        barcode: Barcode of the read, reads of other barcodes are not counted.
+        taxid: Taxonomy ID of the read.
+        successful: True if the classification was successful.
+    """
+    if barcode in barcodecounts:
+        barcodecounts[barcode][taxid] += 1
+    if successful:
+        species.add(taxid)
 
 
 def make_rank_csv(headers):
     """Generate an OTU table with species occurance.
 
+    The SUM row and the percentages are calculated from the counts
+    in memory, both tables are written at once.
+
     Arguments:
         headers: List of header names with the run and barcode names.
-
-    Raises:
-        ValueError, IndexError and StopIteration: Catch errors 
-        when calculating the sum of the barcodes.
     """
     print()
     print("Creating OTU count file...\n")
-    with open('otu_count.csv', 'w') as tf:
-        phylum = ""
-        taxclass = ""
-        order = ""
-        family = ""
-        genus = ""
-        tf.write('phylum,class,order,family,genus,best (rank),')
-        i = 0
-        for h in headers:
-            tf.write(h)
-            if i < len(headers) - 1:
-                tf.write(',')
-            i += 1
-        tf.write('\n')
-        for key, value in sorted(d.items(), key=itemgetter(1), reverse=True):
-            x = 0
-            line = ""
-            keyname = re.sub(r"[\(\[].*?[\)\]]", "", key)
-            name2taxid = ncbi.get_name_translator([keyname[:-1]])
-            for dummytaxonomyname, taxonomyid in name2taxid.items():
-                taxids = [taxonomyid[0]]
-                # desired_ranks = searchrank
-                for taxid in taxids:
-                    for srank in searchrank:
-                        ranks = get_desired_ranks(taxid, [srank])
-                        for dummykey, rank in ranks.items():
-                            if rank != '<not present>':
-                                taxid2name = ncbi.get_taxid_translator([int(rank)])
-                                for dummytid, tname in taxid2name.items():
-                                    if srank == "phylum":
-                                        phylum = str(tname)
-                                    elif srank == "class":
-                                        taxclass = str(tname)
-                                    elif srank == "order":
-                                        order = str(tname)
-                                    elif srank == "family":
-                                        family = str(tname)
-                                    elif srank == "genus":
-                                        genus = str(tname)
-                            else:
-                                if srank == "phylum":
-                                        phylum = "NA"
-                                elif srank == "class":
-                                    taxclass = "NA"
-                                elif srank == "order":
-                                    order = "NA"
-                                elif srank == "family":
-                                    family = "NA"
-                                elif srank == "genus":
-                                    genus = "NA"
-            line += str(phylum + ',' + taxclass + ',' + order + ',' + family + ',' + genus + ',')
-            line += str(key + ',')
-            for v in value:
-                line += str(v[0])
-                if x < len(headers) - 1:
-                    line += ','
-                else:
-                    line += '\n'
-                x += 1
-            tf.write(line)
-        total_line = "SUM,,,,,"
-        for i in range(6, len(headers) + 6):
-            try:
-                total = 0
-                cr = csv.reader(open('otu_count.csv'))
-                cr.__next__()
-                for row in cr:
-                    try:
-                        total += int(row[i])
-                    except (ValueError, IndexError):
-                        pass
-            except StopIteration:
-                pass
-            total_line += ","
-            total_line += str(total)
-    with open(tf.name, 'a') as sfile:
-        sfile.write(total_line)
-    print(tf.name + " created\n")
-    print()
-    percentage_nanopore(tf.name)
+    with metrics.stage('taxonomy') as stage:
+        resolver = get_taxonomy()
+        queries = resolver.queries
+        lineage_table = resolver.get_lineage_table(d.rows, searchrank)
+        names = dict((taxid, get_taxon_name(taxid)) for taxid in d.rows)
+        stage['taxa'] = len(d)
+        stage['queries'] = stage.get('queries', 0) + resolver.queries - queries
+        stage['cache'] = resolver.cache_info()
+    with metrics.stage('table_writing') as stage:
+        totals = d.column_totals()
+        rows = sorted(zip(d.items(), d.percentages()), key=lambda row: row[0][1], reverse=True)
+        lines = ['phylum,class,order,family,genus,best (rank),' + ','.join(headers) + '\n']
+        labels = []
+        for (taxid, value), dummypercentages in rows:
+            rank_names = lineage_table[taxid]
+            label = ""
+            for srank in searchrank:
+                label += str(rank_names.get(srank, "NA") + ',')
+            label += str(names[taxid] + ',')
+            labels.append(label)
+            lines.append(label + ','.join(str(v) for v in value) + '\n')
+        lines.append("SUM,,,,,," + ','.join(str(total) for total in totals))
+        filename = os.path.join(output_dir, 'otu_count.csv')
+        write_atomic(filename, ''.join(lines))
+        print(filename + " created\n")
+        print()
+        sum_percentages = [100.0 if total else 0 for total in totals]
+        percentage_nanopore(
+            headers, [(label, percentages) for label, (dummyitem, percentages) in zip(labels, rows)] +
+            [("SUM,,,,,,", sum_percentages)])
+        if formats:
+            lineages = dict((taxid, [lineage_table[taxid].get(srank, "NA") for srank in searchrank] +
+                             [names[taxid]]) for taxid in d.rows)
+            prefixes = [os.path.join(output_dir, name) for name in ('otu_count', 'otu_percentage', 'otu')]
+            keys = [taxid for (taxid, dummyvalue), dummypercentages in rows]
+            for filename in tables.write_tables(formats, prefixes, d, keys, headers,
+                                                searchrank + ["best (rank)"], lineages, "otu.py"):
+                print(filename + " created")
+            print()
+        stage['taxa'] = len(d)
+        stage['samples'] = len(headers)
 
 
-def percentage_nanopore(filename):
-    """Calculate percentage of species occurance and generate a 
-    new OTU table with percentages.
-    
-    Arguments:
-        filename: Filename of the OTU table.
+def percentage_nanopore(headers, rows):
+    """Generate a new OTU table with the percentages of species occurance.
 
-    Raises:
-        ZeroDivisionError: Set percantage to 0 if count is 0.
+    Arguments:
+        headers: List of header names with the run and barcode names.
+        rows: List with the lineage columns and the percentages per sample
+            for every row of the OTU table, including the SUM row.
     """
     print("Create OTU percentage file...")
-    count = 0
-    output = "otu_percentage.csv"
-    with open(filename) as linecount:
-        for line in linecount:
-            count += 1
-    with open(filename) as last:
-        for i, l in enumerate(last):
-            if i == count-1:
-                sum_row = l.split(',')
-            else:
-                pass
-    with open(output, 'w') as perc_nano:
-        with open(filename) as nano:
-            ncount = 0
-            header = nano.readline()
-            samples = header.split(',')
-            for i, dummys in enumerate(samples):
-                options = {0: 'phylum,', 1: 'class,', 2: 'order,', 3: 'family,', 4: 'genus,', 5: 'best (rank),'}
-                headerline = ""
-                if i in options.keys():
-                    headerline += options.get(i)
-                if i > 5:
-                    headerline += samples[i].strip("\n").strip(".csv")
-                if i > 5 and i < len(samples) - 1:
-                    headerline += ","
-                perc_nano.write(headerline)
-            perc_nano.write("\n")
-            sum_row.pop(0)
-            for line in nano:
-                if ncount < count:
-                    wline = ""
-                    sample = line.split(',')
-                    wline += (sample[0] + ',' + sample[1] + ',' + sample[2] +
-                              ',' + sample[3] + ',' + sample[4] + ',' + sample[5] + ',')
-                    for x in range(5, len(sample) - 1):
-                        try:
-                            percentage = float(
-                                100*float(sample[x + 1].strip('\n'))/float(sum_row[x]))
-                        except ZeroDivisionError:
-                            percentage = 0
-                        wline += str(percentage)
-                        if x < len(sample) - 2:
-                            wline += ','
-                        elif x > len(sample) - 2:
-                            wline += '\n'
-                    perc_nano.write(wline)
-                    perc_nano.write("\n")
-                    ncount += 1
+    output = os.path.join(output_dir, "otu_percentage.csv")
+    lines = ['phylum,class,order,family,genus,best (rank),' +
+             ','.join(h.strip(".csv") for h in headers) + '\n']
+    for label, percentages in rows:
+        lines.append(label + ','.join(str(percentage) for percentage in percentages) + '\n')
+    write_atomic(output, ''.join(lines))
     print("Percentage OTU table finished!")
     print()
 
 
+def write_metrics(filename=None):
+    """Write the metrics of the run as JSON next to the OTU tables.
+
+    Keyword Arguments:
+        filename: The JSON file. (default: {otu_metrics.json in the output folder})
+    """
+    if filename is None:
+        filename = os.path.join(output_dir, 'otu_metrics.json')
+    metrics.write(filename)
+    print("Run metrics written to " + filename)
+
+
+def write_atomic(filename, text):
+    """Write a file at once by renaming a temporary file,
+    so a partially written file is never read.
+
+    Arguments:
+        filename: The file to write.
+        text: The content of the file.
+    """
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as f:
+        f.write(text)
+    os.replace(tmpfile, filename)
+
+
 if __name__ == '__main__':
     """Check if database is up-to-date.
     If database is up-to-date start the OTU table creation.
     If database is not up-to-date the database will first be updated.
     """
+    args = parse_args()
     if is_taxadb_up_to_date(DEFAULT_TAXADB):
         start = datetime.now()
         print("---------------------------------------------------------------------")
         print("Starting OTU script at", datetime.now().strftime("%d-%m-%Y %H:%M:%S"))
         print("---------------------------------------------------------------------")
-        mypath, mypathqc, minqscore, minaccuracy, qcfiles, onlyfiles, searchrank, barcodes = get_input()
-        ok_read_ids, barcode_dict = read_basecalling_qc()
-        read_csv()
+        if args.reduce:
+            try:
+                reduce_otu_tables(args.reduce, args.output_dir, args.formats, args.subsample, args.seed,
+                                  args.rarefaction)
+            except ValueError as e:
+                print("The partial results can not be merged:", e)
+        elif args.classification is None:
+            mypath, mypathqc, run, minqscore, minaccuracy, barcodes, workers, use_columnar = get_input()
+            build_otu_table((mypath, mypathqc), (minqscore, minaccuracy), barcodes, run, workers,
+                            use_columnar)
+        elif args.sweep_qscore or args.sweep_accuracy:
+            sweep_otu_table((args.classification, args.qc),
+                            (args.sweep_qscore or str(args.min_qscore)).split(','),
+                            (args.sweep_accuracy or str(args.min_accuracy)).split(','),
+                            args.barcodes.split(','), args.run, args.workers, args.output_dir,
+                            args.formats, args.subsample, args.seed, args.rarefaction)
+        elif args.map:
+            map_otu_table((args.classification, args.qc), (args.min_qscore, args.min_accuracy),
+                          args.map, args.barcodes.split(','), args.run, args.workers, args.columnar,
+                          args.shard, args.checkpoint)
+        elif args.watch is not None:
+            watch_otu_table((args.classification, args.qc), (args.min_qscore, args.min_accuracy),
+                            args.barcodes.split(','), args.run, args.output_dir, args.watch,
+                            formats=args.formats, subsample=args.subsample, seed=args.seed,
+                            rarefaction=args.rarefaction)
+        else:
+            build_otu_table((args.classification, args.qc), (args.min_qscore, args.min_accuracy),
+                            args.barcodes.split(','), args.run, args.workers, args.columnar,
+                            args.output_dir, args.checkpoint, args.formats, args.subsample, args.seed,
+                            args.rarefaction)
+        get_taxonomy().print_cache_info()
         end = datetime.now()
-        runtime = end - start
-        totalruntime = str(runtime).split(".")[0]
-        hours = int(totalruntime.split(":")[0])
-        minutes = int(totalruntime.split(":")[1])
-        seconds = int(totalruntime.split(":")[2])
-        days = int(hours / 24)
         print("---------------------------------------------------------------------")
         print("Finished OTU script at", datetime.now().strftime("%d-%m-%Y %H:%M:%S"))
-        if days > 0:
-            print("Total runtime:", str(days), "d", str(hours), "h", str(minutes), "m", str(seconds), "s")
-        elif hours > 0:
-            print("Total runtime:", str(hours), "h", str(minutes), "m", str(seconds), "s")
-        elif minutes > 0:
-            print("Total runtime:", str(minutes), "m", str(seconds), "s")
-        else:
-            print("Total runtime:", str(seconds), "seconds")
+        print("Total runtime:", format_runtime((end - start).total_seconds()))
         print("---------------------------------------------------------------------")
     else:
         print("---------------------------------------------------------------------")
         print("Taxonomy database is updating...")
         print("---------------------------------------------------------------------")
-        ncbi.update_taxonomy_database()
+        get_taxonomy().ncbi.update_taxonomy_database()
         print("---------------------------------------------------------------------")
         print("Update finished!!!")
         print("---------------------------------------------------------------------")
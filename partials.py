@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import zlib
+import struct
+from array import array
+from collections import Counter
+
+
+# Start of every partial result file and the version of the format.
+MAGIC = b"OTUPART"
+FORMAT_VERSION = 1
+# Settings that must be the same in all partial results that are merged.
+MERGE_SETTINGS = ["minqscore", "minaccuracy", "barcodes"]
+
+
+def to_bytes(values, typecode):
+    """Get the little endian bytes of an array of integers."""
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_bytes(data, typecode):
+    """Get the integers of little endian bytes as array."""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def write_partial(filename, info, results):
+    """Write the counts of some classification files as partial result.
+
+    The file starts with MAGIC, the format version and the length of a
+    JSON header with the settings, the QC filter counts and the name,
+    filter counts and number of entries of every file. The counts follow
+    as zlib compressed little endian arrays with the barcode number,
+    taxonomy ID and count of every non-zero count, and the taxonomy IDs
+    that are classified successfully, per file.
+
+    Arguments:
+        filename: The partial result file.
+        info: Dictionary with the settings, at least minqscore,
+            minaccuracy and barcodes, and the QC filter counts as qc_stats.
+        results: List with the classification file name and the result
+            of scan_classification_file for every file.
+    """
+    barcodes = info['barcodes']
+    files = []
+    arrays = []
+    for csv, (barcodecounts, species, stats) in results:
+        numbers = []
+        taxids = []
+        counts = []
+        for number, bc in enumerate(barcodes):
+            for taxid, count in sorted(barcodecounts[bc].items()):
+                if count:
+                    numbers.append(number)
+                    taxids.append(taxid)
+                    counts.append(count)
+        species = sorted(species)
+        files.append({'name': csv, 'stats': dict(stats), 'entries': len(counts), 'species': len(species)})
+        arrays.extend([to_bytes(numbers, 'H'), to_bytes(taxids, 'q'), to_bytes(counts, 'q'),
+                       to_bytes(species, 'q')])
+    header = json.dumps({'info': info, 'files': files}, sort_keys=True).encode('utf-8')
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(MAGIC + struct.pack('<HI', FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(zlib.compress(b''.join(arrays)))
+    os.rename(tmpfile, filename)
+
+
+def read_partial(filename):
+    """Read a partial result file, see write_partial.
+
+    Arguments:
+        filename: The partial result file.
+
+    Returns:
+        Dictionary with the settings and the QC filter counts.
+        List with the classification file name and a tuple with a
+        dictionary with a counter of taxonomy IDs per barcode, the
+        taxonomy IDs that are classified successfully and a counter with
+        the filter counts for every file.
+
+    Raises:
+        ValueError: If the file is not a partial result of this format version.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    start = len(MAGIC) + struct.calcsize('<HI')
+    if not data.startswith(MAGIC) or len(data) < start:
+        raise ValueError(filename + " is not a partial OTU table")
+    version, length = struct.unpack('<HI', data[len(MAGIC):start])
+    if version != FORMAT_VERSION:
+        raise ValueError("{} has format version {}, version {} is supported".format(
+            filename, version, FORMAT_VERSION))
+    header = json.loads(data[start:start + length].decode('utf-8'))
+    body = zlib.decompress(data[start + length:])
+    info = header['info']
+    barcodes = info['barcodes']
+    results = []
+    offset = 0
+    for entry in header['files']:
+        values = []
+        for typecode, size in (('H', entry['entries']), ('q', entry['entries']), ('q', entry['entries']),
+                               ('q', entry['species'])):
+            end = offset + size * array(typecode).itemsize
+            values.append(from_bytes(body[offset:end], typecode))
+            offset = end
+        numbers, taxids, counts, species = values
+        barcodecounts = dict((bc, Counter()) for bc in barcodes)
+        for number, taxid, count in zip(numbers, taxids, counts):
+            barcodecounts[barcodes[number]][taxid] = count
+        results.append((entry['name'], (barcodecounts, set(species), Counter(entry['stats']))))
+    return info, results
+
+
+def merge_partials(filenames):
+    """Read and merge partial result files.
+
+    Arguments:
+        filenames: List of partial result files.
+
+    Returns:
+        Dictionary with the settings of the partial results.
+        List with the results of all files sorted by file name, see read_partial.
+        Counter with the QC filter counts of all partial results.
+
+    Raises:
+        ValueError: If the partial results have different settings or a
+        classification file is in more than one partial result.
+    """
+    info = None
+    results = []
+    qc_stats = Counter()
+    origins = {}
+    for filename in filenames:
+        partial_info, partial_results = read_partial(filename)
+        if info is None:
+            info = partial_info
+        for name in MERGE_SETTINGS:
+            if partial_info[name] != info[name]:
+                raise ValueError("{} has {} {!r} instead of {!r}".format(
+                    filename, name, partial_info[name], info[name]))
+        for csv, result in partial_results:
+            if csv in origins:
+                raise ValueError(csv + " is in " + origins[csv] + " and " + filename)
+            origins[csv] = filename
+            results.append((csv, result))
+        qc_stats.update(partial_info.get('qc_stats', {}))
+    if info is None:
+        raise ValueError("No partial results to merge")
+    results.sort(key=lambda result: result[0])
+    return info, results, qc_stats
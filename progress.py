@@ -0,0 +1,104 @@
+import sys
+import time
+
+from metrics import format_runtime
+
+
+# Number of rows between two checks of the time, so the time is not read for every row.
+CHECK_ROWS = 1 << 14
+# Minimum number of seconds between two progress lines.
+INTERVAL = 1.0
+
+
+def file_position(f):
+    """Get the number of bytes that are read from an open file.
+
+    The position is taken from the underlying binary file, it can be a
+    read buffer ahead of the lines that are returned, which is precise
+    enough for progress reporting. For a compressed file it is the
+    number of compressed bytes.
+
+    Arguments:
+        f: The open file.
+
+    Returns:
+        The byte offset in the file.
+    """
+    f = getattr(f, 'buffer', f)
+    position = getattr(getattr(f, 'raw', None), 'position', None)
+    if position is None:
+        return f.tell()
+    return position
+
+
+class Progress(object):
+    """Report the progress of reading a file from the byte offset.
+
+    The byte offset is compared to the size of the file, so the file
+    does not have to be read first to count the lines. The progress,
+    rows per second and the remaining time are written at most once per
+    interval.
+    """
+
+    def __init__(self, label, total, interval=INTERVAL, stream=None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = sys.stdout if stream is None else stream
+        self.start = time.time()
+        self.last = self.start
+        try:
+            self.tty = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.tty = False
+
+    def update(self, position, rows):
+        """Write the progress if the interval has passed since the last update.
+
+        Arguments:
+            position: Number of bytes that are read, None if it is not known.
+            rows: Number of rows that are read.
+        """
+        now = time.time()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        self.write(position, rows, now)
+
+    def write(self, position, rows, now):
+        """Write a progress line.
+
+        Arguments:
+            position: Number of bytes that are read, None if it is not known.
+            rows: Number of rows that are read.
+            now: The current time.
+        """
+        seconds = now - self.start
+        line = "{}: {} rows, {} rows/s".format(
+            self.label, rows, int(rows / seconds) if seconds > 0 else rows)
+        if position is not None and self.total:
+            fraction = min(position / float(self.total), 1.0)
+            line = "{}: {:.1f}%{}".format(self.label, fraction * 100, line[len(self.label) + 1:])
+            if 0 < fraction < 1:
+                line += ", ETA " + format_runtime(seconds * (1 - fraction) / fraction)
+        if self.tty:
+            self.stream.write("\r" + line + "\x1b[K")
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def finish(self, rows):
+        """Write the final progress line with the total time.
+
+        Arguments:
+            rows: Number of rows that are read.
+        """
+        now = time.time()
+        seconds = now - self.start
+        line = "{}: 100.0% {} rows, {} rows/s, {}".format(
+            self.label, rows, int(rows / seconds) if seconds > 0 else rows, format_runtime(seconds))
+        if self.tty:
+            self.stream.write("\r" + line + "\x1b[K\n")
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
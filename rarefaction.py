@@ -0,0 +1,165 @@
+import math
+import random
+from bisect import bisect_right
+from collections import Counter
+
+from counts import CountMatrix
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_columns(matrix):
+    """Get the counts of every sample of a CountMatrix.
+
+    Returns:
+        List with a dictionary with row index and count per sample, in column order.
+    """
+    columns = [{} for dummysample in matrix.columns]
+    for row, counts in enumerate(matrix.counts):
+        for column, count in counts.items():
+            if count:
+                columns[column][row] = count
+    return columns
+
+
+def subsample_counts(counts, depth, rng):
+    """Draw reads without replacement from the counts of a sample.
+
+    Drawing from the counts gives the same distribution as a reservoir
+    sample of the reads of the sample, without keeping the reads.
+
+    Arguments:
+        counts: Dictionary with row index and count.
+        depth: Number of reads to draw.
+        rng: The random.Random instance.
+
+    Returns:
+        Dictionary with row index and count of the drawn reads, all counts
+        if the sample has no more than depth reads.
+    """
+    total = sum(counts.values())
+    if total <= depth:
+        return dict(counts)
+    rows = sorted(counts)
+    cumulative = []
+    running = 0
+    for row in rows:
+        running += counts[row]
+        cumulative.append(running)
+    drawn = rng.sample(range(total), depth)
+    if np is not None:
+        found = np.bincount(np.searchsorted(cumulative, drawn, side='right'), minlength=len(rows))
+        return dict((row, int(count)) for row, count in zip(rows, found) if count)
+    sampled = Counter()
+    for index in drawn:
+        sampled[rows[bisect_right(cumulative, index)]] += 1
+    return dict(sampled)
+
+
+def subsample(matrix, depth, seed=0):
+    """Subsample every sample of a CountMatrix to the same number of reads.
+
+    Every sample has its own random generator seeded with the seed and
+    the sample name, so the subsample of a sample does not depend on the
+    other samples or on the reader that counted the reads.
+
+    Arguments:
+        matrix: The CountMatrix.
+        depth: Number of reads per sample.
+
+    Keyword Arguments:
+        seed: Seed of the random generators. (default: {0})
+
+    Returns:
+        A new CountMatrix with the taxa that have reads left, in the same
+        order, and all samples. Samples with less reads are kept as they are.
+    """
+    keys = list(matrix.rows)
+    sampled = CountMatrix()
+    columns = [subsample_counts(counts, depth, random.Random("{}:{}".format(seed, sample)))
+               for sample, counts in zip(matrix.samples(), get_columns(matrix))]
+    rows = sorted(set(row for counts in columns for row in counts))
+    for row in rows:
+        sampled.add_row(keys[row])
+    for sample, counts in zip(matrix.samples(), columns):
+        sampled.add_counts(sample, dict((keys[row], count) for row, count in counts.items()))
+    return sampled
+
+
+def get_depths(matrix, points):
+    """Get evenly spaced depths up to the largest sample.
+
+    Arguments:
+        matrix: The CountMatrix.
+        points: Number of depths.
+
+    Returns:
+        Sorted list of depths.
+    """
+    largest = max(matrix.column_totals() or [0])
+    return sorted(set(int(round(largest * (point + 1) / float(points))) for point in range(points)) - {0})
+
+
+def expected_taxa(counts, depths):
+    """Get the expected number of taxa in random subsamples of a sample.
+
+    Uses the rarefaction formula E(S) = sum(1 - C(N - Ni, n) / C(N, n))
+    for all depths n at once, with a table of log factorials, vectorized
+    if NumPy is installed.
+
+    Arguments:
+        counts: List with the counts of the taxa of the sample.
+        depths: List of depths.
+
+    Returns:
+        List with the expected number of taxa per depth, None for depths
+        larger than the sample.
+    """
+    total = sum(counts)
+    if np is not None:
+        logfactorial = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, total + 1, dtype=np.float64)))))
+        n = np.array(depths, dtype=np.int64)
+        valid = n <= total
+        n = n[valid]
+        rest = total - np.array(counts, dtype=np.int64)[:, None]
+        absent = rest >= n[None, :]
+        rest_n = np.where(absent, rest - n[None, :], 0)
+        logratio = (logfactorial[rest] - logfactorial[rest_n] - logfactorial[total] +
+                    logfactorial[total - n][None, :])
+        expected = (1.0 - np.where(absent, np.exp(logratio), 0.0)).sum(axis=0)
+        result = [None] * len(depths)
+        for index, value in zip(np.nonzero(valid)[0], expected.tolist()):
+            result[index] = value
+        return result
+    result = []
+    for depth in depths:
+        if depth > total:
+            result.append(None)
+            continue
+        expected = 0.0
+        for count in counts:
+            rest = total - count
+            if rest >= depth:
+                expected += 1.0 - math.exp(math.lgamma(rest + 1) - math.lgamma(rest - depth + 1) -
+                                           math.lgamma(total + 1) + math.lgamma(total - depth + 1))
+            else:
+                expected += 1.0
+        result.append(expected)
+    return result
+
+
+def rarefaction_curves(matrix, depths):
+    """Get the rarefaction curve of every sample of a CountMatrix from the counts.
+
+    Arguments:
+        matrix: The CountMatrix.
+        depths: List of depths.
+
+    Returns:
+        List with the expected number of taxa per depth for every sample,
+        in column order.
+    """
+    return [expected_taxa(list(counts.values()), depths) for counts in get_columns(matrix)]
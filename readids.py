@@ -0,0 +1,360 @@
+import heapq
+import sys
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Number of read IDs that are sorted at once before they are merged.
+RUN_SIZE = 1 << 20
+MASK64 = (1 << 64) - 1
+DASHES = (8, 13, 18, 23)
+
+
+def uuid_to_int(read_id):
+    """Convert a UUID read ID to a 128-bit integer.
+
+    Arguments:
+        read_id: Read ID from an EPI2ME csv file.
+
+    Returns:
+        The read ID as an integer or None if the read ID is not a UUID.
+    """
+    if (len(read_id) != 36 or read_id[8] != '-' or read_id[13] != '-' or read_id[18] != '-' or
+            read_id[23] != '-'):
+        return None
+    digits = read_id.replace('-', '')
+    if len(digits) != 32 or not digits.isalnum():
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+if np is not None:
+    HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+    for digit in '0123456789abcdef':
+        HEX_VALUES[ord(digit)] = int(digit, 16)
+        HEX_VALUES[ord(digit.upper())] = int(digit, 16)
+    HEX_COLUMNS = [i for i in range(36) if i not in DASHES]
+
+
+def uuids_to_arrays(read_ids):
+    """Convert many UUID read IDs to 128-bit integers with NumPy.
+
+    Arguments:
+        read_ids: Sequence of read IDs.
+
+    Returns:
+        Boolean array that is True for UUID read IDs.
+        Arrays with the upper and lower 64 bits of the UUID read IDs.
+    """
+    try:
+        raw = np.asarray(read_ids).astype('S37')
+    except UnicodeEncodeError:
+        values = [uuid_to_int(read_id) for read_id in read_ids]
+        valid = np.array([value is not None for value in values], dtype=bool)
+        hi = np.array([value >> 64 for value in values if value is not None], dtype=np.uint64)
+        lo = np.array([value & MASK64 for value in values if value is not None], dtype=np.uint64)
+        return valid, hi, lo
+    chars = raw.view(np.uint8).reshape(-1, 37)
+    valid = (chars[:, 35] != 0) & (chars[:, 36] == 0)
+    hexvalid, hi, lo = chars_to_arrays(chars[valid])
+    valid[valid] = hexvalid
+    return valid, hi, lo
+
+
+def chars_to_arrays(chars):
+    """Convert a matrix with the characters of 36 character read IDs to 128-bit integers.
+
+    Arguments:
+        chars: NumPy uint8 array with one read ID per row and at least 36 columns.
+
+    Returns:
+        Boolean array that is True for UUID read IDs.
+        Arrays with the upper and lower 64 bits of the UUID read IDs.
+    """
+    valid = np.ones(len(chars), dtype=bool)
+    for i in DASHES:
+        valid &= chars[:, i] == ord('-')
+    nibbles = HEX_VALUES[chars[valid][:, HEX_COLUMNS]]
+    hexdigits = (nibbles != 255).all(axis=1)
+    valid[valid] = hexdigits
+    nibbles = nibbles[hexdigits]
+    # Pack two hex digits per byte and read the 16 bytes as two big-endian integers.
+    packed = np.ascontiguousarray((nibbles[:, 0::2] << 4) | nibbles[:, 1::2])
+    halves = packed.view('>u8').astype(np.uint64)
+    return valid, halves[:, 0].copy(), halves[:, 1].copy()
+
+
+def sort_order(hi, lo):
+    """Get the order that sorts 128-bit integers.
+
+    The integers are sorted by the upper 64 bits, which is several times
+    faster than np.lexsort, and the rare integers with the same upper 64
+    bits are sorted by the lower 64 bits after that.
+
+    Arguments:
+        hi: NumPy array with the upper 64 bits.
+        lo: NumPy array with the lower 64 bits.
+
+    Returns:
+        NumPy array with the indices of the integers in sorted order.
+    """
+    order = np.argsort(hi)
+    sortedhi = hi[order]
+    same = np.nonzero(sortedhi[1:] == sortedhi[:-1])[0]
+    if len(same):
+        rows = np.unique(np.concatenate((same, same + 1)))
+        ties = order[rows]
+        order[rows] = ties[np.lexsort((lo[ties], hi[ties]))]
+    return order
+
+
+class ReadIdSet(object):
+    """Compact set of read IDs.
+
+    UUID read IDs are stored as 128-bit integers in two sorted arrays of
+    unsigned 64-bit integers, 16 bytes per read instead of a Python string
+    in a set. Membership is tested with a binary search. Read IDs that
+    are not UUIDs are kept in a normal set.
+
+    Read IDs are added in runs, freeze() sorts and merges the runs. Adding
+    read IDs after freeze() is allowed, the next lookup merges them again.
+    Sorting, merging and bulk lookups are vectorized if NumPy is installed.
+    """
+
+    def __init__(self):
+        self.hi = array('Q')
+        self.lo = array('Q')
+        self.runs = []
+        self.pending = []
+        self.other = set()
+
+    def add(self, read_id):
+        """Add a read ID to the set.
+
+        Arguments:
+            read_id: Read ID from an EPI2ME csv file.
+        """
+        value = uuid_to_int(read_id)
+        if value is None:
+            self.other.add(read_id)
+            return
+        self.pending.append(value)
+        if len(self.pending) >= RUN_SIZE:
+            self._flush()
+
+    def update(self, read_ids):
+        """Add all read IDs of a sequence to the set.
+
+        Arguments:
+            read_ids: Sequence of read IDs.
+        """
+        if np is None or len(read_ids) == 0:
+            for read_id in read_ids:
+                self.add(read_id)
+            return
+        valid, hi, lo = uuids_to_arrays(read_ids)
+        self.update_uuids(hi, lo)
+        if not valid.all():
+            for i in np.nonzero(~valid)[0]:
+                self.other.add(read_ids[i])
+
+    def update_uuids(self, hi, lo):
+        """Add UUID read IDs that are already converted to integers.
+
+        The run is not sorted, freeze() sorts all runs at once with NumPy.
+
+        Arguments:
+            hi: NumPy array with the upper 64 bits of the read IDs.
+            lo: NumPy array with the lower 64 bits of the read IDs.
+        """
+        if len(hi):
+            self.runs.append((array('Q', hi.tobytes()), array('Q', lo.tobytes())))
+
+    def merge(self, other):
+        """Add all read IDs of another ReadIdSet to the set.
+
+        Arguments:
+            other: The ReadIdSet to add.
+        """
+        other.freeze()
+        if len(other.hi):
+            self.runs.append((other.hi, other.lo))
+        self.other.update(other.other)
+
+    def _flush(self):
+        """Sort the pending read IDs and store them as a run."""
+        if self.pending:
+            self.pending.sort()
+            hi = array('Q', [value >> 64 for value in self.pending])
+            lo = array('Q', [value & MASK64 for value in self.pending])
+            self.runs.append((hi, lo))
+            self.pending = []
+
+    def freeze(self):
+        """Merge all runs into the sorted arrays and remove duplicates."""
+        self._flush()
+        if not self.runs:
+            return
+        runs = self.runs
+        if len(self.hi):
+            runs.append((self.hi, self.lo))
+        self.runs = []
+        if np is not None:
+            hi = np.concatenate([np.frombuffer(run[0], dtype=np.uint64) for run in runs])
+            lo = np.concatenate([np.frombuffer(run[1], dtype=np.uint64) for run in runs])
+            order = sort_order(hi, lo)
+            hi = hi[order]
+            lo = lo[order]
+            unique = np.ones(len(hi), dtype=bool)
+            unique[1:] = (hi[1:] != hi[:-1]) | (lo[1:] != lo[:-1])
+            self.hi = array('Q', hi[unique].tobytes())
+            self.lo = array('Q', lo[unique].tobytes())
+            return
+        hi = array('Q')
+        lo = array('Q')
+        last = None
+        for value in heapq.merge(*[self._iter_run(run) for run in runs]):
+            if value != last:
+                hi.append(value >> 64)
+                lo.append(value & MASK64)
+                last = value
+        self.hi = hi
+        self.lo = lo
+
+    @staticmethod
+    def _iter_run(run):
+        """Iterate over the 128-bit integers of a run."""
+        hi, lo = run
+        for i in range(len(hi)):
+            yield (hi[i] << 64) | lo[i]
+
+    def _contains_int(self, value):
+        """Binary search for a 128-bit integer in the sorted arrays."""
+        hi = value >> 64
+        lo = value & MASK64
+        i = bisect_left(self.hi, hi)
+        while i < len(self.hi) and self.hi[i] == hi:
+            if self.lo[i] == lo:
+                return True
+            i += 1
+        return False
+
+    def __contains__(self, read_id):
+        value = uuid_to_int(read_id)
+        if value is None:
+            return read_id in self.other
+        if self.pending or self.runs:
+            self.freeze()
+        return self._contains_int(value)
+
+    def contains_many(self, read_ids):
+        """Test the membership of many read IDs at once.
+
+        Uses a vectorized binary search if NumPy is installed.
+
+        Arguments:
+            read_ids: Sequence of read IDs.
+
+        Returns:
+            List or NumPy array of booleans.
+        """
+        if np is None:
+            return [read_id in self for read_id in read_ids]
+        found = np.zeros(len(read_ids), dtype=bool)
+        if len(read_ids) == 0:
+            return found
+        valid, hi, lo = uuids_to_arrays(read_ids)
+        found[valid] = self.contains_uuids(hi, lo)
+        if self.other:
+            for i in np.nonzero(~valid)[0]:
+                found[i] = read_ids[i] in self.other
+        return found
+
+    def contains_uuids(self, hi, lo):
+        """Test the membership of many UUID read IDs that are converted to integers.
+
+        Arguments:
+            hi: NumPy array with the upper 64 bits of the read IDs.
+            lo: NumPy array with the lower 64 bits of the read IDs.
+
+        Returns:
+            NumPy array of booleans.
+        """
+        if self.pending or self.runs:
+            self.freeze()
+        if not len(self.hi) or not len(hi):
+            return np.zeros(len(hi), dtype=bool)
+        sethi = np.frombuffer(self.hi, dtype=np.uint64)
+        setlo = np.frombuffer(self.lo, dtype=np.uint64)
+        index = np.minimum(np.searchsorted(sethi, hi), len(sethi) - 1)
+        samehi = sethi[index] == hi
+        found = samehi & (setlo[index] == lo)
+        # Read IDs with the same upper 64 bits are rare, check those one by one.
+        nextsame = samehi & ~found & (index + 1 < len(sethi))
+        nextsame[nextsame] = sethi[index[nextsame] + 1] == hi[nextsame]
+        for i in np.nonzero(nextsame)[0]:
+            found[i] = self._contains_int(int(hi[i]) << 64 | int(lo[i]))
+        return found
+
+    def __len__(self):
+        if self.pending or self.runs:
+            self.freeze()
+        return len(self.hi) + len(self.other)
+
+    def nbytes(self):
+        """Get the approximate memory use of the set in bytes."""
+        size = self.hi.itemsize * (len(self.hi) + len(self.lo))
+        for hi, lo in self.runs:
+            size += hi.itemsize * (len(hi) + len(lo))
+        size += sys.getsizeof(self.pending) + sys.getsizeof(self.other)
+        for read_id in self.other:
+            size += sys.getsizeof(read_id)
+        return size
+
+
+
+class ReadIdLevels(object):
+    """Read IDs that are added in batches, as levels of frozen ReadIdSets.
+
+    Every batch is frozen as a new level. A level is merged into the level
+    before it while that level is at most twice as large, so the sizes of
+    the levels grow geometrically. Adding a batch sorts and merges each
+    read ID a logarithmic number of times instead of merging the batch
+    into all read IDs that were added before.
+    """
+
+    def __init__(self):
+        self.levels = []
+
+    def add_batch(self, read_ids):
+        """Add a batch of read IDs as a new level.
+
+        Arguments:
+            read_ids: Sequence of read IDs.
+        """
+        level = ReadIdSet()
+        level.update(read_ids)
+        level.freeze()
+        self.levels.append(level)
+        while len(self.levels) > 1 and len(self.levels[-2]) <= 2 * len(self.levels[-1]):
+            level = self.levels.pop()
+            self.levels[-1].merge(level)
+            self.levels[-1].freeze()
+
+    def __contains__(self, read_id):
+        for level in reversed(self.levels):
+            if read_id in level:
+                return True
+        return False
+
+    def nbytes(self):
+        """Get the approximate memory use of all levels in bytes."""
+        return sum(level.nbytes() for level in self.levels)
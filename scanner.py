@@ -0,0 +1,115 @@
+import os
+import mmap
+from collections import Counter
+
+from layouts import CLASSIFICATION_FIELDS, CLASSIFICATION_LAYOUT, read_layout
+from progress import CHECK_ROWS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Number of reads that are looked up in the QC read IDs at once.
+BATCH_ROWS = 1 << 16
+SUCCESSFUL = b"Classification successful"
+
+
+def scan_classification_file(filename, barcodes, minaccuracy, ok_read_ids, layout=None, report=None):
+    """Count the reads per barcode and taxid in a classification file with a memory map.
+
+    The file is mapped instead of read, the lines are split up to the
+    accuracy column and only the read ID is decoded. The read IDs are
+    looked up in batches, vectorized if NumPy is installed, so the
+    memory use does not depend on the size of the file.
+
+    Arguments:
+        filename: The uncompressed classification file.
+        barcodes: List of barcodes to count.
+        minaccuracy: Minimum accuracy per read.
+        ok_read_ids: ReadIdSet with the reads that passed the QC filtering.
+
+    Keyword Arguments:
+        layout: Layout of the file, detected from the header if None. (default: {None})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A dictionary with a counter of taxonomy IDs per barcode.
+        All taxonomy IDs that are classified successfully in the file.
+        A counter with the number of rows and the rows that failed the
+        parse, barcode, accuracy and qc filters.
+
+    Raises:
+        ValueError: If the header does not match the classification layout.
+    """
+    if layout is None:
+        layout = read_layout(filename, [CLASSIFICATION_LAYOUT], CLASSIFICATION_LAYOUT)
+    read_id_column, status_column, taxid_column, barcode_column, acc_column = [
+        layout[field] for field in CLASSIFICATION_FIELDS]
+    maxsplit = layout.maxsplit(CLASSIFICATION_FIELDS)
+    counts = dict((bc.encode('utf-8'), Counter()) for bc in barcodes)
+    species = set()
+    stats = Counter()
+    rows = 0
+    batch = []
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                mm.readline()
+                for line in iter(mm.readline, b''):
+                    rows += 1
+                    if report is not None and not rows % CHECK_ROWS:
+                        report.update(mm.tell(), rows)
+                    content = line.rstrip(b'\r\n').split(b',', maxsplit)
+                    try:
+                        barcode = content[barcode_column]
+                        if barcode == b"NA":
+                            stats['barcode'] += 1
+                            continue
+                        if not float(content[acc_column]) >= minaccuracy:
+                            stats['accuracy'] += 1
+                            continue
+                        batch.append((content[read_id_column].decode('utf-8', 'replace'), barcode,
+                                      int(content[taxid_column]), content[status_column] == SUCCESSFUL))
+                    except (IndexError, ValueError):
+                        stats['parse'] += 1
+                        continue
+                    if len(batch) >= BATCH_ROWS:
+                        count_batch(batch, ok_read_ids, counts, species, stats)
+                        batch = []
+            finally:
+                mm.close()
+    count_batch(batch, ok_read_ids, counts, species, stats)
+    if report is not None:
+        report.finish(rows)
+    stats['rows'] = rows
+    return dict((bc, counts[bc.encode('utf-8')]) for bc in barcodes), species, stats
+
+
+def count_batch(batch, ok_read_ids, counts, species, stats):
+    """Count the reads of a batch that passed the QC filtering.
+
+    Arguments:
+        batch: List with the read ID, barcode, taxonomy ID and if the
+            classification was successful of every read.
+        ok_read_ids: ReadIdSet with the reads that passed the QC filtering.
+        counts: Dictionary with a counter of taxonomy IDs per encoded barcode.
+        species: Set with the taxonomy IDs that are classified successfully.
+        stats: Counter with the number of reads that failed the qc filter.
+    """
+    if not batch:
+        return
+    if np is None:
+        found = [read_id in ok_read_ids for read_id, dummybarcode, dummytaxid, dummysuccessful in batch]
+    else:
+        found = ok_read_ids.contains_many([row[0] for row in batch]).tolist()
+    for (dummyread_id, barcode, taxid, successful), passed in zip(batch, found):
+        if not passed:
+            stats['qc'] += 1
+            continue
+        if barcode in counts:
+            counts[barcode][taxid] += 1
+        if successful:
+            species.add(taxid)
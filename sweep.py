@@ -0,0 +1,197 @@
+from bisect import bisect_right
+from collections import Counter
+
+from compressed import open_csv
+from layouts import CLASSIFICATION_LAYOUT, QC_LAYOUT, classification_parser, qc_parser, read_layout
+from progress import CHECK_ROWS, file_position
+from readids import ReadIdSet
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Number of reads that are looked up in the qscore bins at once.
+BATCH_ROWS = 1 << 16
+
+
+def get_bin(thresholds, value):
+    """Get the number of thresholds a value passes.
+
+    Arguments:
+        thresholds: Sorted list of minimum values.
+        value: The value, i.e. the mean qscore or the accuracy of a read.
+
+    Returns:
+        0 if the value is below all thresholds, otherwise the number of
+        the highest threshold that is passed, counted from 1.
+    """
+    if not value >= thresholds[0]:
+        return 0
+    return bisect_right(thresholds, value)
+
+
+def filter_qc_file(filename, qscores, minseqlen=1400, maxseqlen=1700, layout=None, report=None):
+    """Read a QC file and bin the reads by the qscore thresholds they pass.
+
+    Arguments:
+        filename: The QC file.
+        qscores: Sorted list of minimum mean qscores.
+
+    Keyword Arguments:
+        minseqlen: Minimum read length. (default: {1400})
+        maxseqlen: Maximum read length. (default: {1700})
+        layout: Layout of the file, detected from the header if None. (default: {None})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A list with a ReadIdSet per qscore, with the reads that pass that
+        qscore and not the next one.
+        A counter with the number of rows and the rows that failed the
+        parse, barcode, seqlen and qscore filters, the qscore filter with
+        the lowest qscore.
+
+    Raises:
+        ValueError: If the header does not match the QC layout.
+    """
+    if layout is None:
+        layout = read_layout(filename, [QC_LAYOUT], QC_LAYOUT)
+    parse_qc_line = qc_parser(layout, qscores[0], minseqlen, maxseqlen)
+    bins = [ReadIdSet() for dummyqscore in qscores]
+    stats = Counter()
+    linenr = 0
+    with open_csv(filename) as qf:
+        qf.readline()
+        for line in qf:
+            linenr += 1
+            if report is not None and not linenr % CHECK_ROWS:
+                report.update(file_position(qf), linenr)
+            passed = parse_qc_line(line)
+            if passed.__class__ is tuple:
+                bins[get_bin(qscores, passed[2]) - 1].add(passed[0])
+            else:
+                stats[passed] += 1
+    if report is not None:
+        report.finish(linenr)
+    for read_ids in bins:
+        read_ids.freeze()
+    stats['rows'] = linenr
+    return bins, stats
+
+
+def get_qscore_bins(bins, read_ids):
+    """Get the qscore bin of many reads.
+
+    Arguments:
+        bins: List with a ReadIdSet per qscore.
+        read_ids: List of read IDs.
+
+    Returns:
+        List with the number of the bin of every read, 0 if the read did
+        not pass the QC filtering.
+    """
+    if np is not None:
+        found = np.zeros(len(read_ids), dtype=np.int64)
+        for number, bin_read_ids in enumerate(bins, 1):
+            found[bin_read_ids.contains_many(read_ids)] = number
+        return found.tolist()
+    found = []
+    for read_id in read_ids:
+        for number, bin_read_ids in enumerate(bins, 1):
+            if read_id in bin_read_ids:
+                found.append(number)
+                break
+        else:
+            found.append(0)
+    return found
+
+
+def scan_classification_file(filename, accuracies, bins, layout=None, report=None):
+    """Count the reads of a classification file per qscore and accuracy bin.
+
+    Arguments:
+        filename: The classification file.
+        accuracies: Sorted list of minimum accuracies.
+        bins: List with a ReadIdSet per qscore, see filter_qc_file.
+
+    Keyword Arguments:
+        layout: Layout of the file, detected from the header if None. (default: {None})
+        report: Progress of the file or None. (default: {None})
+
+    Returns:
+        A counter with the barcode, taxonomy ID, if the classification was
+        successful, the qscore bin and the accuracy bin of the reads.
+        A counter with the number of rows and the rows that failed the
+        parse, barcode, accuracy and qc filters, the accuracy filter with
+        the lowest accuracy and the qc filter with the lowest qscore.
+
+    Raises:
+        ValueError: If the header does not match the classification layout.
+    """
+    if layout is None:
+        layout = read_layout(filename, [CLASSIFICATION_LAYOUT], CLASSIFICATION_LAYOUT)
+    parse_classification_line = classification_parser(layout, accuracies[0])
+    histogram = Counter()
+    stats = Counter()
+    batch = []
+    linenr = 0
+    with open_csv(filename) as nf:
+        nf.readline()
+        for line in nf:
+            linenr += 1
+            if report is not None and not linenr % CHECK_ROWS:
+                report.update(file_position(nf), linenr)
+            classification = parse_classification_line(line)
+            if classification.__class__ is not tuple:
+                stats[classification] += 1
+                continue
+            read_id, barcode, taxid, successful, accuracy = classification
+            batch.append((read_id, barcode, taxid, successful, get_bin(accuracies, accuracy)))
+            if len(batch) >= BATCH_ROWS:
+                count_batch(batch, bins, histogram, stats)
+                batch = []
+    count_batch(batch, bins, histogram, stats)
+    if report is not None:
+        report.finish(linenr)
+    stats['rows'] = linenr
+    return histogram, stats
+
+
+def count_batch(batch, bins, histogram, stats):
+    """Add the reads of a batch that passed the QC filtering to the histogram."""
+    if not batch:
+        return
+    qscore_bins = get_qscore_bins(bins, [row[0] for row in batch])
+    for (dummyread_id, barcode, taxid, successful, accuracy_bin), qscore_bin in zip(batch, qscore_bins):
+        if qscore_bin:
+            histogram[(barcode, taxid, successful, qscore_bin, accuracy_bin)] += 1
+        else:
+            stats['qc'] += 1
+
+
+def get_counts(histogram, barcodes, qscore_index, accuracy_index):
+    """Get the counts of a classification file for one combination of thresholds.
+
+    Arguments:
+        histogram: The counter of scan_classification_file.
+        barcodes: List of barcodes to count.
+        qscore_index: Index of the minimum qscore in the sorted qscores.
+        accuracy_index: Index of the minimum accuracy in the sorted accuracies.
+
+    Returns:
+        A dictionary with a counter of taxonomy IDs per barcode.
+        All taxonomy IDs that are classified successfully.
+        A counter with the number of reads that passed the thresholds.
+    """
+    barcodecounts = dict((bc, Counter()) for bc in barcodes)
+    species = set()
+    stats = Counter()
+    for (barcode, taxid, successful, qscore_bin, accuracy_bin), count in histogram.items():
+        if qscore_bin > qscore_index and accuracy_bin > accuracy_index:
+            if barcode in barcodecounts:
+                barcodecounts[barcode][taxid] += count
+            if successful:
+                species.add(taxid)
+            stats['passed'] += count
+    return barcodecounts, species, stats
@@ -0,0 +1,280 @@
+import os
+import json
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+# Output formats next to the csv tables and the package they need.
+FORMATS = ["biom", "hdf5", "parquet", "npz"]
+REQUIREMENTS = {"hdf5": "h5py", "parquet": "pyarrow", "npz": "numpy"}
+
+
+def missing_requirement(fmt):
+    """Get the package that is needed for an output format and not installed.
+
+    Arguments:
+        fmt: The output format.
+
+    Returns:
+        The name of the package or None if the format can be written.
+    """
+    installed = {"h5py": h5py is not None and np is not None, "pyarrow": pa is not None,
+                 "numpy": np is not None}
+    requirement = REQUIREMENTS.get(fmt)
+    if requirement is None or installed[requirement]:
+        return None
+    return requirement
+
+
+def get_entries(matrix, keys):
+    """Get the non-zero counts and percentages of a CountMatrix.
+
+    Arguments:
+        matrix: The CountMatrix.
+        keys: The taxa in the order of the table.
+
+    Returns:
+        Lists with the row, column, count and percentage of the non-zero
+        entries, ordered by row and column.
+    """
+    totals = matrix.column_totals()
+    rows = []
+    columns = []
+    counts = []
+    percentages = []
+    for row, key in enumerate(keys):
+        for column, count in sorted(matrix.counts[matrix.rows[key]].items()):
+            if count:
+                rows.append(row)
+                columns.append(column)
+                counts.append(count)
+                percentages.append(100.0 * count / totals[column])
+    return rows, columns, counts, percentages
+
+
+def write_tables(formats, names, matrix, keys, samples, metadata_columns, metadata, generated_by):
+    """Write the counts and percentages of a CountMatrix in sparse output formats.
+
+    BIOM tables hold one matrix, so the counts and the percentages are
+    written as two tables like the csv files. Parquet and npz files hold
+    both, one entry per non-zero count.
+
+    Arguments:
+        formats: List of output formats, biom, hdf5, parquet or npz.
+        names: Tuple with the path without extension of the count table,
+            the percentage table and the table with both.
+        matrix: The CountMatrix.
+        keys: The taxa in the order of the table.
+        samples: The sample names in column order.
+        metadata_columns: Names of the metadata of the taxa, i.e. the lineage.
+        metadata: Dictionary with taxon and a list of metadata values.
+        generated_by: Name of the program for the BIOM tables.
+
+    Returns:
+        List with the files that are written.
+    """
+    count_name, percentage_name, name = names
+    rows, columns, counts, percentages = get_entries(matrix, keys)
+    ids = [str(key) for key in keys]
+    lineages = [[str(value) for value in metadata[key]] for key in keys]
+    files = []
+    for fmt in formats:
+        if fmt == "biom":
+            for filename, values, dtype in ((count_name + ".biom", counts, "int"),
+                                            (percentage_name + ".biom", percentages, "float")):
+                write_biom_json(filename, ids, samples, (rows, columns, values), dtype,
+                                metadata_columns, lineages, generated_by)
+                files.append(filename)
+        elif fmt == "hdf5":
+            for filename, values in ((count_name + ".biom.h5", counts),
+                                     (percentage_name + ".biom.h5", percentages)):
+                write_biom_hdf5(filename, ids, samples, (rows, columns, values),
+                                metadata_columns, lineages, generated_by)
+                files.append(filename)
+        elif fmt == "parquet":
+            write_parquet(name + ".parquet", ids, samples, (rows, columns, counts, percentages),
+                          metadata_columns, lineages)
+            files.append(name + ".parquet")
+        elif fmt == "npz":
+            write_npz(name + ".npz", ids, samples, (rows, columns, counts, percentages),
+                      metadata_columns, lineages)
+            files.append(name + ".npz")
+    return files
+
+
+def get_observation_metadata(metadata_columns, lineage):
+    """Get the BIOM metadata of a taxon, the lineage is stored as taxonomy."""
+    if not metadata_columns:
+        return None
+    return {"taxonomy": lineage}
+
+
+def write_biom_json(filename, ids, samples, entries, dtype, metadata_columns, lineages, generated_by):
+    """Write a sparse BIOM 1.0 table in JSON format.
+
+    Arguments:
+        filename: The BIOM file.
+        ids: The taxon IDs in row order.
+        samples: The sample names in column order.
+        entries: Tuple with the rows, columns and values of the non-zero entries.
+        dtype: Type of the values, int or float.
+        metadata_columns: Names of the metadata of the taxa.
+        lineages: List with the metadata values of every taxon.
+        generated_by: Name of the program.
+    """
+    rows, columns, values = entries
+    table = {
+        "id": os.path.basename(filename),
+        "format": "Biological Observation Matrix 1.0.0",
+        "format_url": "http://biom-format.org",
+        "type": "OTU table",
+        "generated_by": generated_by,
+        "date": datetime.now().isoformat(),
+        "rows": [{"id": taxon, "metadata": get_observation_metadata(metadata_columns, lineage)}
+                 for taxon, lineage in zip(ids, lineages)],
+        "columns": [{"id": sample, "metadata": None} for sample in samples],
+        "matrix_type": "sparse",
+        "matrix_element_type": dtype,
+        "shape": [len(ids), len(samples)],
+        "data": [list(entry) for entry in zip(rows, columns, values)]}
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(table, f, separators=(',', ':'))
+    os.rename(tmpfile, filename)
+
+
+def write_biom_hdf5(filename, ids, samples, entries, metadata_columns, lineages, generated_by):
+    """Write a sparse BIOM 2.1 table in HDF5 format.
+
+    The matrix is stored compressed by row and by column as the format
+    requires, the values are stored as floats.
+
+    Arguments:
+        filename: The BIOM file.
+        ids: The taxon IDs in row order.
+        samples: The sample names in column order.
+        entries: Tuple with the rows, columns and values of the non-zero entries,
+            ordered by row and column.
+        metadata_columns: Names of the metadata of the taxa.
+        lineages: List with the metadata values of every taxon.
+        generated_by: Name of the program.
+
+    Raises:
+        ImportError: If h5py or NumPy is not installed.
+    """
+    if missing_requirement("hdf5"):
+        raise ImportError("h5py and NumPy are required to write BIOM HDF5 tables")
+    rows = np.array(entries[0], dtype=np.int32)
+    columns = np.array(entries[1], dtype=np.int32)
+    values = np.array(entries[2], dtype=np.float64)
+    strings = h5py.special_dtype(vlen=str)
+    tmpfile = filename + '.tmp'
+    with h5py.File(tmpfile, 'w') as f:
+        f.attrs['id'] = os.path.basename(filename)
+        f.attrs['type'] = "OTU table"
+        f.attrs['format-url'] = "http://biom-format.org"
+        f.attrs['format-version'] = (2, 1)
+        f.attrs['generated-by'] = generated_by
+        f.attrs['creation-date'] = datetime.now().isoformat()
+        f.attrs['shape'] = (len(ids), len(samples))
+        f.attrs['nnz'] = len(values)
+        for axis, axis_ids, major, minor, size in (
+                ("observation", ids, rows, columns, len(ids)),
+                ("sample", samples, columns, rows, len(samples))):
+            order = np.lexsort((minor, major))
+            group = f.create_group(axis)
+            group.create_dataset('ids', data=np.array(axis_ids, dtype=object), dtype=strings)
+            group.create_dataset('matrix/data', data=values[order], compression='gzip')
+            group.create_dataset('matrix/indices', data=minor[order], compression='gzip')
+            group.create_dataset('matrix/indptr', data=np.concatenate(
+                ([0], np.cumsum(np.bincount(major, minlength=size)))).astype(np.int32))
+            group.create_group('metadata')
+            group.create_group('group-metadata')
+        if metadata_columns:
+            f['observation/metadata'].create_dataset(
+                'taxonomy', data=np.array(lineages, dtype=object), dtype=strings)
+    os.rename(tmpfile, filename)
+
+
+def write_parquet(filename, ids, samples, entries, metadata_columns, lineages):
+    """Write the non-zero entries as a Parquet table with one row per taxon and sample.
+
+    The taxon, sample and metadata columns are dictionary encoded.
+
+    Arguments:
+        filename: The Parquet file.
+        ids: The taxon IDs in row order.
+        samples: The sample names in column order.
+        entries: Tuple with the rows, columns, counts and percentages of the non-zero entries.
+        metadata_columns: Names of the metadata of the taxa.
+        lineages: List with the metadata values of every taxon.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    if missing_requirement("parquet"):
+        raise ImportError("pyarrow is required to write Parquet tables")
+    rows, columns, counts, percentages = entries
+    indices = pa.array(rows, type=pa.int32())
+    arrays = [pa.DictionaryArray.from_arrays(indices, pa.array(ids, type=pa.string()))]
+    names = ["taxon"]
+    for number, column in enumerate(metadata_columns):
+        arrays.append(pa.DictionaryArray.from_arrays(
+            indices, pa.array([lineage[number] for lineage in lineages], type=pa.string())))
+        names.append(column)
+    arrays.append(pa.DictionaryArray.from_arrays(
+        pa.array(columns, type=pa.int32()), pa.array(samples, type=pa.string())))
+    arrays.append(pa.array(counts, type=pa.int64()))
+    arrays.append(pa.array(percentages, type=pa.float64()))
+    names.extend(["sample", "count", "percentage"])
+    tmpfile = filename + '.tmp'
+    pq.write_table(pa.Table.from_arrays(arrays, names=names), tmpfile)
+    os.rename(tmpfile, filename)
+
+
+def write_npz(filename, ids, samples, entries, metadata_columns, lineages):
+    """Write the non-zero entries in a compressed NumPy npz file.
+
+    The file has the arrays taxa, samples, metadata_columns and metadata
+    with a row per taxon, and row, column, count and percentage with the
+    non-zero entries in coordinate format.
+
+    Arguments:
+        filename: The npz file.
+        ids: The taxon IDs in row order.
+        samples: The sample names in column order.
+        entries: Tuple with the rows, columns, counts and percentages of the non-zero entries.
+        metadata_columns: Names of the metadata of the taxa.
+        lineages: List with the metadata values of every taxon.
+
+    Raises:
+        ImportError: If NumPy is not installed.
+    """
+    if missing_requirement("npz"):
+        raise ImportError("NumPy is required to write npz tables")
+    rows, columns, counts, percentages = entries
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        np.savez_compressed(
+            f, taxa=np.array(ids, dtype=str), samples=np.array(samples, dtype=str),
+            metadata_columns=np.array(metadata_columns, dtype=str),
+            metadata=np.array(lineages, dtype=str).reshape(len(ids), len(metadata_columns)),
+            shape=np.array([len(ids), len(samples)]), row=np.array(rows, dtype=np.int32),
+            column=np.array(columns, dtype=np.int32), count=np.array(counts, dtype=np.int64),
+            percentage=np.array(percentages, dtype=np.float64))
+    os.rename(tmpfile, filename)
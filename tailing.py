@@ -0,0 +1,65 @@
+import os
+
+
+# Maximum number of bytes that are read from a file at once.
+READ_SIZE = 1 << 26
+
+
+class FileTail(object):
+    """Read the lines that are added to a growing csv file.
+
+    The byte offset after the last complete line is kept, so every line
+    is read once. A partial last line is read when it is complete.
+    """
+
+    def __init__(self, filename, header=True):
+        self.filename = filename
+        self.header = header
+        self.offset = 0
+
+    def truncated(self):
+        """Check if the file is smaller than the part that is already read,
+        i.e. if the file was replaced.
+        """
+        try:
+            return os.path.getsize(self.filename) < self.offset
+        except OSError:
+            return False
+
+    def reset(self):
+        """Read the file from the start again."""
+        self.offset = 0
+
+    def read_header(self):
+        """Read the first line of the file.
+
+        Returns:
+            The first line without line ending, None if the first line is
+            not complete yet.
+        """
+        with open(self.filename, 'rb') as f:
+            line = f.readline(READ_SIZE)
+        if not line.endswith(b'\n'):
+            return None
+        return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def read_lines(self):
+        """Read the complete lines that were added since the last call.
+
+        Returns:
+            Generator with the new lines without line endings, the header
+            line is skipped.
+        """
+        with open(self.filename, 'rb') as f:
+            while True:
+                f.seek(self.offset)
+                data = f.read(READ_SIZE)
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    return
+                lines = data[:end].decode('utf-8', 'replace').split('\n')[:-1]
+                if self.offset == 0 and self.header:
+                    lines = lines[1:]
+                self.offset += end
+                for line in lines:
+                    yield line
@@ -0,0 +1,447 @@
+import os
+import sqlite3
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_ANNOTATION_CACHE = os.path.join(os.environ.get(
+    'HOME', '/'), '.etetoolkit', 'taxa_annotations.sqlite')
+# Stay below the default SQLITE_MAX_VARIABLE_NUMBER of 999.
+SQLITE_MAX_VARIABLES = 900
+
+
+def chunks(items, size=SQLITE_MAX_VARIABLES):
+    """Split a list in lists with a maximum size.
+
+    Arguments:
+        items: The list to split.
+
+    Keyword Arguments:
+        size: Maximum size of a chunk. (default: {SQLITE_MAX_VARIABLES})
+
+    Returns:
+        Generator with the chunks.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LRUCache(object):
+    """Dictionary with a maximum size that evicts the least recently used item.
+
+    Keeps track of the number of hits and misses.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """Get a value and mark it as recently used.
+
+        Arguments:
+            key: The key to look up.
+
+        Keyword Arguments:
+            default: Value returned if the key is not cached. (default: {None})
+
+        Returns:
+            The cached value or the default.
+        """
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Add a value and evict the oldest values if the cache is full.
+
+        Arguments:
+            key: The key to store.
+            value: The value to store.
+        """
+        self.data.pop(key, None)
+        self.data[key] = value
+        while self.maxsize is not None and len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        """Remove all values and reset the counters."""
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def get_taxadb_signature(dbfile):
+    """Get a string that changes when the NCBI taxonomy database changes.
+
+    Arguments:
+        dbfile: The NCBI taxonomy database file or None.
+
+    Returns:
+        The database version from the stats table, modification time and
+        size, None for the parts that can not be read.
+    """
+    if dbfile is None or not os.path.isfile(dbfile):
+        return '{}:{}:{}'.format(None, None, None)
+    try:
+        db = sqlite3.connect(dbfile)
+        try:
+            version = db.execute('SELECT version FROM stats;').fetchone()[0]
+        finally:
+            db.close()
+    except (sqlite3.OperationalError, TypeError):
+        version = None
+    try:
+        stat = os.stat(dbfile)
+        mtime, size = int(stat.st_mtime), stat.st_size
+    except OSError:
+        mtime, size = None, None
+    return '{}:{}:{}'.format(version, mtime, size)
+
+
+class AnnotationCache(object):
+    """Persistent taxid to name, rank and lineage cache in a SQLite file.
+
+    The cache is cleared automatically when the signature of the NCBI
+    taxonomy database changes, i.e. after an update of taxa.sqlite.
+    """
+
+    kinds = ('names', 'ranks', 'lineages')
+
+    def __init__(self, filename=DEFAULT_ANNOTATION_CACHE, dbfile=None):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);')
+        signature = get_taxadb_signature(dbfile)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'taxadb';").fetchone()
+        if row is None or row[0] != signature:
+            for kind in self.kinds:
+                self.db.execute('DROP TABLE IF EXISTS {};'.format(kind))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('taxadb', ?);", (signature,))
+        for kind in self.kinds:
+            self.db.execute('CREATE TABLE IF NOT EXISTS {} (taxid INTEGER PRIMARY KEY, value TEXT);'.format(kind))
+        self.db.commit()
+
+    def get(self, kind, taxids):
+        """Get cached values of one kind.
+
+        Arguments:
+            kind: One of names, ranks or lineages.
+            taxids: List of taxonomy IDs.
+
+        Returns:
+            Dictionary with taxid and value for all taxids that are cached.
+        """
+        taxids = list(taxids)
+        found = {}
+        for chunk in chunks(taxids):
+            query = 'SELECT taxid, value FROM {} WHERE taxid IN ({});'.format(kind, ','.join('?' * len(chunk)))
+            for taxid, value in self.db.execute(query, chunk):
+                if kind == 'lineages':
+                    value = [int(ltaxid) for ltaxid in value.split(',')]
+                found[taxid] = value
+        self.hits += len(found)
+        self.misses += len(taxids) - len(found)
+        return found
+
+    def put(self, kind, items):
+        """Store values of one kind.
+
+        Arguments:
+            kind: One of names, ranks or lineages.
+            items: Dictionary with taxid and value, None values are skipped.
+        """
+        rows = []
+        for taxid, value in items.items():
+            if value is not None:
+                if kind == 'lineages':
+                    value = ','.join(str(ltaxid) for ltaxid in value)
+                rows.append((taxid, value))
+        if rows:
+            self.db.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?);'.format(kind), rows)
+            self.db.commit()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM lineages;').fetchone()[0]
+
+    def close(self):
+        """Close the cache file."""
+        self.db.close()
+
+
+class TaxonomyResolver(object):
+    """Memoize taxid to name, rank and lineage lookups from the NCBI taxonomy database.
+
+    A run only contains a few hundred distinct taxids, so most lookups
+    are answered from memory instead of the taxa.sqlite database.
+    Lookups that are not in memory are tried in the optional persistent
+    AnnotationCache before the taxa.sqlite database is queried.
+    """
+
+    def __init__(self, ncbi, maxsize=DEFAULT_CACHE_SIZE, annotations=None):
+        self.ncbi = ncbi
+        self.annotations = annotations
+        self.queries = 0
+        self.names = LRUCache(maxsize)
+        self.ranks = LRUCache(maxsize)
+        self.lineages = LRUCache(maxsize)
+
+    def _load(self, kind, cache, taxids):
+        """Copy values from the persistent cache to a memory cache.
+
+        Arguments:
+            kind: One of names, ranks or lineages.
+            cache: The memory cache of this kind.
+            taxids: List of taxonomy IDs that are not in the memory cache.
+
+        Returns:
+            Dictionary with taxid and value for the taxids in the persistent cache.
+        """
+        if self.annotations is None or not taxids:
+            return {}
+        found = self.annotations.get(kind, taxids)
+        for taxid, value in found.items():
+            cache.put(taxid, value)
+        return found
+
+    def _store(self, kind, items):
+        """Add values to the persistent cache if there is one."""
+        if self.annotations is not None and items:
+            self.annotations.put(kind, items)
+
+    def _lookup(self, kind, cache, taxids, translator):
+        """Get cached values and look up all missing taxids with one query.
+
+        Arguments:
+            kind: One of names, ranks or lineages.
+            cache: The cache to use.
+            taxids: List of taxonomy IDs.
+            translator: NCBITaxa function that translates a list of taxids.
+
+        Returns:
+            Dictionary with taxid and value for all taxids that are found.
+        """
+        found = {}
+        missing = []
+        for taxid in taxids:
+            taxid = int(taxid)
+            value = cache.get(taxid, cache)
+            if value is cache:
+                missing.append(taxid)
+            elif value is not None:
+                found[taxid] = value
+        if missing:
+            loaded = self._load(kind, cache, missing)
+            found.update(loaded)
+            missing = [taxid for taxid in missing if taxid not in loaded]
+        if missing:
+            self.queries += 1
+            translated = translator(missing)
+            for taxid in missing:
+                value = translated.get(taxid)
+                cache.put(taxid, value)
+                if value is not None:
+                    found[taxid] = value
+            self._store(kind, translated)
+        return found
+
+    def get_names(self, taxids):
+        """Translate taxonomy IDs to scientific names.
+
+        Arguments:
+            taxids: List of taxonomy IDs.
+
+        Returns:
+            Dictionary with taxid and name.
+        """
+        return self._lookup('names', self.names, taxids, self.ncbi.get_taxid_translator)
+
+    def get_ranks(self, taxids):
+        """Get the rank of taxonomy IDs.
+
+        Arguments:
+            taxids: List of taxonomy IDs.
+
+        Returns:
+            Dictionary with taxid and rank.
+        """
+        return self._lookup('ranks', self.ranks, taxids, self.ncbi.get_rank)
+
+    def get_name(self, taxid):
+        """Get the scientific name of a taxonomy ID or None if it is unknown."""
+        return self.get_names([taxid]).get(int(taxid))
+
+    def get_rank(self, taxid):
+        """Get the rank of a taxonomy ID or None if it is unknown."""
+        return self.get_ranks([taxid]).get(int(taxid))
+
+    def get_lineage(self, taxid):
+        """Get the lineage of a taxonomy ID from root to taxid.
+
+        Arguments:
+            taxid: Taxonomy ID.
+
+        Returns:
+            List of taxonomy IDs.
+
+        Raises:
+            ValueError: If the taxid is not in the NCBI taxonomy database.
+        """
+        taxid = int(taxid)
+        lineage = self.lineages.get(taxid)
+        if lineage is None:
+            lineage = self._load('lineages', self.lineages, [taxid]).get(taxid)
+        if lineage is None:
+            self.queries += 1
+            lineage = self.ncbi.get_lineage(taxid)
+            self.lineages.put(taxid, lineage)
+            self._store('lineages', {taxid: lineage})
+        return lineage
+
+    def get_desired_ranks(self, taxid, desired_ranks):
+        """Finds the taxonomy IDs of the desired ranks in the lineage of a taxid.
+
+        Arguments:
+            taxid: Taxonomy ID from EPI2ME csv file.
+            desired_ranks: The desired ranks to find based on the taxonomy ID.
+
+        Returns:
+            Dictionary with '<rank>_id' and the taxid or '<not present>'.
+        """
+        lineage2ranks = self.get_ranks(self.get_lineage(taxid))
+        ranks2lineage = dict((rank, ltaxid)
+                             for (ltaxid, rank) in lineage2ranks.items())
+        return dict(('{}_id'.format(rank), ranks2lineage.get(rank, '<not present>'))
+                    for rank in desired_ranks)
+
+    def _query(self, sql, taxids):
+        """Run a query with a taxid IN clause for a list of taxids.
+
+        Arguments:
+            sql: Query with a {} placeholder for the list of parameters.
+            taxids: List of taxonomy IDs.
+
+        Returns:
+            All rows returned for all taxids.
+        """
+        rows = []
+        for chunk in chunks(list(taxids)):
+            query = sql.format(','.join('?' * len(chunk)))
+            self.queries += 1
+            rows.extend(self.ncbi.db.execute(query, chunk).fetchall())
+        return rows
+
+    def resolve_lineages(self, taxids):
+        """Look up the lineages, names and ranks of many taxids at once.
+
+        The lineages are read from the track column of the species table
+        and the names and ranks of all taxids in the lineages are read
+        with one query per chunk instead of three queries per taxid.
+        Merged taxids get the lineage of the taxid they are merged into.
+        Values in the persistent cache are not queried again.
+
+        Arguments:
+            taxids: List of taxonomy IDs.
+        """
+        missing = set(int(taxid) for taxid in taxids) - set(self.lineages.data)
+        if not missing:
+            return
+        lineages = self._load('lineages', self.lineages, list(missing))
+        missing = missing - set(lineages)
+        tracks = dict(self._query('SELECT taxid, track FROM species WHERE taxid IN ({});', missing))
+        merged = missing - set(tracks)
+        if merged:
+            merged = dict(self._query('SELECT taxid_old, taxid_new FROM merged WHERE taxid_old IN ({});', merged))
+            newtracks = dict(self._query('SELECT taxid, track FROM species WHERE taxid IN ({});', set(merged.values())))
+            for taxid_old, taxid_new in merged.items():
+                if taxid_new in newtracks:
+                    tracks[taxid_old] = newtracks[taxid_new]
+        newlineages = {}
+        for taxid, track in tracks.items():
+            lineage = [int(ltaxid) for ltaxid in reversed(track.split(','))]
+            self.lineages.put(taxid, lineage)
+            newlineages[taxid] = lineage
+        self._store('lineages', newlineages)
+        lineages.update(newlineages)
+        nodes = set()
+        for lineage in lineages.values():
+            nodes.update(lineage)
+        nodes = [node for node in nodes if node not in self.names or node not in self.ranks]
+        names = self._load('names', self.names, nodes)
+        ranks = self._load('ranks', self.ranks, nodes)
+        nodes = [node for node in nodes if node not in names or node not in ranks]
+        names, ranks = {}, {}
+        for taxid, spname, rank in self._query('SELECT taxid, spname, rank FROM species WHERE taxid IN ({});', nodes):
+            names[taxid] = spname
+            ranks[taxid] = rank
+        for node in nodes:
+            self.names.put(node, names.get(node))
+            self.ranks.put(node, ranks.get(node))
+        self._store('names', names)
+        self._store('ranks', ranks)
+
+    def get_lineage_table(self, taxids, desired_ranks):
+        """Get the names of the desired ranks in the lineages of many taxids.
+
+        Arguments:
+            taxids: List of taxonomy IDs.
+            desired_ranks: The desired ranks to find in the lineages.
+
+        Returns:
+            Dictionary with taxid and a dictionary with rank and name
+            for the desired ranks that are present in the lineage.
+        """
+        taxids = [int(taxid) for taxid in taxids]
+        self.resolve_lineages(taxids)
+        table = {}
+        for taxid in taxids:
+            try:
+                lineage = self.get_lineage(taxid)
+            except ValueError:
+                table[taxid] = {}
+                continue
+            ranks = self.get_ranks(lineage)
+            names = self.get_names(lineage)
+            rank_names = {}
+            for ltaxid in lineage:
+                rank = ranks.get(ltaxid)
+                if rank in desired_ranks and ltaxid in names:
+                    rank_names[rank] = str(names[ltaxid])
+            table[taxid] = rank_names
+        return table
+
+    def cache_info(self):
+        """Get the hits, misses, hit rate and size of all caches.
+
+        Returns:
+            Dictionary with cache name and a dictionary with hits, misses, hit rate and size.
+        """
+        caches = [('names', self.names), ('ranks', self.ranks), ('lineages', self.lineages)]
+        if self.annotations is not None:
+            caches.append(('annotations', self.annotations))
+        return dict((name, {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache),
+                            'hit_rate': round(cache.hits / float(cache.hits + cache.misses), 4)
+                            if cache.hits + cache.misses else None})
+                    for name, cache in caches)
+
+    def print_cache_info(self):
+        """Print the number of cache hits and misses."""
+        print("Taxonomy database queries: " + str(self.queries))
+        for name, info in sorted(self.cache_info().items()):
+            print("Taxonomy " + name + " cache: " + str(info['hits']) + " hits, " +
+                  str(info['misses']) + " misses, " + str(info['size']) + " entries")
@@ -0,0 +1,95 @@
+import os
+import sys
+import bz2
+import gzip
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compressed  # noqa: E402
+from compressed import DecompressedStream, csv_name, get_decompressor, is_csv_file, open_csv  # noqa: E402
+from layouts import QC_LAYOUT, read_layout  # noqa: E402
+
+TEXT = "filename,read_id,barcode,runid,a,b,seqlen,mean_qscore\n" + "".join(
+    "f,read_{},BC{:02d},r,x,y,{},8.5\n".format(number, number % 12 + 1, 1400 + number % 300)
+    for number in range(5000))
+
+
+def write_compressed(filename, text):
+    data = text.encode('utf-8')
+    if filename.endswith('.gz'):
+        # Two gzip members, like files that are appended to with gzip.
+        with open(filename, 'wb') as f:
+            f.write(gzip.compress(data[:len(data) // 2]) + gzip.compress(data[len(data) // 2:]))
+    elif filename.endswith('.bz2'):
+        with open(filename, 'wb') as f:
+            f.write(bz2.compress(data))
+    else:
+        zstandard = pytest.importorskip("zstandard")
+        with open(filename, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(data))
+
+
+@pytest.mark.parametrize("extension", [".gz", ".bz2", ".zst"])
+def test_open_csv_reads_compressed_files(tmp_path, extension):
+    filename = str(tmp_path / ("run_1.csv" + extension))
+    write_compressed(filename, TEXT)
+    with open_csv(filename) as f:
+        assert f.read() == TEXT
+    assert read_layout(filename, [QC_LAYOUT], QC_LAYOUT).columns == QC_LAYOUT.columns
+
+
+def test_small_chunks_and_early_close(tmp_path):
+    filename = str(tmp_path / "run_1.csv.gz")
+    write_compressed(filename, TEXT)
+    stream = DecompressedStream(filename, get_decompressor(filename), chunk_size=100, queue_size=2)
+    with stream:
+        assert stream.read(10) == TEXT[:10].encode('utf-8')
+    assert stream.closed
+
+
+def test_missing_zstandard_is_an_io_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(compressed, "zstandard", None)
+    with pytest.raises(IOError):
+        get_decompressor(str(tmp_path / "run_1.csv.zst"))
+
+
+def test_csv_names():
+    assert is_csv_file("run_1.csv.gz", "_1")
+    assert not is_csv_file("run_1.csv.gz", "_2")
+    assert not is_csv_file("run_1.csv.tmp")
+    assert csv_name("run_1.csv.bz2") == "run_1.csv"
+
+
+def test_compressed_run_gives_the_same_tables(tmp_path):
+    pytest.importorskip("ete3")
+    import benchmark
+    import otu
+    from taxonomy import TaxonomyResolver
+    taxadb = str(tmp_path / "taxa.sqlite")
+    taxids = benchmark.make_taxadb(taxadb, 40)
+    folders = benchmark.make_files(str(tmp_path), "otu", 1000, 2, 4, taxids, 1)
+    otu.ncbi = otu.NCBITaxa(dbfile=taxadb)
+    otu.taxonomy = TaxonomyResolver(otu.ncbi)
+    otu.progress = False
+    paths = []
+    for kind in ("classification", "qc"):
+        folder = tmp_path / (kind + "_gz")
+        folder.mkdir()
+        for name in sorted(os.listdir(folders[kind])):
+            with open(os.path.join(folders[kind], name), 'rb') as source:
+                with gzip.open(str(folder / (name + ".gz")), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+        paths.append(str(folder))
+    plain = tmp_path / "plain"
+    packed = tmp_path / "packed"
+    plain.mkdir()
+    packed.mkdir()
+    barcodes = ["BC01", "BC02", "BC03", "BC04"]
+    otu.build_otu_table((folders["classification"], folders["qc"]), (7, 80), barcodes, output_dir=str(plain))
+    otu.build_otu_table(tuple(paths), (7, 80), barcodes, output_dir=str(packed))
+    for name in ("otu_count.csv", "otu_percentage.csv"):
+        with open(str(plain / name), 'rb') as f, open(str(packed / name), 'rb') as g:
+            assert f.read() == g.read()
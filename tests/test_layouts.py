@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from layouts import (CLASSIFICATION_LAYOUT, QC_LAYOUT, WIMP_LAYOUT, classification_parser,  # noqa: E402
+                     detect_layout, qc_parser)
+
+
+def test_reordered_qc_header():
+    layout = detect_layout("read_id,mean_qscore,seqlen,barcode\n", [QC_LAYOUT])
+    assert layout.columns == {'read_id': 0, 'mean_qscore': 1, 'seqlen': 2, 'barcode': 3}
+    parse_qc_line = qc_parser(layout, 7)
+    assert parse_qc_line("r1,8.5,1500,BC01\n") == ("r1", "BC01", 8.5)
+    assert parse_qc_line("r2,6.5,1500,BC01\n") == 'qscore'
+
+
+def test_reordered_classification_header():
+    header = "filename,read_id,runid,barcode,exit_status,taxid,accuracy,lca\n"
+    layout = detect_layout(header, [CLASSIFICATION_LAYOUT, WIMP_LAYOUT])
+    assert layout.name == "classification"
+    assert layout.columns == {'read_id': 1, 'barcode': 3, 'status': 4, 'taxid': 5, 'accuracy': 6, 'lca': 7}
+    parse_classification_line = classification_parser(layout, 80)
+    assert parse_classification_line("f,r1,run,BC02,Classification successful,562,91.5,0\n") == (
+        "r1", "BC02", 562, True, 91.5)
+
+
+def test_wimp_and_classification_are_told_apart_by_their_fields():
+    layouts = [WIMP_LAYOUT, CLASSIFICATION_LAYOUT]
+    assert detect_layout("readid,lca,accuracy,taxid\n", layouts).name == "wimp"
+    assert detect_layout("read_id,status,taxid,barcode,accuracy,lca\n", layouts).name == "classification"
+
+
+def test_header_without_known_names_uses_the_default():
+    assert detect_layout("a,b,c,d,e,f,g,h\n", [QC_LAYOUT], QC_LAYOUT) is QC_LAYOUT
+
+
+@pytest.mark.parametrize("header", ["read_id,barcode,seqlen\n", "filename,read_id,barc"])
+def test_incomplete_header_is_an_error(header):
+    with pytest.raises(ValueError):
+        detect_layout(header, [QC_LAYOUT], QC_LAYOUT)
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("ete3")
+
+import benchmark  # noqa: E402
+import otu  # noqa: E402
+from taxonomy import TaxonomyResolver  # noqa: E402
+
+
+@pytest.fixture
+def run_paths(tmp_path):
+    """Synthetic QC and classification files of three runs and a taxonomy database."""
+    taxadb = str(tmp_path / "taxa.sqlite")
+    taxids = benchmark.make_taxadb(taxadb, 40)
+    folders = benchmark.make_files(str(tmp_path), "otu", 2000, 3, 4, taxids, 1)
+    otu.ncbi = otu.NCBITaxa(dbfile=taxadb)
+    otu.taxonomy = TaxonomyResolver(otu.ncbi)
+    otu.progress = False
+    return folders["classification"], folders["qc"]
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_map_reduce_is_identical_to_single_run(tmp_path, run_paths):
+    barcodes = ["BC01", "BC02", "BC03", "BC04"]
+    single = tmp_path / "single"
+    merged = tmp_path / "merged"
+    single.mkdir()
+    merged.mkdir()
+    otu.build_otu_table(run_paths, (7, 80), barcodes, output_dir=str(single))
+    partial_files = []
+    for number in range(2):
+        partial_file = str(tmp_path / "part{}.otp".format(number))
+        otu.map_otu_table(run_paths, (7, 80), partial_file, barcodes, shard=(number, 2))
+        partial_files.append(partial_file)
+    otu.reduce_otu_tables(partial_files[::-1], output_dir=str(merged))
+    for name in ("otu_count.csv", "otu_percentage.csv"):
+        assert read(str(merged / name)) == read(str(single / name))
+    assert read(str(single / "otu_count.csv")).startswith(
+        b"phylum,class,order,family,genus,best (rank),run_1BC01")
+
+
+def test_reduce_rejects_different_thresholds(tmp_path, run_paths):
+    first = str(tmp_path / "q7.otp")
+    second = str(tmp_path / "q9.otp")
+    otu.map_otu_table(run_paths, (7, 80), first, shard=(0, 2))
+    otu.map_otu_table(run_paths, (9, 80), second, shard=(1, 2))
+    with pytest.raises(ValueError):
+        otu.reduce_otu_tables([first, second], output_dir=str(tmp_path))
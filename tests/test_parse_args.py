@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("ete3")
+
+import otu  # noqa: E402
+
+
+@pytest.mark.parametrize("args", [
+    ["cl", "qc", "--shard", "0/2"],
+    ["cl", "qc", "--map", "part.otp", "--sweep-qscore", "7,8"],
+    ["cl", "qc", "--map", "part.otp", "--watch", "5"],
+    ["cl", "qc", "--watch", "0"],
+    ["cl", "qc", "--sweep-accuracy", "80,90", "--columnar"],
+    ["cl", "qc", "--watch", "5", "--checkpoint", "runs.sqlite"],
+])
+def test_conflicting_options_are_rejected(args):
+    with pytest.raises(SystemExit):
+        otu.parse_args(args)
+
+
+def test_map_with_shard():
+    args = otu.parse_args(["cl", "qc", "--map", "part.otp", "--shard", "1/4"])
+    assert args.shard == (1, 4)
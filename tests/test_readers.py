@@ -0,0 +1,94 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("ete3")
+pytest.importorskip("pyarrow")
+
+import columnar  # noqa: E402
+import otu  # noqa: E402
+from layouts import WIMP_LAYOUT, lca_parser, read_layout  # noqa: E402
+
+READ_IDS = ["6b1d2f7e-2c4a-4d8e-9f1a-3e5c7b9d0a%02d" % number for number in range(8)]
+QC_LINES = [
+    "filename,read_id,barcode,runid,a,b,seqlen,mean_qscore",
+    "f,{},BC01,r,x,y,1500,8.5".format(READ_IDS[0]),
+    "f,{},BC01,r,,y,1500,8.5".format(READ_IDS[1]),
+    ",{},BC02,r,x,y,1500,9.5".format(READ_IDS[2]),
+    "f,{},BC02,r,x,y,1500,".format(READ_IDS[3]),
+    "f,{},NA,r,,y,1500,8.5".format(READ_IDS[4]),
+    "f,,BC01,r,x,y,1500,8.5",
+    "f,{},BC02,r,x,y,1300,9.5".format(READ_IDS[5]),
+    "f,{},BC02,r,x,y,1600,6.5".format(READ_IDS[6]),
+    "f,{},BC02,r,x,y,1600,7.5".format(READ_IDS[7])]
+CLASSIFICATION_LINES = [
+    "filename,readid,status,name,taxid,barcode,accuracy,lca",
+    "f,{},Classification successful,n,562,BC01,90.5,0".format(READ_IDS[0]),
+    "f,{},Classification successful,,562,BC01,90.5,0".format(READ_IDS[1]),
+    "f,{},Classification successful,n,561,BC02,90.5,".format(READ_IDS[7]),
+    "f,{},,n,563,BC02,85.5,0".format(READ_IDS[7]),
+    "f,{},Classification successful,n,,BC02,90.5,0".format(READ_IDS[7]),
+    "f,{},Classification successful,n,,NA,90.5,0".format(READ_IDS[7]),
+    "f,{},Classification successful,n,562,BC02,,0".format(READ_IDS[7]),
+    "f,{},Classification successful,n,,BC02,70.5,0".format(READ_IDS[7]),
+    "f,,Classification successful,n,562,BC02,90.5,0",
+    "f,{},Classification successful,n,562,,90.5,0".format(READ_IDS[0])]
+WIMP_LINES = [
+    "filename,readid,taxid,accuracy,a,b,c,d,lca",
+    "f,r1,562,90.5,x,y,z,w,1",
+    "f,r2,562,90.5,x,,z,w,1",
+    ",r3,563,90.5,x,y,z,w,2",
+    "f,r4,563,90.5,x,y,z,w,",
+    "f,r5,563,70.5,x,y,z,w,2",
+    "f,r6,564,85.5,x,y,z,w,2"]
+
+
+def write_csv(filename, lines):
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def run_paths(tmp_path):
+    """A QC and a classification file with empty fields."""
+    qc = tmp_path / "qc"
+    cl = tmp_path / "cl"
+    qc.mkdir()
+    cl.mkdir()
+    write_csv(str(qc / "run_1.csv"), QC_LINES)
+    write_csv(str(cl / "run_1.csv"), CLASSIFICATION_LINES)
+    otu.progress = False
+    return str(cl), str(qc)
+
+
+def read_run(run_paths, use_columnar):
+    otu.configure(run_paths, (7, 80), ["BC01", "BC02"], use_columnar=use_columnar)
+    read_ids, barcode_counter, qc_stats = otu.filter_qc_file("run_1.csv")
+    otu.ok_read_ids = read_ids
+    barcodecounts, species, stats = otu.scan_classification_file("run_1.csv")
+    return ([read_id for read_id in READ_IDS if read_id in read_ids], barcode_counter, qc_stats,
+            barcodecounts, species, stats)
+
+
+def test_line_and_columnar_readers_skip_the_same_rows(run_paths):
+    line = read_run(run_paths, False)
+    assert line[0] == [READ_IDS[0], READ_IDS[7]]
+    assert line[2] == Counter(rows=9, parse=5, seqlen=1, qscore=1)
+    assert read_run(run_paths, True) == line
+
+
+def test_line_and_columnar_readers_count_the_same_taxa(tmp_path):
+    filename = str(tmp_path / "wimp.csv")
+    write_csv(filename, WIMP_LINES)
+    layout = read_layout(filename, [WIMP_LAYOUT])
+    parse_lca_line = lca_parser(layout)
+    taxcounter = Counter()
+    for line in WIMP_LINES[1:]:
+        key = parse_lca_line(line)
+        if key is not None:
+            taxcounter[key] += 1
+    assert taxcounter == Counter({(562, '1'): 1, (564, '2'): 1})
+    assert columnar.count_taxa(filename, layout) == taxcounter
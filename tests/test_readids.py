@@ -0,0 +1,51 @@
+import os
+import sys
+import uuid
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import readids  # noqa: E402
+from readids import ReadIdLevels, ReadIdSet  # noqa: E402
+
+
+def make_read_ids(count, seed=1):
+    rng = random.Random(seed)
+    return [str(uuid.UUID(int=rng.getrandbits(128))) for dummy in range(count)]
+
+
+def test_read_id_set_membership():
+    read_ids = make_read_ids(2000)
+    # Read IDs with the same upper 64 bits and read IDs that are not UUIDs.
+    read_ids += [read_ids[0][:19] + "0000-00000000000%d" % number for number in range(3)]
+    read_ids += ["read_1", "read_2"]
+    members = ReadIdSet()
+    members.update(read_ids[:1000])
+    for read_id in read_ids[1000:]:
+        members.add(read_id)
+    members.update(read_ids[:10])
+    assert len(members) == len(read_ids)
+    assert all(read_id in members for read_id in read_ids)
+    assert not any(read_id in members for read_id in make_read_ids(200, seed=2) + ["read_3"])
+
+
+def test_sort_order_sorts_equal_upper_bits():
+    np = pytest.importorskip("numpy")
+    hi = np.array([5, 3, 5, 1, 5, 3], dtype=np.uint64)
+    lo = np.array([9, 2, 1, 7, 4, 0], dtype=np.uint64)
+    order = readids.sort_order(hi, lo)
+    assert list(zip(hi[order], lo[order])) == sorted(zip(hi, lo))
+
+
+def test_read_id_levels_merge_geometrically():
+    read_ids = make_read_ids(3000)
+    levels = ReadIdLevels()
+    for start in range(0, len(read_ids), 100):
+        levels.add_batch(read_ids[start:start + 100])
+    sizes = [len(level) for level in levels.levels]
+    assert sum(sizes) == len(read_ids)
+    assert all(larger > 2 * smaller for larger, smaller in zip(sizes, sizes[1:]))
+    assert all(read_id in levels for read_id in read_ids)
+    assert not any(read_id in levels for read_id in make_read_ids(200, seed=2))
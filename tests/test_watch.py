@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("ete3")
+
+import otu  # noqa: E402
+
+QC_HEADER = "filename,read_id,barcode,runid,a,b,seqlen,mean_qscore\n"
+CLASSIFICATION_HEADER = "filename,read_id,status,name,taxid,barcode,accuracy,lca\n"
+READ_IDS = ["0d0c5f8e-6a4f-4c1e-9a35-6b8f3c2a1d%02d" % number for number in range(4)]
+
+
+def append(filename, text):
+    with open(filename, 'a') as f:
+        f.write(text)
+
+
+def test_watch_waits_for_a_complete_header(tmp_path):
+    qc = tmp_path / "qc"
+    cl = tmp_path / "cl"
+    qc.mkdir()
+    cl.mkdir()
+    qcfile = str(qc / "run_1.csv")
+    csv = str(cl / "run_1.csv")
+    otu.configure((str(cl), str(qc)), (7, 80), ["BC01"], output_dir=str(tmp_path))
+    watcher = otu.RunWatcher()
+    append(qcfile, QC_HEADER[:20])
+    append(csv, CLASSIFICATION_HEADER[:25])
+    assert watcher.refresh() == 0
+    append(qcfile, QC_HEADER[20:])
+    append(csv, CLASSIFICATION_HEADER[25:])
+    for number, read_id in enumerate(READ_IDS):
+        append(qcfile, "f,{},BC01,r,x,y,1500,{}\n".format(read_id, 6.5 if number == 3 else 8.5))
+        append(csv, "f,{},Classification successful,n,{},BC01,90.5,0\n".format(read_id, 562 + number % 2))
+    assert watcher.refresh() == 8
+    [(name, (barcodecounts, species, stats))] = watcher.results()
+    assert name == "run_1.csv"
+    assert barcodecounts["BC01"] == {562: 2, 563: 1}
+    assert stats['qc'] == 1